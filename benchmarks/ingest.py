@@ -0,0 +1,356 @@
+"""
+    End-to-end ingest benchmark: drives the falcon app in process with recorded provider
+    payloads and reports throughput, push latency and the latency of every pipeline stage.
+
+    The dataproxy runs in a temporary working directory with its own configuration, incidents
+    are delivered to a local stub witness and stored in an in-memory (or mongomock) incident
+    storage, thus results only depend on the code and are comparable between commits.
+
+    Usage (from the repository root):
+
+        python -m benchmarks.ingest --pushes 200 --output ingest.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import platform
+import threading
+import subprocess
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+CONFIG = """
+dump_folder: dump
+logs:
+    level: {log_level}
+subscriptions:
+    mask_providers: benchmark
+    delay_to_next_witness_in_seconds: 0
+    delay_before_initial_sending_in_seconds:
+        create: 0
+        in_progress: 0
+        finish: 0
+        result: 0
+    retry_on_error:
+        delay: 0
+        number: 0
+    witnesses:
+        - url: {witness}
+          group: benchmark
+          name: stub
+providers:
+    bench_json:
+        name: bench_json
+        processor:
+            type: generic
+            response: RECEIVED_OK
+    bench_xml:
+        name: bench_xml
+        module: benchmarks.ingest_payloads
+        processor:
+            type: pushed
+            response: RECEIVED_OK
+"""
+
+# scenario -> provider route receiving it
+SCENARIOS = {
+    "multipart-json": "bench_json",
+    "multipart-xml": "bench_xml",
+    "urlencoded": "bench_json",
+    "json": "bench_json",
+}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubWitness(BaseHTTPRequestHandler):
+    """ Accepts every incident like a witness would """
+
+    received = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with StubWitness.lock:
+            StubWitness.received += 1
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InMemoryIncidentStorage(object):
+    """ The part of the bos_incidents storage the push path uses """
+
+    def __init__(self):
+        from bos_incidents.exceptions import DuplicateIncidentException
+        self._duplicate_exception = DuplicateIncidentException
+        self._incidents = {}
+        self._lock = threading.Lock()
+
+    def insert_incident(self, incident):
+        key = incident["unique_string"] + incident["provider_info"]["name"]
+        with self._lock:
+            if key in self._incidents:
+                raise self._duplicate_exception(key)
+            self._incidents[key] = incident
+        incident["_id"] = key
+
+
+def _git_revision():
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPOSITORY, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=REPOSITORY, stderr=subprocess.DEVNULL) != 0
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb():
+    # kilobytes on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100.0 * (len(values) - 1))))]
+
+
+def _histogram_state(histogram, label_filter=None):
+    """ Sums the bucket counts of all children of the histogram matching label_filter """
+    counts = [0] * (len(histogram.upper_bounds) + 1)
+    total = 0.0
+    count = 0
+    for label_values, child in histogram.children():
+        if label_filter is not None and not label_filter(label_values):
+            continue
+        child_counts, child_total, child_count = child.get()
+        counts = [a + b for a, b in zip(counts, child_counts)]
+        total += child_total
+        count += child_count
+    return counts, total, count
+
+
+def _histogram_quantile(upper_bounds, counts, quantile):
+    """ Estimates the quantile by linear interpolation within the bucket, like Prometheus does """
+    count = sum(counts)
+    if count == 0:
+        return None
+    rank = quantile * count
+    cumulative = 0
+    lower = 0.0
+    for upper, bucket_count in zip(list(upper_bounds) + [upper_bounds[-1]], counts):
+        if cumulative + bucket_count >= rank and bucket_count > 0:
+            return lower + (upper - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+        lower = upper
+    return upper_bounds[-1]
+
+
+def _stage_report(histogram, before, after):
+    counts = [b - a for a, b in zip(before[0], after[0])]
+    count = after[2] - before[2]
+    if count == 0:
+        return {"count": 0}
+    return {
+        "count": count,
+        "mean_ms": round((after[1] - before[1]) / count * 1000, 3),
+        "p50_ms": round(_histogram_quantile(histogram.upper_bounds, counts, 0.5) * 1000, 3),
+        "p99_ms": round(_histogram_quantile(histogram.upper_bounds, counts, 0.99) * 1000, 3),
+    }
+
+
+def _stages(provider):
+    from dataproxy import metrics
+
+    return {
+        "parse": (metrics.PARSE_LATENCY, lambda labels: labels == (provider, )),
+        "prepare_for_dump": (metrics.PREPARE_FOR_DUMP_LATENCY, None),
+        "store_raw": (metrics.STORE_WRITE_LATENCY, lambda labels: labels == ("RawStore", )),
+        "store_processed": (metrics.STORE_WRITE_LATENCY, lambda labels: labels == ("ProcessedFileStore", )),
+        "store_incident": (metrics.STORE_WRITE_LATENCY, lambda labels: labels == ("IncidentFileStore", )),
+        "insert": (metrics.MONGO_INSERT_LATENCY, None),
+        "deliver": (metrics.WITNESS_POST_LATENCY, None),
+    }
+
+
+def _counter_value(counter, labels):
+    child = dict(counter.children()).get(labels, None)
+    return child.get() if child is not None else 0
+
+
+def _wait_for_deliveries(timeout):
+    from dataproxy import metrics
+
+    deadline = time.monotonic() + timeout
+    while metrics.DELIVERY_QUEUE_DEPTH.labels().get() > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _post(app, path, body, content_type):
+    """ Calls the wsgi app directly, the test client of falcon adds the wsgiref validator which
+        rejects the unbounded stream reads of PushReceiver """
+    import falcon.testing
+
+    environ = falcon.testing.create_environ(path=path,
+                                            method="POST",
+                                            body=body,
+                                            headers={"Content-Type": content_type},
+                                            remote_addr="127.0.0.1")
+    start_response = falcon.testing.StartResponseMock()
+    for unused in app(environ, start_response):
+        pass
+    return start_response.status
+
+
+def run_scenario(app, name, provider, incidents, pushes, unique, offset):
+    from dataproxy import metrics
+    from . import ingest_payloads
+
+    stages = _stages(provider)
+    before = {stage: _histogram_state(histogram, label_filter) for stage, (histogram, label_filter) in stages.items()}
+    found_before = _counter_value(metrics.INCIDENTS, (provider, "found"))
+    new_before = _counter_value(metrics.INCIDENTS, (provider, "new"))
+    received_before = StubWitness.received
+
+    bodies = []
+    for index in range(pushes):
+        incident = incidents[index % len(incidents)]
+        if unique:
+            incident = ingest_payloads.make_unique(incident, offset + index)
+        bodies.append(ingest_payloads.ENCODINGS[name](incident))
+
+    latencies = []
+    failed = 0
+    started = time.perf_counter()
+    for body, content_type in bodies:
+        push_started = time.perf_counter()
+        status = _post(app, "/push/" + provider, body, content_type)
+        latencies.append(time.perf_counter() - push_started)
+        if not status.startswith("200"):
+            failed += 1
+    duration = time.perf_counter() - started
+    _wait_for_deliveries(60)
+    delivered_duration = time.perf_counter() - started
+
+    after = {stage: _histogram_state(histogram, label_filter) for stage, (histogram, label_filter) in stages.items()}
+    found = _counter_value(metrics.INCIDENTS, (provider, "found")) - found_before
+    new = _counter_value(metrics.INCIDENTS, (provider, "new")) - new_before
+
+    return {
+        "provider": provider,
+        "pushes": pushes,
+        "failed_pushes": failed,
+        "duration_s": round(duration, 3),
+        "pushes_per_s": round(pushes / duration, 1),
+        "incidents_found": found,
+        "incidents_new": new,
+        "incidents_per_s": round(found / duration, 1),
+        "witness_posts": StubWitness.received - received_before,
+        "witness_posts_per_s": round((StubWitness.received - received_before) / delivered_duration, 1),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+        },
+        "stages": {stage: _stage_report(stages[stage][0], before[stage], after[stage]) for stage in stages},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingest benchmark of the dataproxy")
+    parser.add_argument("--pushes", type=int, default=200, help="pushes per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="pushes before measuring, not reported")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS.keys()), help="comma separated, default all of " + ", ".join(SCENARIOS.keys()))
+    parser.add_argument("--duplicates", action="store_true", help="push the recorded incidents as they are, i.e. mostly duplicates")
+    parser.add_argument("--storage", choices=["memory", "mongomock"], default="memory")
+    parser.add_argument("--payloads", default=None, help="folder with recorded incidents (json), defaults to the test sample data")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default=None, help="also write the json report to this file")
+    parser.add_argument("--keep-files", action="store_true", help="keep the temporary dump folder for inspection")
+    args = parser.parse_args()
+
+    witness = _ThreadingHTTPServer(("127.0.0.1", 0), StubWitness)
+    threading.Thread(target=witness.serve_forever, daemon=True).start()
+
+    output = os.path.abspath(args.output) if args.output else None
+    working_directory = tempfile.mkdtemp(prefix="dataproxy-benchmark-")
+    with open(os.path.join(working_directory, "config-dataproxy.yaml"), "w") as file:
+        file.write(CONFIG.format(log_level=args.log_level,
+                                 witness="http://127.0.0.1:" + str(witness.server_address[1])))
+    if REPOSITORY not in sys.path:
+        sys.path.insert(0, REPOSITORY)
+    os.chdir(working_directory)
+
+    # the incident storage is created on import of dataproxy.implementations
+    from bos_incidents import factory
+    if args.storage == "memory":
+        storage = InMemoryIncidentStorage()
+    else:
+        import mongomock
+        from bos_incidents import mongodb_storage
+        mongodb_storage.MongoClient = mongomock.MongoClient
+        storage = factory.get_incident_storage("mongodbtest", purge=True)
+    factory.get_incident_storage = lambda *args, **kwargs: storage
+
+    from dataproxy.app import create_app
+    from dataproxy.stores import RawStore, ProcessedFileStore, IncidentFileStore
+    from . import ingest_payloads
+
+    app = create_app(RawStore(), ProcessedFileStore(), IncidentFileStore())
+    if args.payloads:
+        incidents = ingest_payloads.load_incidents(args.payloads)
+    else:
+        incidents = ingest_payloads.load_incidents()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error("Unknown scenario " + name)
+
+    # warm up caches (bookiesports, json schema) with pushes that are not reported
+    offset = 0
+    for name in scenarios:
+        run_scenario(app, name, SCENARIOS[name], incidents, args.warmup, not args.duplicates, offset)
+        offset += args.warmup
+
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "scenarios": {}
+    }
+    for name in scenarios:
+        report["scenarios"][name] = run_scenario(app, name, SCENARIOS[name], incidents, args.pushes, not args.duplicates, offset)
+        offset += args.pushes
+
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.keep_files:
+        print("Dump folder kept in " + working_directory, file=sys.stderr)
+    else:
+        os.chdir(REPOSITORY)
+        shutil.rmtree(working_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
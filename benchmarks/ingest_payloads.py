@@ -0,0 +1,105 @@
+"""
+    Recorded provider payloads for the ingest benchmark, encoded the way providers push them,
+    and a minimal XML processor such that XML pushes are processed end to end.
+"""
+import io
+import os
+import json
+import uuid
+import glob
+import urllib.parse
+from datetime import timedelta
+from xml.etree import ElementTree
+
+from dataproxy.processors import GenericProcessor
+from dataproxy.datestring import string_to_date, date_to_string
+
+
+DEFAULT_PAYLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                      "tests", "dump", "sampledata", "incidents")
+
+
+def load_incidents(folder=DEFAULT_PAYLOAD_FOLDER):
+    """ Loads the recorded incidents, without the fields the dataproxy adds itself """
+    incidents = []
+    for file_name in sorted(glob.glob(os.path.join(folder, "*.json"))):
+        with io.open(file_name, encoding="utf-8") as file:
+            incident = json.load(file)
+        for key in ["_id", "unique_string", "timestamp"]:
+            incident.pop(key, None)
+        incident["provider_info"].pop("source_file", None)
+        incidents.append(incident)
+    if not incidents:
+        raise Exception("No recorded incidents found in " + folder)
+    return incidents
+
+
+def make_unique(incident, index):
+    """ Shifts the start time, such that every push contains a new incident """
+    incident = json.loads(json.dumps(incident))
+    start_time = string_to_date(incident["id"]["start_time"]) + timedelta(minutes=index)
+    incident["id"]["start_time"] = date_to_string(start_time)
+    return incident
+
+
+def _to_element(tag, value):
+    element = ElementTree.Element(tag)
+    if isinstance(value, dict):
+        for key, child in value.items():
+            element.append(_to_element(key, child))
+    else:
+        element.text = json.dumps(value)
+    return element
+
+
+def _from_element(element):
+    if len(element) == 0:
+        return json.loads(element.text)
+    return {child.tag: _from_element(child) for child in element}
+
+
+def to_xml(incident):
+    return ElementTree.tostring(_to_element("incident", incident), encoding="unicode")
+
+
+def multipart(field, content):
+    """ :returns: (body, content type) of a multipart/form-data push with one file field """
+    boundary = uuid.uuid4().hex
+    body = ("--" + boundary + "\r\n" +
+            "Content-Disposition: form-data; name=\"" + field + "\"; filename=\"push." + field + "\"\r\n" +
+            "Content-Type: application/" + field + "\r\n\r\n" +
+            content + "\r\n" +
+            "--" + boundary + "--\r\n")
+    return body, "multipart/form-data; boundary=" + boundary
+
+
+def urlencoded(content):
+    return "json=" + urllib.parse.quote(content), "application/x-www-form-urlencoded"
+
+
+def application_json(content):
+    return content, "application/json"
+
+
+ENCODINGS = {
+    "multipart-json": lambda incident: multipart("json", json.dumps(incident)),
+    "multipart-xml": lambda incident: multipart("xml", to_xml(incident)),
+    "urlencoded": lambda incident: urlencoded(json.dumps(incident)),
+    "json": lambda incident: application_json(json.dumps(incident)),
+}
+
+
+class Processor(GenericProcessor):
+    """ Reads incidents in the XML format of :func:`to_xml` """
+
+    def __init__(self):
+        super(Processor, self).__init__(file_ending=".xml")
+
+    def _process_source(self, source, source_type):
+        if source_type == "file":
+            with io.open(source, encoding="utf-8") as file:
+                source = file.read()
+        return _from_element(ElementTree.fromstring(source))
+
+    def _incident_of_interest(self, incident):
+        return True
@@ -0,0 +1,61 @@
+"""
+    Compares rejecting large uninteresting radish pushes the former way (decode, then
+    source_of_interest on the text) with the pre-filter on the raw bytes
+    (raw_source_of_interest), in time and allocated memory per push.
+
+    Usage (from the repository root): python -m benchmarks.interest
+"""
+import json
+import time
+import argparse
+import tracemalloc
+import urllib.parse
+
+from dataproxy import utils
+from dataproxy.provider.modules.radish import Processor
+
+
+def uninteresting_payload(megabytes):
+    """ Json of roughly the given size that has all keys but no results """
+    entry = {"id": 1, "sport_id": 1, "league": {"name": "league"}, "home": {"name": "home"}, "away": {"name": "away"}}
+    entries = [dict(entry, id=index) for index in range(int(megabytes * 1024 * 1024 / len(json.dumps(entry))))]
+    return json.dumps({"success": 1, "pager": {"total": len(entries)}, "odds": entries}).encode("utf-8")
+
+
+def legacy_source_of_interest(processor, raw_content):
+    return processor.source_of_interest(utils.save_string(raw_content))
+
+
+def _measure(method, processor, raw_content, repeat):
+    assert not method(processor, raw_content)
+    tracemalloc.start()
+    method(processor, raw_content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for unused in range(repeat):
+        method(processor, raw_content)
+    return (time.perf_counter() - started) / repeat * 1000, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megabytes", default="1,10", help="comma separated payload sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    processor = Processor()
+    print("{0:<34}{1:>22}{2:>22}".format("", "decode + str check", "raw bytes check"))
+    for megabytes in [float(size) for size in args.megabytes.split(",")]:
+        payload = uninteresting_payload(megabytes)
+        # as pushed (multipart or application/json) and as unquoted form body, see PushReceiver._unquote_form
+        unquoted = memoryview(urllib.parse.unquote_to_bytes("json=" + urllib.parse.quote(payload)))[5:]
+        for name, raw_content in [("bytes", payload), ("unquoted form (memoryview)", unquoted)]:
+            results = [_measure(method, processor, raw_content, args.repeat)
+                       for method in [legacy_source_of_interest, lambda processor, raw: processor.raw_source_of_interest(raw)]]
+            print("{0:<34}{1:>10.2f} ms {2:>6.1f} MB{3:>10.2f} ms {4:>6.1f} MB".format(
+                "{0:.0f} MB, {1}".format(megabytes, name), results[0][0], results[0][1], results[1][0], results[1][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+    Compares the former EVENTS_HISTORY dict of the radish provider with the SeenSet
+    at 100k remembered incidents.
+
+    Usage (from the repository root): python -m benchmarks.seen_set
+"""
+import time
+import argparse
+
+from dataproxy.cache import SeenSet
+
+
+def legacy_check_and_add(history, giid, capacity):
+    # former radish.Processor._incident_of_interest with a configurable cap
+    found = giid in history
+    if not found:
+        keys = list(history.keys())
+        if len(keys) > capacity:
+            history.pop(keys[0])
+        history[giid] = True
+    return found
+
+
+def _measure(method, keys):
+    started = time.perf_counter()
+    for key in keys:
+        method(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--operations", type=int, default=2000)
+    args = parser.parse_args()
+
+    prefill = ["incident-" + str(i) for i in range(args.entries)]
+    new_keys = ["new-incident-" + str(i) for i in range(args.operations)]
+    known_keys = prefill[-args.operations:]
+
+    legacy = {}
+    for key in prefill:
+        legacy[key] = True
+    seen_set = SeenSet(capacity=args.entries)
+    for key in prefill:
+        seen_set.check_and_add(key)
+
+    print("{0} remembered entries, {1} operations each".format(args.entries, args.operations))
+    print("{0:<28}{1:>16}{2:>16}".format("", "legacy dict", "SeenSet"))
+    print("{0:<28}{1:>13.2f} us{2:>13.2f} us".format(
+        "lookup of known incident",
+        _measure(lambda key: legacy_check_and_add(legacy, key, args.entries), known_keys),
+        _measure(seen_set.check_and_add, known_keys)))
+    print("{0:<28}{1:>13.2f} us{2:>13.2f} us".format(
+        "new incident (evicting)",
+        _measure(lambda key: legacy_check_and_add(legacy, key, args.entries), new_keys),
+        _measure(seen_set.check_and_add, new_keys)))
+
+
+if __name__ == "__main__":
+    main()
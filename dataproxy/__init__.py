@@ -2,9 +2,12 @@ import os
 import yaml
 import io
 from copy import deepcopy
+import atexit
 import logging
+import threading
 import collections
-from logging.handlers import TimedRotatingFileHandler
+from queue import Queue
+from logging.handlers import TimedRotatingFileHandler, QueueListener
 
 from bookiesports.normalize import IncidentsNormalizer
 
@@ -21,6 +24,112 @@ def get_version():
 __VERSION__ = get_version()
 
 
+_MISSING = object()
+
+
+def _read_only(*args, **kwargs):
+    raise TypeError("The configuration is read-only, change a copy of it and use Config.swap")
+
+
+class FrozenDict(dict):
+    """ Read-only dict of a :class:`ConfigSnapshot`, copies of it are plain dicts """
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: deepcopy(value, memo) for key, value in self.items()}
+
+
+class FrozenList(list):
+    """ Read-only list of a :class:`ConfigSnapshot`, copies of it are plain lists """
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [deepcopy(value, memo) for value in self]
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(_freeze(item) for item in value)
+    return value
+
+
+class ConfigSnapshot(object):
+    """ Frozen copy of the configuration with every nested key path flattened into
+        one dictionary, such that a lookup is a single dict access. Nested dicts and lists
+        are read-only (see :class:`FrozenDict`), thus values returned by :meth:`Config.get`
+        can not change the configuration.
+
+        Entries with value None are treated as not configured, like in :meth:`Config.get`.
+    """
+
+    __slots__ = ("data", "source", "revision", "_values", "_resolved", "_misses")
+
+    # upper bound of memoized (key path, default) combinations
+    MAX_RESOLVED = 10000
+
+    def __init__(self, data, source, revision):
+        self.data = _freeze(data) if data is not None else FrozenDict()
+        self.source = source
+        self.revision = revision
+        self._values = {}
+        self._resolved = {}
+        self._misses = set()
+        self._flatten(self.data, ())
+
+    def _flatten(self, nested, path):
+        for key, value in nested.items():
+            if value is None or type(key) != str:
+                continue
+            key_path = path + (key,)
+            if isinstance(value, dict):
+                self._flatten(value, key_path)
+            elif isinstance(value, list) and len(value) == 1 and value[0] is None:
+                # filter out empty lists
+                value = None
+            self._values[key_path] = value
+
+    def lookup(self, keys, resolved=False):
+        """ Returns the value for the key path, or _MISSING. With resolved, keys may end
+            with a default value that has been memoized before
+        """
+        try:
+            value = self._values.get(keys, _MISSING)
+            if value is _MISSING and resolved:
+                # the type is part of the key, True and 1 must not share an entry
+                value = self._resolved.get((type(keys[-1]), keys), _MISSING)
+            return value
+        except TypeError:
+            # unhashable key or default
+            return _MISSING
+
+    def memoize(self, keys, value):
+        """ Remembers the result of a lookup whose last key is its default value """
+        if len(self._resolved) < ConfigSnapshot.MAX_RESOLVED:
+            try:
+                self._resolved[(type(keys[-1]), keys)] = value
+            except TypeError:
+                pass
+
+    def first_miss(self, keys):
+        """ Returns True the first time keys is reported missing for this snapshot """
+        if keys in self._misses:
+            return False
+        self._misses.add(keys)
+        return True
+
+
 class Config(dict):
     """ This class allows us to load the configuration from a YAML encoded
         configuration file.
@@ -31,6 +140,12 @@ class Config(dict):
 
     data = None
     source = None
+    # absolute paths of all loaded files in load order, re-read by reload
+    files = []
+    _snapshot = None
+    _reload_lock = threading.Lock()
+    # increased whenever the configuration changes, allows derived lookups to detect stale state
+    revision = 0
 
     @staticmethod
     def load(config_files=[], relative_location=False):
@@ -39,11 +154,10 @@ class Config(dict):
             :param str file_name: (defaults to 'config.yaml') File name and
                 path to load config from
         """
-        if not Config.data:
-            Config.data = {}
-
         if not config_files:
             raise Exception("Trying to load config without target files")
+        # the current data may be the one of the active snapshot, which must not change
+        data = deepcopy(Config.data) if Config.data else {}
         if type(config_files) == str:
             config_files = [config_files]
 
@@ -57,18 +171,26 @@ class Config(dict):
                 )
             stream = io.open(file_path, 'r', encoding='utf-8')
             with stream:
-                Config.data = Config._nested_update(Config.data, yaml.load(stream))
+                data = Config._nested_update(data, yaml.load(stream))
+            file_path = os.path.abspath(file_path)
+            if file_path not in Config.files:
+                Config.files.append(file_path)
 
+        Config.data = data
         Config.source = ";".join(config_files)
+        Config.revision += 1
 
     @staticmethod
-    def get_config(config_name=None):
+    def get_config(config_name=None, copy=True):
         """ Static method that returns the configuration as dictionary.
             Usage:
 
             .. code-block:: python
 
                 Config.get_config()
+
+            With copy=False the shared dictionary of the current snapshot is returned,
+            which must not be modified.
         """
         if not config_name:
             if not Config.data:
@@ -77,8 +199,69 @@ class Config(dict):
             if not Config.data:
                 Config.data = {}
             Config.load(config_name)
+        if not copy:
+            return Config.snapshot().data
         return deepcopy(Config.data)
 
+    @staticmethod
+    def snapshot():
+        """ Returns the current :class:`ConfigSnapshot`, rebuilds it if the configuration
+            has changed since it was taken
+        """
+        snapshot = Config._snapshot
+        if snapshot is None or snapshot.revision != Config.revision:
+            snapshot = ConfigSnapshot(Config.data, Config.source, Config.revision)
+            Config._snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def swap(data, source=None):
+        """ Atomically replaces the whole configuration, readers either see the old or the new one
+
+            :param data: the new configuration
+            :type data: dict
+            :param source: description of where the configuration was loaded from
+            :type source: str
+        """
+        revision = Config.revision + 1
+        snapshot = ConfigSnapshot(data, source if source is not None else Config.source, revision)
+        Config.data = snapshot.data
+        Config.source = snapshot.source
+        Config._snapshot = snapshot
+        Config.revision = revision
+
+    @staticmethod
+    def reload():
+        """ Re-reads all loaded configuration files (and the configuration files of providers
+            that have been added since) and atomically swaps the configuration.
+
+            Lookups that are in progress finish with the old configuration, caches derived from
+            the configuration detect the change via the revision. If a file can't be read
+            the current configuration stays active and the exception is raised.
+
+            :returns: the list of files that have been read
+        """
+        with Config._reload_lock:
+            files = list(Config.files)
+            data = {}
+            for file_path in files:
+                with io.open(file_path, 'r', encoding='utf-8') as stream:
+                    data = Config._nested_update(data, yaml.load(stream))
+            for file_path in get_provider_config_files(data):
+                file_path = os.path.abspath(file_path)
+                if file_path not in files:
+                    with io.open(file_path, 'r', encoding='utf-8') as stream:
+                        data = Config._nested_update(data, yaml.load(stream))
+                    files.append(file_path)
+
+            chain_changed = data.get("bookiesports_chain", None) != Config.get("bookiesports_chain", default=None)
+            Config.files = files
+            Config.swap(data, ";".join(files))
+            if chain_changed:
+                set_normalizer_chain()
+            logging.getLogger(__name__).info("Configuration reloaded (revision %s) from %s", Config.revision, Config.source)
+            return files
+
     @staticmethod
     def get(*args, **kwargs):
         """
@@ -95,6 +278,15 @@ class Config(dict):
         :param default: default value if not found in config
         :type default: object
         """
+        snapshot = Config._snapshot
+        if snapshot is None or snapshot.revision != Config.revision:
+            snapshot = Config.snapshot()
+        # the flattened snapshot holds every nested key path, only string keys are flattened
+        # thus a trailing default value never produces a hit
+        value = snapshot.lookup(args, not kwargs)
+        if value is not _MISSING:
+            return value
+
         default_given = "default" in kwargs
         default = kwargs.pop("default", None)
         message = kwargs.pop("message", None)
@@ -104,36 +296,32 @@ class Config(dict):
                 raise KeyError("There can only be one default set. Either use default=value or add non-string values as last positioned argument!")
             default = args[len(args) - 1]
             default_given = True
-            args = args[0:len(args) - 1]
-
-        try:
-            nested = Config.data
-            for key in args:
-                if type(key) == str:
-                    nested = nested[key]
-                else:
-                    raise KeyError("The given key " + str(key) + " is not valid.")
-            if nested is None:
-                raise KeyError()
-        except KeyError:
-            lookup_key = '.'.join(str(i) for i in args)
+            key_path = args[0:len(args) - 1]
+            value = snapshot.lookup(key_path)
+            if value is _MISSING:
+                value = default
+                if snapshot.first_miss(key_path) and logging.getLogger(__name__).isEnabledFor(logging.DEBUG):
+                    logging.getLogger(__name__).debug(Config._missing_message(key_path, message, snapshot.source) + " Using given default value.")
             if not message:
-                if Config.ERRORS.get(lookup_key):
-                    message = Config.ERRORS[lookup_key]
-                else:
-                    message = "Configuration key {0} not found in {1}!"
-                message = message.format(lookup_key, Config.source)
-            if default_given:
-                logging.getLogger(__name__).debug(message + " Using given default value.")
-                return default
-            else:
-                raise KeyError(message)
+                snapshot.memoize(args, value)
+            return value
 
-        # filter out empty lists
-        if type(nested) == list and len(nested) == 1 and nested[0] is None:
-            nested = None
+        if default_given:
+            if snapshot.first_miss(args) and logging.getLogger(__name__).isEnabledFor(logging.DEBUG):
+                logging.getLogger(__name__).debug(Config._missing_message(args, message, snapshot.source) + " Using given default value.")
+            return default
+        raise KeyError(Config._missing_message(args, message, snapshot.source))
 
-        return nested
+    @staticmethod
+    def _missing_message(args, message, source):
+        lookup_key = '.'.join(str(i) for i in args)
+        if not message:
+            if Config.ERRORS.get(lookup_key):
+                message = Config.ERRORS[lookup_key]
+            else:
+                message = "Configuration key {0} not found in {1}!"
+            message = message.format(lookup_key, source)
+        return message
 
     @staticmethod
     def reset():
@@ -141,6 +329,9 @@ class Config(dict):
         """
         Config.data = None
         Config.source = None
+        Config.files = []
+        Config._snapshot = None
+        Config.revision += 1
 
     @staticmethod
     def _nested_update(d, u):
@@ -156,7 +347,27 @@ class Config(dict):
         return d
 
 
+LOG_LISTENER = None
+
+
+def _stop_log_listener():
+    global LOG_LISTENER
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
+
+
+atexit.register(_stop_log_listener)
+
+
 def set_global_logger(existing_loggers=None, config_file_name=None):
+    """ Sets up logging to file and console. With logs.async the handlers run in a
+        QueueListener thread such that logging threads never wait for disk or console I/O,
+        with logs.json every record is written as one json line including the request id.
+    """
+    global LOG_LISTENER
+    from .logs import RequestIdFilter, JsonLinesFormatter, LocalQueueHandler
+
     print("Setting up logger handling for dataproxy...")
 
     # setup logging
@@ -166,6 +377,10 @@ def set_global_logger(existing_loggers=None, config_file_name=None):
 
     os.makedirs(log_folder, exist_ok=True)
     log_format = (Config.get("logs", "format", default="%(asctime)s %(levelname) -10s %(name)s: %(message)s"))
+    if Config.get("logs", "json", default=False):
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = logging.Formatter(log_format)
     if config_file_name is None:
         config_file_name = Config.get("logs", "file", default="dataproxy.log")
     trfh = TimedRotatingFileHandler(
@@ -174,20 +389,33 @@ def set_global_logger(existing_loggers=None, config_file_name=None):
         1
     )
     trfh.suffix = "%Y-%m-%d"
-    trfh.setFormatter(logging.Formatter(log_format))
+    trfh.setFormatter(formatter)
     trfh.setLevel(log_level)
 
     # ... and to console
     sh = logging.StreamHandler()
-    sh.setFormatter(logging.Formatter(log_format))
+    sh.setFormatter(formatter)
     sh.setLevel(log_level)
 
-    # global config (e.g. for werkzeug)
+    use_handlers = [trfh, sh]
+
+    if Config.get("logs", "async", default=False):
+        # handlers are only called from the listener thread, logging calls only enqueue
+        _stop_log_listener()
+        LOG_LISTENER = QueueListener(Queue(-1), trfh, sh, respect_handler_level=True)
+        LOG_LISTENER.start()
+        queue_handler = LocalQueueHandler(LOG_LISTENER.queue)
+        queue_handler.setLevel(log_level)
+        use_handlers = [queue_handler]
+
+    for handler in use_handlers:
+        handler.addFilter(RequestIdFilter())
+
+    # global config (e.g. for werkzeug), replaces handlers of an earlier call
     logging.basicConfig(level=log_level,
                         format=log_format,
-                        handlers=[trfh, sh])
-
-    use_handlers = [trfh, sh]
+                        handlers=use_handlers,
+                        force=True)
 
     if existing_loggers is not None:
         if not type(existing_loggers) == list:
@@ -203,12 +431,21 @@ def set_global_logger(existing_loggers=None, config_file_name=None):
     return use_handlers
 
 
-def on_startup():
-    if Config.data and Config.data.get("subscribed_witnesses", None) is not None:
-        raise Exception("Please update your config.yaml to match the new format, subscribed_witnesses is outdated")
+def get_provider_config_files(data):
+    """ Returns the existing optional configuration files of all providers in data """
+    config_files = []
+    for key, provider in (data.get("providers", None) or {}).items():
+        _config_file = (provider or {}).get("config_file", None)
+        if _config_file is None:
+            _config_file = "config-" + key + ".yaml"
+        else:
+            _config_file = _config_file + ".yaml"
+        if os.path.isfile(_config_file):
+            config_files.append(_config_file)
+    return config_files
 
-    Config.get("subscriptions", "mask_providers")
 
+def set_normalizer_chain():
     try:
         IncidentsNormalizer.use_chain(Config.get("bookiesports_chain", default="beatrice"),
                                       not_found_file=os.path.join(Config.get("dump_folder"), "missing_bookiesports_entries.txt"))
@@ -217,16 +454,18 @@ def on_startup():
         IncidentsNormalizer.NOT_FOUND_FILE = os.path.join(Config.get("dump_folder"), "missing_bookiesports_entries.txt")
         logging.getLogger(__name__).debug("Incidents normalizer set for chain " + IncidentsNormalizer.DEFAULT_CHAIN + ", using " + str(IncidentsNormalizer.NOT_FOUND_FILE) + " for missing entries")
 
-    providers = list(Config.get("providers", default={}).keys())
-    for key in providers:
-        # check and load optional provider configs
-        _config_file = Config.get("providers", key).get("config_file", None)
-        if _config_file is None:
-            _config_file = "config-" + key + ".yaml"
-        else:
-            _config_file = _config_file + ".yaml"
-        if os.path.isfile(_config_file):
-            Config.load(_config_file, True)
+
+def on_startup():
+    if Config.data and Config.data.get("subscribed_witnesses", None) is not None:
+        raise Exception("Please update your config.yaml to match the new format, subscribed_witnesses is outdated")
+
+    Config.get("subscriptions", "mask_providers")
+
+    set_normalizer_chain()
+
+    # check and load optional provider configs
+    for _config_file in get_provider_config_files(Config.data):
+        Config.load(_config_file, True)
 
 
 if not Config.data:
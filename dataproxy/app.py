@@ -7,8 +7,13 @@ from .stores import RawStore, ProcessedFileStore,\
 
 from .routes.push import PushReceiver
 from .provider.json.processor import GenericJsonProcessor
+from .provider.wrapper_service import PollerScheduler
+from .archiver import Archiver
 from . import Config
+from .logs import RequestIdMiddleware
+from .profiling import ProfilingMiddleware
 import threading
+import signal
 import os
 
 
@@ -31,15 +36,26 @@ def get_push_receiver(provider_name, provider_processor, provider_success_respon
     )
 
 
+def _reload_on_signal(signum, frame):
+    # the handler interrupts the main thread, which may hold locks (e.g. of logging)
+    def reload():
+        try:
+            Config.reload()
+        except Exception as e:
+            logging.getLogger(__name__).warning("Reloading the configuration failed, keeping the current one", exc_info=e)
+    threading.Thread(name="ConfigReload", target=reload).start()
+
+
 def create_app(raw_store, processed_store, incident_store):
     """
         Creates the Falcon app and adds routes to all providers
     """
-    api = falcon.API()
+    api = falcon.API(middleware=[RequestIdMiddleware(), ProfilingMiddleware()])
 
     provider_config = Config.get("providers", default={})
 
     background_threads = []
+    scheduler = PollerScheduler()
 
     for key, value in provider_config.items():
         logging.getLogger(__name__).info("Configuring provider " + key + " ...")
@@ -56,36 +72,60 @@ def create_app(raw_store, processed_store, incident_store):
             _class = getattr(module, "Processor")
             _processor = _class()
 
-            # check if a thread is necessary
+            # check if a poller is necessary
             try:
                 _class = getattr(module, "BackgroundThread")
                 _object = _class()
-                background_threads.append(
-                    threading.Thread(
-                        name=_object.getName(),
-                        target=_object.run
+                if hasattr(_object, "execute"):
+                    background_threads.append(
+                        scheduler.add(
+                            _object.getName(),
+                            _object.execute,
+                            getattr(_object, "interval", Config.get("providers", key, "polling_in_seconds", 5)),
+                            jitter=Config.get("providers_setting", "polling_jitter_in_seconds", 0),
+                            initial_delay=2
+                        )
+                    )
+                else:
+                    # pollers that manage their own loop
+                    background_threads.append(
+                        threading.Thread(
+                            name=_object.getName(),
+                            target=_object.run
+                        )
                     )
-                )
             except AttributeError:
                 pass
 
         logging.getLogger(__name__).info("Adding provider " + key + ", route " + "/push/" + key)
+        receiver = get_push_receiver(
+            key,
+            _processor,
+            value["processor"].get("response", None),
+            raw_store,
+            processed_store,
+            incident_store
+        )
+        PushReceiver.register(key, receiver)
         api.add_route(
             "/push/" + key,
-            get_push_receiver(
-                key,
-                _processor,
-                value["processor"].get("response", None),
-                raw_store,
-                processed_store,
-                incident_store
-            )
+            receiver
         )
 
-    # start all background threads
+    # start all background threads and the pollers
     for t in background_threads:
-        logging.getLogger(__name__).info("Starting thread for {}".format(t))
-        t.start()
+        if isinstance(t, threading.Thread):
+            logging.getLogger(__name__).info("Starting thread for {}".format(t))
+            t.start()
+    logging.getLogger(__name__).info("Starting scheduler for {} pollers".format(len(scheduler.pollers)))
+    scheduler.start()
+
+    # archives the folders of past days off the request path, instead of the stores on rollover
+    archiver = Archiver.from_config([raw_store, processed_store])
+    if archiver is not None:
+        background_threads.append(
+            archiver.start(Config.get("archiving", "interval_in_seconds", default=600))
+        )
 
     from .routes.isalive import IsAlive
     api.add_route("/isalive", IsAlive(incident_store, background_threads))
@@ -96,6 +136,18 @@ def create_app(raw_store, processed_store, incident_store):
     from .routes.replay import Replay
     api.add_route("/replay", Replay())
 
+    from .routes.metrics import Metrics
+    api.add_route("/metrics", Metrics())
+
+    from .routes.reload import Reload
+    api.add_route("/reload", Reload())
+
+    try:
+        signal.signal(signal.SIGHUP, _reload_on_signal)
+    except (AttributeError, ValueError):
+        # no SIGHUP on this platform, or not called from the main thread
+        logging.getLogger(__name__).debug("Configuration reload on SIGHUP is not available")
+
     return api
 
 
@@ -0,0 +1,363 @@
+"""
+    Compresses the date folders of the stores once the day is over, see :class:`Archiver`, and
+    streams the files back out of those archives, see :func:`iter_archives`.
+"""
+
+import os
+import re
+import time
+import queue
+import shutil
+import tarfile
+import logging
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is used otherwise
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # windows, folders are archived without a lock then
+    fcntl = None
+
+EXTENSIONS = {
+    "gzip": ".tar.gz",
+    "zstd": ".tar.zst",
+}
+
+_DATE_FOLDER = re.compile(r"^\d{8}$")
+
+
+class Throttle(object):
+    """ Limits the average throughput of a single thread to bytes_per_second (None is unlimited) """
+
+    def __init__(self, bytes_per_second=None, clock=time.monotonic, sleep=time.sleep):
+        self._bytes_per_second = bytes_per_second
+        self._clock = clock
+        self._sleep = sleep
+        self._started = None
+        self._bytes = 0
+
+    def consume(self, amount):
+        if not self._bytes_per_second:
+            return
+        now = self._clock()
+        if self._started is None:
+            self._started = now
+        self._bytes += amount
+        ahead = self._bytes / self._bytes_per_second - (now - self._started)
+        if ahead > 0:
+            self._sleep(ahead)
+
+
+class _ThrottledReader(object):
+    """ File object wrapper that accounts every read against the throttle """
+
+    def __init__(self, file, throttle):
+        self._file = file
+        self._throttle = throttle
+
+    def read(self, size=-1):
+        chunk = self._file.read(size)
+        self._throttle.consume(len(chunk))
+        return chunk
+
+
+class Archiver(object):
+    """ Archives the date folders (<storage path>/<yearmonthdate>) of the given stores after the day
+        is over, replacing the rollover archiving of the stores themselves.
+
+        Every folder is streamed file by file into <folder>.tar.gz (or .tar.zst with zstandard), in a
+        temporary file that is renamed once it is complete, only then the folder is removed. Every worker
+        process runs an archiver, the lock file <folder>.lock ensures that a folder is archived by one
+        of them, the others skip it. Reading is
+        limited to max_bytes_per_second and the archiving thread runs with the given nice value, such
+        that live pushes are not slowed down. Folders are archived one after another by
+        :meth:`execute`, which is meant to be scheduled, see :meth:`start`.
+
+        Stores whose backend has no date folders (sqlite) are pruned instead, execute deletes their
+        items older than the retention in days given per store in retention.
+    """
+
+    def __init__(self,
+                 storage_paths,
+                 compression="gzip",
+                 level=6,
+                 max_bytes_per_second=None,
+                 nice=10,
+                 clock=time.time,
+                 retention=()):
+        if compression == "zstd" and zstandard is None:
+            logging.getLogger(__name__).warning("zstd compression needs the zstandard package, using gzip")
+            compression = "gzip"
+        if compression not in EXTENSIONS:
+            raise Exception("Unknown archive compression " + str(compression))
+        self._storage_paths = list(storage_paths)
+        self._compression = compression
+        self._level = level
+        self._max_bytes_per_second = max_bytes_per_second
+        self._nice = nice
+        self._clock = clock
+        self._niced = set()
+        self._scheduler = None
+        # [(store, days)]
+        self._retention = list(retention)
+
+    @classmethod
+    def from_config(cls, stores):
+        """ Archiver for all stores that archive their old folders, with the settings of the archiving
+            configuration. Returns None if archiving is disabled. The rollover archiving of the stores
+            is switched off. The other stores are pruned after stores.<store name>.retention_in_days
+            if configured. """
+        from . import Config
+
+        if not Config.get("archiving", "enabled", default=True):
+            return None
+        storage_paths = []
+        retention = []
+        for store in stores:
+            storage_path = store.hand_over_archiving()
+            if storage_path is not None:
+                storage_paths.append(storage_path)
+            elif Config.get("stores", store.STORE_NAME, "retention_in_days", default=None):
+                retention.append((store, Config.get("stores", store.STORE_NAME, "retention_in_days")))
+        return cls(
+            storage_paths,
+            retention=retention,
+            compression=Config.get("archiving", "compression", default="gzip"),
+            level=Config.get("archiving", "level", default=6),
+            max_bytes_per_second=Config.get("archiving", "max_bytes_per_second", default=None),
+            nice=Config.get("archiving", "nice", default=10))
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self._compression]
+
+    def pending(self):
+        """ :returns: date folders of past days that are not archived yet, oldest first """
+        today = time.strftime("%Y%m%d", time.localtime(self._clock()))
+        folders = []
+        for storage_path in self._storage_paths:
+            parent, placeholder, suffix = storage_path.partition("{yearmonthdate}")
+            if not placeholder or suffix.strip("/\\") or not os.path.isdir(parent or "."):
+                # only paths that end with the date folder can be archived
+                continue
+            for name in os.listdir(parent or "."):
+                folder = os.path.join(parent, name)
+                if _DATE_FOLDER.match(name) and name < today and os.path.isdir(folder):
+                    folders.append((name, folder))
+        return [folder for unused, folder in sorted(folders)]
+
+    def execute(self):
+        self._lower_priority()
+        for folder in self.pending():
+            self.archive(folder)
+        for store, days in self._retention:
+            date_before = time.strftime("%Y%m%d", time.localtime(self._clock() - days * 24 * 60 * 60))
+            deleted = store.prune(date_before)
+            if deleted:
+                logging.getLogger(__name__).info("Pruned %d items before %s of %s", deleted, date_before, store.__class__.__name__)
+
+    def archive(self, folder):
+        """ Archives the folder and removes it, returns the archive file or None if another process
+            is archiving it or has already done so """
+        lock_file = folder + ".lock"
+        lock = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    logging.getLogger(__name__).debug("%s is being archived by another process, skipping it", folder)
+                    return None
+            # None if archived by another process since it was listed
+            target = self._archive_locked(folder) if os.path.isdir(folder) else None
+            # only removed once the folder is gone, a process that locks the stale file skips it then
+            try:
+                os.remove(lock_file)
+            except FileNotFoundError:
+                pass
+            return target
+        finally:
+            os.close(lock)
+
+    def _archive_locked(self, folder):
+        logger = logging.getLogger(__name__)
+        target = folder + self.extension
+        if os.path.isfile(target):
+            logger.info("The archive " + target + " already exists, renaming it ...")
+            os.rename(target, target + ".renamed." + time.strftime("%Y%m%d%H%M%S"))
+
+        logger.info("Start archiving old folder " + folder)
+        started = time.monotonic()
+        tmp_file = target + ".tmp"
+        if os.path.isfile(tmp_file):
+            # left over by a process that died while holding the lock
+            os.remove(tmp_file)
+        # fails instead of writing into the file of another archiver
+        file = os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644), "wb")
+        try:
+            with file:
+                self._write(folder, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_file, target)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            raise
+        shutil.rmtree(folder)
+        logger.info("Archiving done in {0:.1f}s, old folder was {1}".format(time.monotonic() - started, folder))
+        return target
+
+    def _write(self, folder, file):
+        throttle = Throttle(self._max_bytes_per_second)
+        if self._compression == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self._level)
+            with compressor.stream_writer(file, closefd=False) as writer:
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    self._add_all(tar, folder, throttle)
+        else:
+            with tarfile.open(fileobj=file, mode="w:gz", compresslevel=self._level) as tar:
+                self._add_all(tar, folder, throttle)
+
+    def _add_all(self, tar, folder, throttle):
+        # same layout as shutil.make_archive(folder, "gztar", folder), i.e. members are relative to the folder
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                tarinfo = tar.gettarinfo(path, arcname=os.path.join(".", os.path.relpath(path, folder)))
+                with open(path, "rb") as source:
+                    tar.addfile(tarinfo, _ThrottledReader(source, throttle))
+
+    def _lower_priority(self):
+        # applies to the calling thread only, the io priority follows the cpu priority unless set otherwise
+        thread_id = threading.get_native_id()
+        if not self._nice or thread_id in self._niced or not hasattr(os, "setpriority"):
+            return
+        try:
+            os.setpriority(os.PRIO_PROCESS, thread_id, os.getpriority(os.PRIO_PROCESS, thread_id) + self._nice)
+        except OSError as e:
+            logging.getLogger(__name__).debug("Could not lower the priority of the archiver: %s", e)
+        self._niced.add(thread_id)
+
+    def start(self, interval=600, initial_delay=60):
+        """ Runs execute every interval seconds in a dedicated thread, such that lowering its priority
+            does not affect other work """
+        from .provider.wrapper_service import PollerScheduler
+
+        self._scheduler = PollerScheduler(max_workers=1)
+        poller = self._scheduler.add("Archiver", self.execute, interval, initial_delay=initial_delay)
+        self._scheduler.start()
+        return poller
+
+    def stop(self, wait=True):
+        if self._scheduler is not None:
+            self._scheduler.stop(wait=wait)
+
+
+def is_archive(path):
+    return isinstance(path, str) and path.endswith(tuple(EXTENSIONS.values()))
+
+
+def archive_stem(path):
+    """ Name of the archived folder, e.g. 20200101 for dump/a_raw/20200101.tar.gz """
+    name = os.path.basename(path)
+    for extension in EXTENSIONS.values():
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def iter_members(path, member_filter=None):
+    """ Streams the regular files of the archive without extracting it to disk.
+
+        :param member_filter: called with the member name (relative to the archived folder),
+            members it returns False for are skipped without being decompressed to memory
+        :returns: generator of (member name, content as bytes)
+    """
+    with open(path, "rb") as file:
+        if path.endswith(EXTENSIONS["zstd"]):
+            if zstandard is None:
+                raise Exception("Reading " + path + " needs the zstandard package")
+            file = zstandard.ZstdDecompressor().stream_reader(file)
+            mode = "r|"
+        else:
+            mode = "r|gz"
+        with tarfile.open(fileobj=file, mode=mode) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = os.path.normpath(member.name)
+                if member_filter is not None and not member_filter(name):
+                    continue
+                yield name, tar.extractfile(member).read()
+
+
+_DONE = object()
+
+
+def iter_archives(paths, member_filter=None, max_workers=4, max_buffered=64):
+    """ Streams the members of all archives, see :func:`iter_members`, decompressing up to
+        max_workers archives in parallel (zlib and zstandard release the GIL). At most
+        max_buffered members are held in memory, the order across archives is not defined.
+
+        :returns: generator of (archive path, member name, content as bytes)
+    """
+    paths = list(paths)
+    if max_workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            for name, content in iter_members(path, member_filter):
+                yield path, name, content
+        return
+
+    pending = queue.Queue()
+    for path in paths:
+        pending.put(path)
+    buffer = queue.Queue(maxsize=max_buffered)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work():
+        try:
+            while not stopped.is_set():
+                try:
+                    path = pending.get_nowait()
+                except queue.Empty:
+                    break
+                for name, content in iter_members(path, member_filter):
+                    if not put((path, name, content)):
+                        return
+        except BaseException as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    workers = [threading.Thread(name="ArchiveReader-" + str(index), target=work, daemon=True)
+               for index in range(min(max_workers, len(paths)))]
+    for worker in workers:
+        worker.start()
+    try:
+        running = len(workers)
+        while running:
+            item = buffer.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        # also reached if the consumer stops early, unblocks the workers
+        stopped.set()
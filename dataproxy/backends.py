@@ -0,0 +1,277 @@
+"""
+    Storage backends of the stores, see :class:`StorageBackend`. Which backend a store uses is
+    configured in stores.<store name>.backend, see :func:`get_backend`.
+"""
+
+import io
+import os
+import re
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+# item of a store, date is YYYYMMDD, written a timestamp and location the file or database entry
+StoredItem = namedtuple("StoredItem", ["date", "sub_folder", "name", "written", "location"])
+
+_DATE_FOLDER = re.compile(r"^\d{8}$")
+
+
+def write_bytes(fopen, file_name, content):
+    """ Writes bytes, bytearray or memoryview content with unbuffered writes, i.e. straight
+        from the given buffer without encoding or copying it """
+    view = memoryview(content).cast("B")
+    with fopen(file_name, "wb", buffering=0) as file:
+        while view:
+            view = view[file.write(view):]
+
+
+class StorageBackend(ABC):
+    """ Keeps the items of a store, addressed by (date, sub folder, name). The sub folder is the
+        provider for all stores of the dataproxy. """
+
+    @abstractmethod
+    def save(self, date, sub_folder, name, content, if_exists="overwrite"):
+        """ Saves str (as utf-8) or bytes-like content.
+
+            :param if_exists: "overwrite", "keep" the existing item or "fail"
+            :returns: location of the item
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, date, sub_folder, name):
+        pass
+
+    @abstractmethod
+    def folder_exists(self, date, sub_folder):
+        pass
+
+    @abstractmethod
+    def open(self, date, sub_folder, name):
+        """ :returns: (binary stream, length) """
+        pass
+
+    @abstractmethod
+    def iterate(self, sub_folder=None, date_from=None, date_to=None):
+        """ :returns: generator of the :class:`StoredItem` in the given sub folder and dates (inclusive),
+            ordered by date, sub folder and name """
+        pass
+
+    @abstractmethod
+    def last_written(self, sub_folder=None):
+        """ :returns: the most recently written :class:`StoredItem` or None """
+        pass
+
+    def prune(self, date_before):
+        """ Deletes the items of the days before date_before (YYYYMMDD), backends whose date folders
+            are archived instead (see archiver.Archiver) keep them.
+
+            :returns: the number of deleted items
+        """
+        return 0
+
+
+class FileBackend(StorageBackend):
+    """ One file per item in <storage path>/<sub folder>/<name>, {yearmonthdate} in the storage
+        path is replaced by the date """
+
+    def __init__(self,
+                 storage_path,
+                 fopen=io.open,
+                 dmakedir=os.makedirs,
+                 disfile=os.path.isfile,
+                 disfolder=os.path.isdir):
+        self.storage_path = storage_path
+        self._fopen = fopen
+        self._dmakedir = dmakedir
+        self._disfile = disfile
+        self._disfolder = disfolder
+
+    def path(self, date, sub_folder, name=None, create=True):
+        folder = os.path.join(self.storage_path.format(yearmonthdate=date), sub_folder)
+        if create:
+            # ensure all subfolders exist
+            self._dmakedir(folder, exist_ok=True)
+        if name:
+            return os.path.join(folder, name)
+        return folder
+
+    def save(self, date, sub_folder, name, content, if_exists="overwrite"):
+        file_path = self.path(date, sub_folder, name)
+        if if_exists != "overwrite" and self._disfile(file_path):
+            if if_exists == "fail":
+                raise Exception("File exists, but shouldnt!")
+            return file_path
+        if isinstance(content, str):
+            with self._fopen(file_path, 'wt', encoding="utf-8") as file:
+                file.write(content)
+        else:
+            write_bytes(self._fopen, file_path, content)
+        return file_path
+
+    def exists(self, date, sub_folder, name):
+        return self._disfile(self.path(date, sub_folder, name, create=False))
+
+    def folder_exists(self, date, sub_folder):
+        return self._disfolder(self.path(date, sub_folder, create=False))
+
+    def open(self, date, sub_folder, name):
+        file_path = self.path(date, sub_folder, name, create=False)
+        stream = self._fopen(file_path, 'rb')
+        return stream, os.path.getsize(file_path)
+
+    def _date_folders(self, date_from=None, date_to=None):
+        parent, placeholder, suffix = self.storage_path.partition("{yearmonthdate}")
+        if not placeholder or not os.path.isdir(parent or "."):
+            return []
+        dates = sorted(name for name in os.listdir(parent or ".") if _DATE_FOLDER.match(name) and
+                       (date_from is None or name >= date_from) and (date_to is None or name <= date_to))
+        return [(date, parent + date + suffix) for date in dates]
+
+    def iterate(self, sub_folder=None, date_from=None, date_to=None):
+        for date, date_folder in self._date_folders(date_from, date_to):
+            if not os.path.isdir(date_folder):
+                continue
+            sub_folders = [sub_folder] if sub_folder is not None else sorted(os.listdir(date_folder))
+            for current in sub_folders:
+                folder = os.path.join(date_folder, current)
+                if not os.path.isdir(folder):
+                    continue
+                for name in sorted(os.listdir(folder)):
+                    location = os.path.join(folder, name)
+                    yield StoredItem(date, current, name, os.path.getctime(location), location)
+
+    def last_written(self, sub_folder=None):
+        # the newest date folder that has items decides, only that one is scanned
+        for date, date_folder in reversed(self._date_folders()):
+            items = list(self.iterate(sub_folder, date, date))
+            if items:
+                return max(items, key=lambda item: item.written)
+        return None
+
+
+class SqliteBackend(StorageBackend):
+    """ All items in one SQLite database in WAL mode, with (date, sub folder, name) as primary key
+        and an index on the write time per sub folder, such that exists checks, listings and the
+        latest item per provider are index lookups.
+
+        Every thread uses its own connection, WAL lets readers proceed while one thread writes.
+    """
+
+    def __init__(self, database, clock=time.time):
+        self.database = database
+        self._clock = clock
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.database) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.database, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS items ("
+                    " date TEXT NOT NULL, sub_folder TEXT NOT NULL, name TEXT NOT NULL,"
+                    " content BLOB NOT NULL, written REAL NOT NULL,"
+                    " PRIMARY KEY (date, sub_folder, name)) WITHOUT ROWID")
+                connection.execute("CREATE INDEX IF NOT EXISTS items_written ON items (sub_folder, written)")
+            self._local.connection = connection
+        return connection
+
+    def _location(self, date, sub_folder, name):
+        return self.database + "#" + "/".join([date, sub_folder, name])
+
+    def save(self, date, sub_folder, name, content, if_exists="overwrite"):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        statement = {"overwrite": "INSERT OR REPLACE", "keep": "INSERT OR IGNORE", "fail": "INSERT"}[if_exists]
+        connection = self._connection()
+        try:
+            with connection:
+                connection.execute(statement + " INTO items (date, sub_folder, name, content, written) VALUES (?, ?, ?, ?, ?)",
+                                   (date, sub_folder, name, content, self._clock()))
+        except sqlite3.IntegrityError:
+            raise Exception("File exists, but shouldnt!")
+        return self._location(date, sub_folder, name)
+
+    def exists(self, date, sub_folder, name):
+        return self._connection().execute(
+            "SELECT 1 FROM items WHERE date = ? AND sub_folder = ? AND name = ?",
+            (date, sub_folder, name)).fetchone() is not None
+
+    def folder_exists(self, date, sub_folder):
+        return self._connection().execute(
+            "SELECT 1 FROM items WHERE date = ? AND sub_folder = ? LIMIT 1",
+            (date, sub_folder)).fetchone() is not None
+
+    def open(self, date, sub_folder, name):
+        row = self._connection().execute(
+            "SELECT content FROM items WHERE date = ? AND sub_folder = ? AND name = ?",
+            (date, sub_folder, name)).fetchone()
+        if row is None:
+            raise FileNotFoundError(self._location(date, sub_folder, name))
+        return io.BytesIO(row[0]), len(row[0])
+
+    def iterate(self, sub_folder=None, date_from=None, date_to=None):
+        conditions = []
+        arguments = []
+        for condition, argument in [("sub_folder = ?", sub_folder), ("date >= ?", date_from), ("date <= ?", date_to)]:
+            if argument is not None:
+                conditions.append(condition)
+                arguments.append(argument)
+        query = "SELECT date, sub_folder, name, written FROM items"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        for date, current, name, written in self._connection().execute(query + " ORDER BY date, sub_folder, name", arguments):
+            yield StoredItem(date, current, name, written, self._location(date, current, name))
+
+    def last_written(self, sub_folder=None):
+        if sub_folder is None:
+            row = self._connection().execute(
+                "SELECT date, sub_folder, name, written FROM items ORDER BY written DESC LIMIT 1").fetchone()
+        else:
+            row = self._connection().execute(
+                "SELECT date, sub_folder, name, written FROM items WHERE sub_folder = ? ORDER BY written DESC LIMIT 1",
+                (sub_folder,)).fetchone()
+        if row is None:
+            return None
+        return StoredItem(row[0], row[1], row[2], row[3], self._location(row[0], row[1], row[2]))
+
+    def prune(self, date_before):
+        connection = self._connection()
+        dates = [row[0] for row in connection.execute("SELECT DISTINCT date FROM items WHERE date < ?", (date_before,))]
+        deleted = 0
+        # one transaction per day, such that pushes are not blocked for the whole run
+        for date in dates:
+            with connection:
+                deleted += connection.execute("DELETE FROM items WHERE date = ?", (date,)).rowcount
+        return deleted
+
+
+def backend_name(store_name):
+    """ Configured backend of the store, file or sqlite """
+    from . import Config
+
+    if store_name is None:
+        return "file"
+    return Config.get("stores", store_name, "backend", default="file")
+
+
+def get_backend(store_name, storage_path, **file_backend_arguments):
+    """ Backend of the store as configured in stores.<store_name> (backend: file or sqlite,
+        database: sqlite file, defaults to <dump_folder>/<store_name>.sqlite) """
+    from . import Config
+
+    backend = backend_name(store_name)
+    if backend == "file":
+        return FileBackend(storage_path, **file_backend_arguments)
+    elif backend == "sqlite":
+        return SqliteBackend(Config.get(
+            "stores", store_name, "database",
+            default=os.path.join(Config.get("dump_folder", default="dump"), store_name + ".sqlite")))
+    raise Exception("Unknown storage backend " + str(backend) + " of store " + store_name)
@@ -0,0 +1,357 @@
+import io
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from . import metrics
+from . import jsoncodec
+
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """ Thread-safe least recently used cache with an optional time to live.
+
+        All operations are O(1), the least recently used entry is evicted once
+        capacity is exceeded and entries older than ttl seconds are treated as absent.
+    """
+
+    def __init__(self, capacity=10000, ttl=None, clock=time.time):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+        self._capacity = capacity
+        self._ttl = ttl
+        self._clock = clock
+        # key -> (value, inserted_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def _expired(self, inserted_at, now):
+        return self._ttl is not None and now - inserted_at > self._ttl
+
+    def _get_locked(self, key, now):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        if self._expired(entry[1], now):
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _set_locked(self, key, value, now):
+        self._entries[key] = (value, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_locked(key, self._clock())
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._set_locked(key, value, self._clock())
+
+    def replace(self, key, value, default=None):
+        """ Atomically sets key to value and returns the previous value """
+        with self._lock:
+            now = self._clock()
+            previous = self._get_locked(key, now)
+            self._set_locked(key, value, now)
+        return default if previous is _MISSING else previous
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get_locked(key, self._clock()) is not _MISSING
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SeenSet(LRUCache):
+    """ Bounded set of identifiers that have been processed already, e.g. to prevent
+        sending the same incident twice.
+
+        If persist_file is given (on creation or later via persist_to), the set is loaded from
+        it and, if it changed, written to it every persist_interval seconds by a background
+        thread (and on exit or via save), such that a restart does not forget the recent
+        history. Callers of check_and_add never wait for the file to be written.
+    """
+
+    def __init__(self, capacity=100000, ttl=None, persist_file=None, persist_interval=60, clock=time.time):
+        super(SeenSet, self).__init__(capacity=capacity, ttl=ttl, clock=clock)
+        self._persist_file = None
+        self._persist_interval = persist_interval
+        self._dirty = False
+        self._save_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.persist_to(persist_file)
+
+    def persist_to(self, persist_file):
+        """ Loads the set from persist_file and starts persisting it there. Only one process may
+            persist to a file, the set is not persisted if persist_file is None or already is """
+        if persist_file is None or self._persist_file is not None:
+            return
+        self._persist_file = persist_file
+        self._load()
+        atexit.register(self.close)
+        threading.Thread(name="SeenSetPersister", target=self._persist_periodically, daemon=True).start()
+
+    def _persist_periodically(self):
+        while not self._stopped.wait(self._persist_interval):
+            if self._dirty:
+                self.save()
+
+    def close(self):
+        """ Stops the background persisting and writes the set a last time """
+        self._stopped.set()
+        if self._dirty:
+            self.save()
+
+    def check_and_add(self, key):
+        """ Atomically marks key as seen, returns True if it had been seen before """
+        now = self._clock()
+        with self._lock:
+            seen = self._get_locked(key, now) is not _MISSING
+            if not seen:
+                self._set_locked(key, True, now)
+                self._dirty = True
+        return seen
+
+    def add(self, key):
+        self.check_and_add(key)
+
+    def save(self):
+        """ Writes the set atomically to persist_file, ordered from least to most recently used """
+        if self._persist_file is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                entries = [[key, inserted_at] for key, (unused, inserted_at) in self._entries.items()]
+                self._dirty = False
+            try:
+                os.makedirs(os.path.dirname(self._persist_file) or ".", exist_ok=True)
+                tmp_file = self._persist_file + ".tmp"
+                with io.open(tmp_file, "w", encoding="utf-8") as file:
+                    json.dump(entries, file)
+                os.replace(tmp_file, self._persist_file)
+            except OSError as e:
+                logging.getLogger(__name__).warning("Could not persist seen set to %s: %s", self._persist_file, e)
+
+    def _load(self):
+        try:
+            with io.open(self._persist_file, encoding="utf-8") as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning("Could not load seen set from %s: %s", self._persist_file, e)
+            return
+        now = self._clock()
+        with self._lock:
+            # keys added before loading are the most recent ones
+            added = self._entries
+            self._entries = OrderedDict(
+                (key, (True, inserted_at)) for key, inserted_at in entries
+                if key not in added and not self._expired(inserted_at, now))
+            self._entries.update(added)
+            self._dirty = self._dirty or bool(added)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+
+class SizedLRUCache(LRUCache):
+    """ LRUCache that is bounded by the summed size of its values as well, sizes are given on set """
+
+    def __init__(self, capacity=10000, max_bytes=64 * 1024 * 1024, ttl=None, clock=time.time):
+        super(SizedLRUCache, self).__init__(capacity=capacity, ttl=ttl, clock=clock)
+        self._max_bytes = max_bytes
+        self._sizes = {}
+        self._bytes = 0
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def _get_locked(self, key, now):
+        value = super(SizedLRUCache, self)._get_locked(key, now)
+        if value is _MISSING and key in self._sizes:
+            # expired
+            self._bytes -= self._sizes.pop(key)
+        return value
+
+    def _set_locked(self, key, value, now, size=0):
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._entries[key] = (value, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._capacity or (self._bytes > self._max_bytes and len(self._entries) > 1):
+            evicted, unused = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(evicted)
+
+    def set(self, key, value, size=0, inserted_at=None):
+        """ :param inserted_at: time the value was created, for the ttl, defaults to now """
+        with self._lock:
+            self._set_locked(key, value, self._clock() if inserted_at is None else inserted_at, size)
+
+    def replace(self, key, value, default=None, size=0):
+        """ Atomically sets key to value of the given size and returns the previous value """
+        with self._lock:
+            now = self._clock()
+            previous = self._get_locked(key, now)
+            self._set_locked(key, value, now, size)
+        return default if previous is _MISSING else previous
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            if entry is not _MISSING:
+                self._bytes -= self._sizes.pop(key)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+
+class SingleFlight(object):
+    """ Runs at most one call per key at a time, concurrent callers of the same key wait for
+        the running call and share its result (or exception) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [finished event, result, exception]
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = function()
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1]
+
+
+class TieredJsonCache(object):
+    """ Cache of json objects in two tiers, a SizedLRUCache in memory over a persistent store
+        (e.g. stores.CacheFileStore, items are saved in sub_folder as <identifier>.json).
+
+        Lookups try memory, then the store, then the getter. Concurrent lookups of the same
+        identifier call the getter only once. Entries older than ttl seconds are treated as
+        absent in both tiers, overwrite skips both tiers and replaces the entry. Hits and
+        misses are counted per tier, see stats.
+    """
+
+    def __init__(self,
+                 store,
+                 sub_folder,
+                 capacity=10000,
+                 max_bytes=64 * 1024 * 1024,
+                 ttl=None,
+                 clock=time.time):
+        self._store = store
+        self._sub_folder = sub_folder
+        self._ttl = ttl
+        self._clock = clock
+        self._memory = SizedLRUCache(capacity=capacity, max_bytes=max_bytes, ttl=ttl, clock=clock)
+        self._flight = SingleFlight()
+        self._lookups = metrics.JSON_CACHE_LOOKUPS
+        self._counts = {"memory": 0, "store": 0, "miss": 0}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, result):
+        with self._counts_lock:
+            self._counts[result] += 1
+        self._lookups.labels(self._sub_folder, result).inc()
+
+    def _load(self, identifier):
+        if not self._store.exists(self._sub_folder, ".json", identifier):
+            return _MISSING
+        stream, stream_len = self._store.open(self._sub_folder, identifier + ".json")
+        with stream:
+            content = stream.read(stream_len)
+        try:
+            entry = jsoncodec.loads(content)
+            written, value = entry["written"], entry["value"]
+        except (ValueError, KeyError, TypeError):
+            logging.getLogger(__name__).warning("Ignoring unreadable cache entry %s/%s", self._sub_folder, identifier)
+            return _MISSING
+        if self._ttl is not None and self._clock() - written > self._ttl:
+            return _MISSING
+        self._memory.set(identifier, value, size=len(content), inserted_at=written)
+        return value
+
+    def _fill(self, identifier, getter, overwrite):
+        if not overwrite:
+            # filled by a concurrent lookup in the meantime
+            value = self._memory.get(identifier, _MISSING)
+            if value is not _MISSING:
+                return value
+        value = getter()
+        if value:
+            written = self._clock()
+            content = jsoncodec.dumps({"written": written, "value": value})
+            self._store.save(self._sub_folder, content, file_ext=".json", file_name=identifier, overwrite=True)
+            self._memory.set(identifier, value, size=len(content), inserted_at=written)
+        return value
+
+    def get(self, identifier, getter, overwrite=False):
+        if not overwrite:
+            value = self._memory.get(identifier, _MISSING)
+            if value is not _MISSING:
+                self._count("memory")
+                return value
+            value = self._load(identifier)
+            if value is not _MISSING:
+                self._count("store")
+                return value
+        self._count("miss")
+        return self._flight.do(identifier, lambda: self._fill(identifier, getter, overwrite))
+
+    def stats(self):
+        lookups = sum(self._counts.values())
+        return {
+            "lookups": lookups,
+            "memory_hits": self._counts["memory"],
+            "store_hits": self._counts["store"],
+            "misses": self._counts["miss"],
+            "hit_rate": round((lookups - self._counts["miss"]) / lookups, 4) if lookups else None,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory.bytes,
+        }
@@ -7,6 +7,7 @@ from pprint import pprint
 from .app import get_app
 from . import Config
 from . import implementations
+from . import reprocess as reprocessing
 
 
 @click.group()
@@ -52,13 +53,35 @@ def _load_module(provider):
 @click.option("--name_filter")
 @click.option("--target")
 @click.option("--async_queue")
-def replay(provider, received=None, name_filter=None, target=None, async_queue=False):
+@click.option("--matches", help="Filter expression on the found incidents, e.g. 'sport=soccer and call=result'")
+def replay(provider, received=None, name_filter=None, target=None, async_queue=False, matches=None):
     response = implementations.replay(
         providers=provider,
         received=received,
         name_filter=name_filter,
         target=target,
-        async_queue=async_queue
+        async_queue=async_queue,
+        matches=matches
+    )
+    pprint(response)
+
+
+@main.command()
+@click.argument("provider")
+@click.option("--date_from", required=True, help="First day to reprocess, YYYYMMDD")
+@click.option("--date_to", help="Last day to reprocess (inclusive), defaults to date_from")
+@click.option("--processes", type=int, help="Worker processes, defaults to one per cpu")
+@click.option("--checkpoint", help="Checkpoint file, defaults to <dump_folder>/reprocess/<provider>_<from>_<to>.json")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint of a previous run")
+def reprocess(provider, date_from, date_to=None, processes=None, checkpoint=None, restart=False):
+    """ Re-derives incidents from the raw and processed pushes of the provider and stores the new ones """
+    response = reprocessing.reprocess(
+        provider,
+        date_from,
+        date_to or date_from,
+        processes=processes,
+        checkpoint_file=checkpoint,
+        restart=restart
     )
     pprint(response)
 
@@ -93,7 +116,7 @@ def find(
 @click.option("--eventgroup")
 @click.option("--date_from")
 @click.option("--date_to")
-@click.option("--matches")
+@click.option("--matches", help="Identifier (e.g. a team) or filter expression, e.g. 'home~wizards and call=create'")
 def pull(
         provider,
         sport=None,
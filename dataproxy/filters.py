@@ -0,0 +1,265 @@
+import re
+
+
+"""
+    Precompiled incident filters, used to debug single games (see GenericProcessor.debug_games)
+    and to select incidents for replay, see :func:`compile_filter` for the expression language.
+"""
+
+# fields an identifier is looked for in, as path into the incident
+ID_FIELDS = (
+    ("id", "home"),
+    ("id", "away"),
+    ("id", "event_group_name"),
+    ("id", "start_time"),
+    ("provider_info", "api_event_id"),
+)
+
+# short field names of expressions, any other name is a dotted path into the incident
+FIELD_ALIASES = {
+    "sport": ("id", "sport"),
+    "home": ("id", "home"),
+    "away": ("id", "away"),
+    "event_group_name": ("id", "event_group_name"),
+    "eventgroup": ("id", "event_group_name"),
+    "start_time": ("id", "start_time"),
+    "api_event_id": ("provider_info", "api_event_id"),
+    "provider": ("provider_info", "name"),
+}
+
+_OPERATORS = {
+    "=": lambda value, expected: value == expected,
+    "!=": lambda value, expected: value != expected,
+    "~": lambda value, expected: expected in value,
+    "<": lambda value, expected: value < expected,
+    "<=": lambda value, expected: value <= expected,
+    ">": lambda value, expected: value > expected,
+    ">=": lambda value, expected: value >= expected,
+}
+
+# ordering operators compare numerically if both sides are numbers
+_ORDERING = ("<", "<=", ">", ">=")
+
+_KEYWORDS = ("and", "or", "not")
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|(!=|<=|>=|=|~|<|>)|([^\s()"=!<>~]+))')
+
+_NUMBER = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)$")
+
+# strings without an operator that do not parse are taken as one identifier, e.g. team names
+_COMPARISON = re.compile(r"[=~<>]")
+
+
+def _lookup(incident, path):
+    value = incident
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _normalize(value):
+    return str(value).lower()
+
+
+def _number(value):
+    """ :returns: value as float if it is a plain decimal number, otherwise None """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and _NUMBER.match(value.strip()):
+        return float(value)
+    return None
+
+
+class IdentifierFilter(object):
+    """ Matches incidents that contain any of the identifiers (case insensitive) in one of their
+        id fields. Exact field values are a set lookup, partial ones are found by a single
+        precompiled alternation over all identifiers. """
+
+    def __init__(self, identifiers, fields=ID_FIELDS):
+        self.identifiers = frozenset(_normalize(identifier) for identifier in identifiers if str(identifier))
+        self._fields = fields
+        # longest first, such that the alternation prefers the most specific identifier
+        self._pattern = re.compile("|".join(
+            re.escape(identifier) for identifier in sorted(self.identifiers, key=len, reverse=True)))
+
+    def matches(self, incident):
+        if not self.identifiers:
+            return False
+        values = []
+        for path in self._fields:
+            value = _lookup(incident, path)
+            if value is None:
+                continue
+            value = _normalize(value)
+            if value in self.identifiers:
+                return True
+            values.append(value)
+        return self._pattern.search("\n".join(values)) is not None
+
+
+class FieldFilter(object):
+    """ Compares one field of the incident, case insensitive as strings. <, <=, > and >= compare
+        numerically if both the field and the expected value are numbers """
+
+    def __init__(self, path, operator, expected):
+        self._path = path
+        self._compare = _OPERATORS[operator]
+        self._negated = operator == "!="
+        self._expected = _normalize(expected)
+        self._expected_number = _number(expected) if operator in _ORDERING else None
+
+    def matches(self, incident):
+        value = _lookup(incident, self._path)
+        if value is None:
+            return self._negated
+        if self._expected_number is not None:
+            number = _number(value)
+            if number is not None:
+                return self._compare(number, self._expected_number)
+        return self._compare(_normalize(value), self._expected)
+
+
+class AllOf(object):
+
+    def __init__(self, filters):
+        self._filters = filters
+
+    def matches(self, incident):
+        return all(_filter.matches(incident) for _filter in self._filters)
+
+
+class AnyOf(object):
+
+    def __init__(self, filters):
+        self._filters = filters
+
+    def matches(self, incident):
+        return any(_filter.matches(incident) for _filter in self._filters)
+
+
+class Not(object):
+
+    def __init__(self, _filter):
+        self._filter = _filter
+
+    def matches(self, incident):
+        return not self._filter.matches(incident)
+
+
+class _Parser(object):
+
+    def __init__(self, expression):
+        self._expression = expression
+        self._tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = _TOKEN.match(expression, position)
+            if match is None or match.end() == position:
+                raise Exception("Invalid filter expression at " + str(position) + ": " + self._expression)
+            opening, closing, quoted, operator, word = match.groups()
+            if opening:
+                self._tokens.append(("(", opening))
+            elif closing:
+                self._tokens.append((")", closing))
+            elif quoted is not None:
+                self._tokens.append(("string", re.sub(r"\\(.)", r"\1", quoted)))
+            elif operator:
+                self._tokens.append(("operator", operator))
+            elif word.lower() in _KEYWORDS:
+                self._tokens.append((word.lower(), word))
+            else:
+                self._tokens.append(("word", word))
+            position = match.end()
+        self._position = 0
+
+    def _peek(self, offset=0):
+        if self._position + offset < len(self._tokens):
+            return self._tokens[self._position + offset][0]
+        return None
+
+    def _next(self, *kinds):
+        if self._peek() not in kinds:
+            raise Exception("Invalid filter expression, expected " + " or ".join(kinds) + ": " + self._expression)
+        self._position += 1
+        return self._tokens[self._position - 1][1]
+
+    def parse(self):
+        _filter = self._any_of()
+        if self._peek() is not None:
+            raise Exception("Invalid filter expression, unexpected " + self._tokens[self._position][1] + ": " + self._expression)
+        return _filter
+
+    def _any_of(self):
+        filters = [self._all_of()]
+        while self._peek() == "or":
+            self._next("or")
+            filters.append(self._all_of())
+        if len(filters) == 1:
+            return filters[0]
+        if all(isinstance(_filter, IdentifierFilter) for _filter in filters):
+            # one lookup for all identifiers
+            return IdentifierFilter(set().union(*[_filter.identifiers for _filter in filters]))
+        return AnyOf(filters)
+
+    def _all_of(self):
+        filters = [self._negation()]
+        while self._peek() == "and":
+            self._next("and")
+            filters.append(self._negation())
+        if len(filters) == 1:
+            return filters[0]
+        return AllOf(filters)
+
+    def _negation(self):
+        if self._peek() == "not":
+            self._next("not")
+            return Not(self._negation())
+        if self._peek() == "(":
+            self._next("(")
+            _filter = self._any_of()
+            self._next(")")
+            return _filter
+        if self._peek() == "word" and self._peek(1) == "operator":
+            field = self._next("word")
+            path = FIELD_ALIASES.get(field.lower(), tuple(field.split(".")))
+            operator = self._next("operator")
+            return FieldFilter(path, operator, self._next("word", "string"))
+        # adjacent words form one identifier, e.g. golden state warriors
+        words = [self._next("word", "string")]
+        while self._peek() in ("word", "string") and self._peek(1) != "operator":
+            words.append(self._next("word", "string"))
+        return IdentifierFilter([" ".join(words)])
+
+
+def compile_filter(expression):
+    """ Compiles a filter expression into an object whose matches(incident) tells if the incident
+        is selected. Expressions combine terms with and, or, not and parentheses, a term is either
+
+            - an identifier, e.g. ``golden state warriors`` or ``2865094``, that is looked for in the
+              id fields, see :class:`IdentifierFilter`
+            - a comparison ``field operator value`` with the operators =, !=, ~ (contains), <, <=, >
+              and >=, e.g. ``sport=basketball and call=result`` or ``start_time>=2019-01-25``. The
+              field is one of FIELD_ALIASES or a dotted path into the incident, e.g. arguments.season
+
+        Values are compared case insensitive, numbers compare numerically with <, <=, > and >=.
+        Values with spaces or operators need double quotes. A string without operators that is no
+        valid expression, e.g. ``Team (W)``, is taken as one identifier. Lists (and
+        single integers) are taken as identifiers, filters are returned as they are.
+    """
+    if hasattr(expression, "matches"):
+        return expression
+    if isinstance(expression, int):
+        return IdentifierFilter([expression])
+    if isinstance(expression, (list, tuple, set, frozenset)):
+        return IdentifierFilter(expression)
+    try:
+        return _Parser(expression).parse()
+    except Exception:
+        if not expression.strip() or _COMPARISON.search(expression):
+            raise
+        return IdentifierFilter([expression.strip()])
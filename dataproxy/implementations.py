@@ -3,6 +3,7 @@ import logging
 from .processors import JsonProcessor
 from . import Config
 from .stores import IncidentFileStore, RawStore, ProcessedFileStore
+from .backends import backend_name
 from .routes.push import PushReceiver
 
 import json
@@ -13,6 +14,11 @@ import time
 from strict_rfc3339 import InvalidRFC3339Error
 
 from . import utils
+from . import metrics
+from . import profiling
+from . import filters
+from . import jsoncodec
+from .logs import run_in_context
 from .utils import slugify
 from datetime import timedelta
 
@@ -33,33 +39,44 @@ def _send_to_witness(processor, incident, targets=None):
                                    0)
 
         if initial_delay > 0:
-            logging.getLogger(__name__).info("Incident " + incident["unique_string"] + ": Waiting before sending " + incident["call"])
+            logging.getLogger(__name__).info("Incident %s: Waiting before sending %s", incident["unique_string"], incident["call"])
             time.sleep(initial_delay)
-            logging.getLogger(__name__).info("Incident " + incident["unique_string"] + ": Sending result now")
+            logging.getLogger(__name__).info("Incident %s: Sending result now", incident["unique_string"])
 
         PushReceiver.subscribed_witnesses_status = processor.send_to_witness(
             incident,
             targets=targets
         )
         received_witnesses = len([key for key, value in PushReceiver.subscribed_witnesses_status.items() if value == "ok"])
-        logging.getLogger(__name__).debug("Incident " + incident["unique_string"] + ": Successfully sent to " + str(received_witnesses) + " witnesses")
+        logging.getLogger(__name__).debug("Incident %s: Successfully sent to %d witnesses", incident["unique_string"], received_witnesses)
         return received_witnesses
     except Exception as e:
-        logging.getLogger(__name__).info("Incident " + incident["unique_string"] + ": PUSH to witness failed, continueing anyways, exception below")
+        logging.getLogger(__name__).info("Incident %s: PUSH to witness failed, continueing anyways, exception below", incident["unique_string"])
         logging.getLogger(__name__).exception(e)
+    finally:
+        metrics.DELIVERY_QUEUE_DEPTH.dec()
+
+
+def _start_sending_to_witness(processor, incident, targets=None, async_queue=True):
+    metrics.DELIVERY_QUEUE_DEPTH.inc()
+    if async_queue:
+        thr = threading.Thread(target=run_in_context(_send_to_witness),
+                               args=(processor, incident, targets,))
+        try:
+            thr.start()  # we dont care when it finishes
+        except Exception:
+            metrics.DELIVERY_QUEUE_DEPTH.dec()
+            raise
+    else:
+        _send_to_witness(processor, incident, targets=targets)
 
 
 def _send_list_to_witness(processor, incident_list, targets=None, async_queue=True):
     for incident in incident_list:
-        logging.getLogger(__name__).info("Trigger sending " + incident["unique_string"])
+        logging.getLogger(__name__).info("Trigger sending %s", incident["unique_string"])
 
-        if async_queue:
-            # send to witnesses
-            thr = threading.Thread(target=_send_to_witness,
-                                   args=(processor, incident, targets,))
-            thr.start()  # we dont care when it finishes
-        else:
-            _send_to_witness(processor, incident, targets=targets)
+        # send to witnesses
+        _start_sending_to_witness(processor, incident, targets, async_queue)
 
 
 def process_content(provider_name,
@@ -70,14 +87,30 @@ def process_content(provider_name,
                     file_ending,
                     restrict_witness_group=None,  # deprecated
                     async_queue=True,
-                    target=None):
+                    target=None,
+                    archive=True):
+    """ Finds incidents in the given content and sends new ones to the witnesses
+
+        :param file_content: content as pushed by the provider (str or bytes-like), or an already parsed json payload
+        :param archive: store the content in the processed store before processing
+    """
     file_name = None
+    logger = logging.getLogger(__name__ + "_" + provider_name)
 
     if restrict_witness_group is None and target is not None:
         restrict_witness_group = target
 
     # before storing, check if its worth processing
     is_interesting = file_content is not None
+    if is_interesting and processor and isinstance(file_content, utils.BYTES_TYPES):
+        # rejected pushes are never decoded
+        is_interesting = processor.raw_source_of_interest(file_content)
+
+    # bytes are stored as they are, the processor gets them decoded once
+    raw_content = file_content
+    if is_interesting and isinstance(file_content, utils.BYTES_TYPES):
+        file_content = utils.save_string(file_content)
+
     if is_interesting and processor:
         is_interesting = processor.source_of_interest(
             file_content
@@ -85,57 +118,59 @@ def process_content(provider_name,
     incidents = []
     do_not_send_to_witness = True
     if is_interesting:
-        # store found file again
-        file_name = processed_store.save(
-            provider_name,
-            file_content,
-            file_ext=file_ending)
+        if archive:
+            # store found file again
+            file_name = processed_store.save(
+                provider_name,
+                raw_content if isinstance(raw_content, (str,) + utils.BYTES_TYPES) else json.dumps(raw_content),
+                file_ext=file_ending)
         try:
             # process content (should be asynchronous)
             if processor:
                 for incident in processor.process(file_content):
-                    logging.getLogger(__name__ + "_" + provider_name).debug("Postprocessing " + incident["unique_string"])
-                    incident["provider_info"]["source_file"] = file_name
+                    logger.debug("Postprocessing %s", incident["unique_string"])
+                    if file_name is not None:
+                        incident["provider_info"]["source_file"] = file_name
                     incidents.append(incident)
+                    metrics.INCIDENTS.labels(provider_name, "found").inc()
                     # only send if its a new incident
-                    logging.getLogger(__name__ + "_" + provider_name).debug(" ... exists")
+                    logger.debug(" ... exists")
                     do_not_send_to_witness = incident_store.exists(
                         provider_name,
                         file_ext=".json",
                         file_name=incident["unique_string"])
 
-                    if not do_not_send_to_witness:
-                        logging.getLogger(__name__ + "_" + provider_name).debug(" ... save in incidents folder")
+                    if do_not_send_to_witness:
+                        metrics.INCIDENTS.labels(provider_name, "duplicate").inc()
+                    else:
+                        metrics.INCIDENTS.labels(provider_name, "new").inc()
+                        logger.debug(" ... save in incidents folder")
                         # save locally
                         incident_file = incident_store.save(
                             provider_name,
-                            json.dumps(incident),
+                            jsoncodec.dumps(incident),
                             file_ext=".json",
                             file_name=incident["unique_string"])
                         try:
-                            logging.getLogger(__name__ + "_" + provider_name).debug(" ... save in incidents database")
-                            incidents_storage.insert_incident(incident)
+                            logger.debug(" ... save in incidents database")
+                            with metrics.MONGO_INSERT_LATENCY.time(), profiling.profiled("insert_incident", provider_name):
+                                incidents_storage.insert_incident(incident)
                         except DuplicateIncidentException:
                             pass
                         except Exception as e:
-                            logging.getLogger(__name__ + "_" + provider_name).info(provider_name + ": INSERT INTO stats failed, continueing anyways, incident file is " + incident_file + ", exception below")
-                            logging.getLogger(__name__ + "_" + provider_name).exception(e)
+                            logger.info("%s: INSERT INTO stats failed, continueing anyways, incident file is %s, exception below", provider_name, incident_file)
+                            logger.exception(e)
                         incident.pop("_id", None)
                         try:
-                            logging.getLogger(__name__ + "_" + provider_name).debug(" ... sending to witnesses (" + str(restrict_witness_group) + ", async_queue=" + str(async_queue) + ")")
-                            if async_queue:
-                                # send to witnesses
-                                thr = threading.Thread(target=_send_to_witness,
-                                                       args=(processor, incident, _find_targets(restrict_witness_group),))
-                                thr.start()  # we dont care when it finishes
-                            else:
-                                _send_to_witness(processor, incident, targets=_find_targets(restrict_witness_group))
+                            logger.debug(" ... sending to witnesses (%s, async_queue=%s)", restrict_witness_group, async_queue)
+                            # send to witnesses
+                            _start_sending_to_witness(processor, incident, _find_targets(restrict_witness_group), async_queue)
                         except Exception as e:
-                            logging.getLogger(__name__ + "_" + provider_name).info(provider_name + ": PUSH to witness failed, continueing anyways, incident file is " + incident_file + ", exception below")
-                            logging.getLogger(__name__ + "_" + provider_name).exception(e)
+                            logger.info("%s: PUSH to witness failed, continueing anyways, incident file is %s, exception below", provider_name, incident_file)
+                            logger.exception(e)
         except Exception as e:
-            logging.getLogger(__name__ + "_" + provider_name).info(provider_name + ": Processing failed, continueing anyways. Source file is " + file_name + ", exception below")
-            logging.getLogger(__name__ + "_" + provider_name).exception(e)
+            logger.info("%s: Processing failed, continueing anyways. Source file is %s, exception below", provider_name, file_name)
+            logger.exception(e)
 
     return {
         "file_name": file_name,
@@ -146,17 +181,38 @@ def process_content(provider_name,
     }
 
 
+# (configuration revision, all witnesses, group/url/name -> matching witnesses in configuration order)
+TARGETS_INDEX = None
+
+
+def _get_targets_index():
+    global TARGETS_INDEX
+    index = TARGETS_INDEX
+    if index is None or index[0] != Config.revision:
+        revision = Config.revision
+        witnesses = Config.get("subscriptions", "witnesses")
+        per_key = {}
+        for witness in witnesses:
+            for key in {witness.get("group", None), witness["url"], witness.get("name", None)}:
+                if key is not None:
+                    per_key.setdefault(key, []).append(witness)
+        index = (revision, witnesses, per_key)
+        TARGETS_INDEX = index
+    return index
+
+
 def _find_targets(target):
-    matched = []
-    for witness in Config.get("subscriptions", "witnesses"):
-        if target is not None:
-            if target == witness.get("group", None):
-                matched.append(witness)
-            elif target == witness["url"] or target == witness.get("name", None):
-                matched.append(witness)
-        else:
-            matched.append(witness)
-    return matched
+    """ Returns the subscribed witnesses whose group, url or name equals target, all if target is None.
+        The returned list must not be modified
+    """
+    unused, witnesses, per_key = _get_targets_index()
+    if target is None:
+        return witnesses
+    try:
+        return per_key.get(target, [])
+    except TypeError:
+        # unhashable target, e.g. a comma separated list from a request
+        return []
 
 
 def replay(restrict_witness_group=None,
@@ -168,7 +224,8 @@ def replay(restrict_witness_group=None,
            async_execution=None,
            async_queue=None,
            only_report=None,
-           target=None):
+           target=None,
+           matches=None):
     if name_filter is None and (incidents is None or incidents == []):
         report = {"name_filter": "Name filter must not be empty"}
         return report
@@ -251,13 +308,20 @@ def replay(restrict_witness_group=None,
 
         replay_stats["folder_filter"] = folder_filter
         replay_stats["name_filter"] = name_filter
+        replay_stats["matches"] = matches
+
+        # filter expression on top of the name filter, see filters.compile_filter
+        incident_filter = filters.compile_filter(matches) if matches else None
 
+        if backend_name(IncidentFileStore.STORE_NAME) != "file":
+            logging.getLogger(__name__).warning("Replay: the incident store uses the %s backend, its incidents are not found, only the database and files in dump/d_incidents are searched", backend_name(IncidentFileStore.STORE_NAME))
         logging.getLogger(__name__).info("Replay: Finding all incidents in file dump with configuration " + str(replay_stats))
-        for incident in processor.process_generic(
+        for incident in processor.iter_generic(
                 folder="dump/d_incidents",
                 folder_filter=folder_filter,
                 name_filter=name_filter):
-            incidents.append(incident)
+            if incident_filter is None or incident_filter.matches(incident):
+                incidents.append(incident)
 
         if len(received) == 2:
             logging.getLogger(__name__).info("Replay: Querying local database for incidents")
@@ -277,14 +341,18 @@ def replay(restrict_witness_group=None,
                 #        _till = datetime(received[0][0:4], received[0][4:6], 28, 23, 59, tzinfo=tzutc())
                 #else: 
                 #    _from = None
+                found = set(x["provider_info"]["name"] + "-" + x["unique_string"] for x in incidents)
                 for incident in incidents_storage.get_incidents(
                     dict(
                         unique_string={"$regex": regex_filter, "$options": "i"}#,
                         #timestamp={"$lt": float(_till.timestamp()), "$gt": float(_from.timestamp())}
                     )
                 ):
+                    if incident_filter is not None and not incident_filter.matches(incident):
+                        continue
                     # don't add duplicates
-                    if incident["provider_info"]["name"] + "-" + incident["unique_string"] not in [x["provider_info"]["name"] + "-" + x["unique_string"] for x in incidents]:
+                    if incident["provider_info"]["name"] + "-" + incident["unique_string"] not in found:
+                        found.add(incident["provider_info"]["name"] + "-" + incident["unique_string"])
                         incidents.append(incident)
             except Exception as e:
                 logging.getLogger(__name__).warning("MongoDB not reachable, continueing anyways" + str(e))
@@ -0,0 +1,98 @@
+import json
+import logging
+
+from . import Config
+
+try:
+    import orjson
+except ImportError:  # optional, see CODECS
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # optional, see CODECS
+    ujson = None
+
+
+"""
+    JSON codec of the incident pipeline, see :func:`dumps` and :func:`loads`.
+
+    json_codec selects orjson, ujson or json (stdlib), auto takes the fastest one that is
+    installed. All codecs write compact utf-8 bytes, values the selected codec can not
+    serialize (e.g. non-str keys with orjson) are written by the stdlib instead.
+"""
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(content):
+    if isinstance(content, memoryview):
+        content = str(content, "utf-8")
+    return json.loads(content)
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+
+
+def _ujson_loads(content):
+    if isinstance(content, (bytearray, memoryview)):
+        content = str(content, "utf-8")
+    return ujson.loads(content)
+
+
+# name -> (dumps to bytes, loads from str or bytes-like), fastest first
+CODECS = {}
+if orjson is not None:
+    CODECS["orjson"] = (orjson.dumps, orjson.loads)
+if ujson is not None:
+    CODECS["ujson"] = (_ujson_dumps, _ujson_loads)
+CODECS["json"] = (_json_dumps, _json_loads)
+
+# (config revision, name, dumps, loads)
+_SETTINGS = None
+
+
+def _settings():
+    global _SETTINGS
+    settings = _SETTINGS
+    if settings is None or settings[0] != Config.revision:
+        revision = Config.revision
+        name = Config.get("json_codec", default="auto") or "auto"
+        if name == "auto":
+            name = next(iter(CODECS))
+        elif name not in CODECS:
+            logging.getLogger(__name__).warning("JSON codec %s is not available, using json", name)
+            name = "json"
+        settings = (revision, name) + CODECS[name]
+        _SETTINGS = settings
+    return settings
+
+
+def codec_name():
+    return _settings()[1]
+
+
+def dumps(obj):
+    """ Serializes obj to compact utf-8 json bytes with the configured codec """
+    unused, name, codec_dumps, unused = _settings()
+    if codec_dumps is _json_dumps:
+        return _json_dumps(obj)
+    try:
+        return codec_dumps(obj)
+    except (TypeError, OverflowError):
+        return _json_dumps(obj)
+
+
+def loads(content):
+    """ Parses json given as str, bytes, bytearray or memoryview with the configured codec """
+    codec_loads = _settings()[3]
+    if codec_loads is _json_loads:
+        return _json_loads(content)
+    try:
+        return codec_loads(content)
+    except ValueError:
+        # e.g. NaN or integers beyond 64 bit, which only the stdlib accepts
+        return _json_loads(content)
@@ -0,0 +1,108 @@
+import re
+import copy
+import json
+import uuid
+import logging
+import contextvars
+from logging.handlers import QueueHandler
+
+
+"""
+    Helpers for the logging pipeline, see set_global_logger. This module must not
+    import the configuration, since it is used while the configuration is loaded.
+"""
+
+REQUEST_ID = contextvars.ContextVar("dataproxy_request_id", default=None)
+
+# request ids given by clients are only used if they match, otherwise a new one is generated
+VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+def get_request_id():
+    return REQUEST_ID.get()
+
+
+def set_request_id(request_id=None):
+    """ Binds the given (or a new) request id to the current context and returns the reset token """
+    if request_id is None:
+        request_id = uuid.uuid4().hex[0:16]
+    return REQUEST_ID.set(request_id)
+
+
+def reset_request_id(token):
+    REQUEST_ID.reset(token)
+
+
+def run_in_context(target):
+    """ Wraps target such that it runs with a copy of the current context (e.g. the request id)
+        when started in a different thread """
+    context = contextvars.copy_context()
+
+    def wrapped(*args, **kwargs):
+        return context.run(target, *args, **kwargs)
+    return wrapped
+
+
+class RequestIdFilter(logging.Filter):
+    """ Adds the request_id attribute to every record, '-' if outside of a request """
+
+    def filter(self, record):
+        request_id = REQUEST_ID.get()
+        record.request_id = request_id if request_id is not None else "-"
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """ Formats every record as one json object per line """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """ Enqueues records for a QueueListener in the same process. Unlike QueueHandler the
+        record is not formatted here, only its arguments are merged and a traceback is
+        rendered, such that the listener handlers apply their own formatter """
+
+    _TRACEBACK_FORMATTER = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = LocalQueueHandler._TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestIdMiddleware(object):
+    """ Falcon middleware that assigns a request id to every request. An incoming
+        X-Request-ID header is reused if it is valid (see VALID_REQUEST_ID), the id is
+        returned in the response header """
+
+    HEADER = "X-Request-ID"
+
+    def process_request(self, req, resp):
+        request_id = req.get_header(RequestIdMiddleware.HEADER)
+        if request_id is not None and not VALID_REQUEST_ID.match(request_id):
+            request_id = None
+        req.context["request_id_token"] = set_request_id(request_id)
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        token = req.context.get("request_id_token", None)
+        if token is not None:
+            resp.set_header(RequestIdMiddleware.HEADER, token.var.get())
+            reset_request_id(token)
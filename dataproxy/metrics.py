@@ -0,0 +1,303 @@
+"""
+    In-process metrics that can be scraped in the Prometheus text format.
+
+    Every metric keeps one small child object per label combination. Recording
+    only takes the lock of that child for a couple of integer additions, label
+    resolution is a plain dict hit once the child exists.
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = ['{0}="{1}"'.format(name, _escape(value)) for name, value in zip(label_names, label_values)]
+    if extra is not None:
+        pairs.append('{0}="{1}"'.format(extra[0], _escape(extra[1])))
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _CounterChild(object):
+    __slots__ = ("_lock", "_value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = value
+
+
+class _HistogramChild(object):
+    __slots__ = ("_lock", "_upper_bounds", "_counts", "_sum", "_count")
+
+    def __init__(self, upper_bounds):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def get(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+
+class _Metric(object):
+    TYPE = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if not self.label_names:
+            self._default_child = self._new_child()
+            self._children[()] = self._default_child
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def children(self):
+        """ Returns (label values, child) of all label combinations seen so far """
+        return list(self._children.items())
+
+    def labels(self, *label_values):
+        """ Returns the child for the given label values, creates it on first use """
+        try:
+            return self._children[label_values]
+        except KeyError:
+            pass
+        if len(label_values) != len(self.label_names):
+            raise ValueError("Metric " + self.name + " expects labels " + str(self.label_names))
+        with self._children_lock:
+            child = self._children.get(label_values)
+            if child is None:
+                child = self._new_child()
+                self._children[label_values] = child
+            return child
+
+    def _samples(self):
+        raise NotImplementedError()
+
+    def expose(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation),
+                 "# TYPE {0} {1}".format(self.name, self.TYPE)]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default_child.inc(amount)
+
+    def _samples(self):
+        for label_values, child in list(self._children.items()):
+            yield self.name + "_total" + _format_labels(self.label_names, label_values) + " " + _format_value(child.get())
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default_child.inc(amount)
+
+    def dec(self, amount=1):
+        self._default_child.dec(amount)
+
+    def set(self, value):
+        self._default_child.set(value)
+
+    def _samples(self):
+        for label_values, child in list(self._children.items()):
+            yield self.name + _format_labels(self.label_names, label_values) + " " + _format_value(child.get())
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self._upper_bounds = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, label_names)
+
+    @property
+    def upper_bounds(self):
+        return self._upper_bounds
+
+    def _new_child(self):
+        return _HistogramChild(self._upper_bounds)
+
+    def observe(self, value):
+        self._default_child.observe(value)
+
+    def time(self):
+        return self._default_child.time()
+
+    def _samples(self):
+        for label_values, child in list(self._children.items()):
+            counts, total, count = child.get()
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self._upper_bounds + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket" +\
+                    _format_labels(self.label_names, label_values, ("le", _format_value(float(upper_bound)))) +\
+                    " " + str(cumulative)
+            yield self.name + "_sum" + _format_labels(self.label_names, label_values) + " " + _format_value(total)
+            yield self.name + "_count" + _format_labels(self.label_names, label_values) + " " + str(count)
+
+
+class Registry(object):
+    """ Holds all metrics of this process, metrics are registered on creation """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric " + metric.name + " is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def expose(self):
+        """ Returns all metrics in the Prometheus text exposition format """
+        return "\n".join(metric.expose() for metric in list(self._metrics.values())) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, label_names=()):
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+
+def gauge(name, documentation, label_names=()):
+    return REGISTRY.register(Gauge(name, documentation, label_names))
+
+
+def histogram(name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets))
+
+
+# --------- metrics of the incident pipeline -------------
+
+PUSH_BYTES = histogram(
+    "dataproxy_push_bytes",
+    "Size of received pushes in bytes",
+    ("provider",),
+    BYTES_BUCKETS)
+PARSE_LATENCY = histogram(
+    "dataproxy_push_parse_seconds",
+    "Time spent reading, archiving and decoding a push before its content is processed",
+    ("provider",))
+PUSH_LATENCY = histogram(
+    "dataproxy_push_latency_seconds",
+    "Time spent handling a push, from reading the request until the response is set",
+    ("provider",))
+INCIDENTS = counter(
+    "dataproxy_incidents",
+    "Incidents seen while processing pushes, by outcome (found, new, duplicate)",
+    ("provider", "outcome"))
+PREPARE_FOR_DUMP_LATENCY = histogram(
+    "dataproxy_prepare_for_dump_seconds",
+    "Time spent in CommonFormat.prepare_for_dump per incident")
+NORMALIZE_LATENCY = histogram(
+    "dataproxy_normalize_seconds",
+    "Time spent in the bookiesports normalizer per incident")
+VALIDATE_LATENCY = histogram(
+    "dataproxy_validate_seconds",
+    "Time spent in the incident validator per incident")
+STORE_WRITE_LATENCY = histogram(
+    "dataproxy_store_write_seconds",
+    "Time spent writing one item to a store",
+    ("store",))
+JSON_CACHE_LOOKUPS = counter(
+    "dataproxy_json_cache_lookups",
+    "Lookups of the json cache of the processors, by where they were answered (memory, store, miss)",
+    ("cache", "result"))
+MONGO_INSERT_LATENCY = histogram(
+    "dataproxy_mongo_insert_seconds",
+    "Time spent inserting one incident into the incident database")
+WITNESS_POST_LATENCY = histogram(
+    "dataproxy_witness_post_seconds",
+    "Time spent posting one incident to a witness, including retries",
+    ("witness",))
+WITNESS_POSTS = counter(
+    "dataproxy_witness_posts",
+    "Incidents posted to witnesses, by outcome (ok, http_error, exception)",
+    ("witness", "outcome"))
+DELIVERY_QUEUE_DEPTH = gauge(
+    "dataproxy_delivery_queue_depth",
+    "Incidents currently waiting for or being delivered to witnesses")
+POLL_CYCLE_SECONDS = histogram(
+    "dataproxy_poll_cycle_seconds",
+    "Duration of one poll cycle of a provider poller",
+    ("poller",),
+    (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+POLL_LAG_SECONDS = gauge(
+    "dataproxy_poll_lag_seconds",
+    "Time the last poll cycle of a provider poller exceeded its polling interval",
+    ("poller",))
@@ -1,6 +1,11 @@
 import requests
 import pika
+import heapq
+import threading
+import functools
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 from . import utils
@@ -66,3 +71,247 @@ class PikaConsumer(ABC):
     @abstractmethod
     def on_message(self, channel, method_frame, header_frame, body):
         pass
+
+
+def _select_connection(parameters, on_open_callback, on_open_error_callback, on_close_callback):
+    return pika.SelectConnection(parameters=parameters,
+                                 on_open_callback=on_open_callback,
+                                 on_open_error_callback=on_open_error_callback,
+                                 on_close_callback=on_close_callback)
+
+
+class AsyncPikaConsumer(ABC):
+    """ Consumes a queue through an asynchronous connection and processes the messages
+        in a pool of worker threads, such that a slow message does not stall the channel.
+
+        - Processed messages are acknowledged in batches with one multiple ack up to the
+          oldest message that is still being processed, at least every ack_interval seconds
+        - The prefetch count (at most max_in_flight) limits the unacknowledged messages, the
+          broker delivers the next message only once an earlier one is acknowledged. If a slow
+          message holds back the multiple ack while the window is full, the ack timer
+          acknowledges the processed messages after it one by one
+        - A lost connection is reestablished with exponential backoff, unacknowledged
+          messages are then redelivered by the broker
+
+        on_message is called in a worker thread and must not use the channel. If it raises,
+        the message is rejected (and requeued if requeue_on_error is set).
+
+        connection_factory(parameters, on_open_callback, on_open_error_callback, on_close_callback)
+        creates the connection, defaults to pika.SelectConnection (pika >= 1.0).
+    """
+
+    def __init__(self,
+                 hostname,
+                 port,
+                 user,
+                 password,
+                 virtual_host,
+                 queue_name,
+                 max_workers=8,
+                 prefetch_count=None,
+                 max_in_flight=None,
+                 ack_batch_size=100,
+                 ack_interval=0.5,
+                 requeue_on_error=False,
+                 reconnect_delay=1,
+                 max_reconnect_delay=60,
+                 connection_factory=None
+                 ):
+        self.hostname = hostname
+        self.port = port
+        self.user = user
+        self.password = password
+        self.virtual_host = virtual_host
+        self.queue_name = queue_name
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight if max_in_flight is not None else max_workers * 8
+        # the broker stops delivering at prefetch_count unacknowledged messages
+        self.prefetch_count = min(prefetch_count, self.max_in_flight) if prefetch_count else self.max_in_flight
+        self.ack_batch_size = ack_batch_size
+        self.ack_interval = ack_interval
+        self.requeue_on_error = requeue_on_error
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._connection_factory = connection_factory if connection_factory is not None else _select_connection
+
+        self._stopping = threading.Event()
+        self._executor = None
+        self._connection = None
+        self._channel = None
+        self._consumer_tag = None
+        self._reconnect_attempts = 0
+        # increased on every connection, completions of an earlier connection are dropped
+        self._generation = 0
+        # delivery tags being processed, in delivery order
+        self._in_flight = OrderedDict()
+        # heap of processed delivery tags that are not acknowledged yet
+        self._completed = []
+
+    def log(self, message):
+        logger = logging.getLogger(__name__ + "_" + self.hostname)
+        if isinstance(message, Exception):
+            logger.error(message)
+        else:
+            logger.info(message)
+
+    @abstractmethod
+    def on_message(self, channel, method_frame, header_frame, body):
+        pass
+
+    def consume(self):
+        """ Consumes until stop is called """
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="PikaConsumer_" + self.queue_name)
+        try:
+            while not self._stopping.is_set():
+                self._connection = self._connect()
+                try:
+                    self._connection.ioloop.start()
+                except KeyboardInterrupt:
+                    self.stop()
+                    # finish processing and close the connection
+                    self._connection.ioloop.start()
+                if not self._stopping.is_set():
+                    delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** self._reconnect_attempts)
+                    self._reconnect_attempts += 1
+                    self.log("Connection to " + str(self.hostname) + " lost, reconnecting in " + str(delay) + " seconds")
+                    self._stopping.wait(delay)
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def stop(self):
+        """ Stops consuming, messages being processed are acknowledged before the connection
+            is closed. Can be called from any thread
+        """
+        self._stopping.set()
+        connection = self._connection
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(self._begin_stop)
+
+    def _connect(self):
+        self.log("Initializing connection to " + str(self.hostname) + ":" + str(self.port))
+        credentials = pika.PlainCredentials(self.user, self.password)
+        parameters = pika.ConnectionParameters(self.hostname,
+                                               self.port,
+                                               self.virtual_host,
+                                               credentials)
+        return self._connection_factory(parameters,
+                                        self._on_connection_open,
+                                        self._on_connection_open_error,
+                                        self._on_connection_closed)
+
+    # ------ callbacks below run in the thread of the io loop ------
+
+    def _on_connection_open(self, connection):
+        self._reconnect_attempts = 0
+        self._generation += 1
+        self._in_flight.clear()
+        self._completed = []
+        self.log("Connecting to queue " + self.queue_name)
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        self.log(error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._channel = None
+        self._consumer_tag = None
+        if not self._stopping.is_set():
+            self.log("Connection closed: " + str(reason))
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.basic_qos(prefetch_count=self.prefetch_count, callback=self._on_qos_ok)
+
+    def _on_channel_closed(self, channel, reason):
+        self._channel = None
+        self._consumer_tag = None
+        if not (self._connection.is_closing or self._connection.is_closed):
+            self.log("Channel closed: " + str(reason))
+            self._connection.close()
+
+    def _on_qos_ok(self, frame):
+        self._connection.ioloop.call_later(self.ack_interval, self._on_ack_timer)
+        if self._stopping.is_set():
+            self._close()
+        else:
+            self._start_consuming()
+
+    def _start_consuming(self):
+        self.log("Starting to consume ... ")
+        self._consumer_tag = self._channel.basic_consume(self.queue_name, self._on_delivery)
+
+    def _on_delivery(self, channel, method_frame, header_frame, body):
+        self._in_flight[method_frame.delivery_tag] = True
+        self._executor.submit(self._process, self._generation, channel, method_frame, header_frame, body)
+
+    def _on_processed(self, generation, delivery_tag, success):
+        if generation != self._generation or self._channel is None:
+            # the channel of this delivery is gone, the broker redelivers it
+            return
+        self._in_flight.pop(delivery_tag, None)
+        if success:
+            heapq.heappush(self._completed, delivery_tag)
+        else:
+            self._channel.basic_nack(delivery_tag=delivery_tag, requeue=self.requeue_on_error)
+        if len(self._completed) >= min(self.ack_batch_size, max(1, self.prefetch_count // 2)):
+            self._flush_acks()
+        if self._stopping.is_set() and not self._in_flight:
+            self._close()
+
+    def _on_ack_timer(self):
+        if self._channel is None:
+            return
+        self._flush_acks(unblock=True)
+        self._connection.ioloop.call_later(self.ack_interval, self._on_ack_timer)
+
+    def _flush_acks(self, unblock=False):
+        """ Acknowledges all processed messages up to the oldest one still being processed,
+            with unblock also those after it if the prefetch window is full """
+        if self._channel is None:
+            return
+        oldest_in_flight = next(iter(self._in_flight)) if self._in_flight else None
+        highest = None
+        while self._completed and (oldest_in_flight is None or self._completed[0] < oldest_in_flight):
+            highest = heapq.heappop(self._completed)
+        if highest is not None:
+            self._channel.basic_ack(delivery_tag=highest, multiple=True)
+        if unblock and self._completed and len(self._in_flight) + len(self._completed) >= self.prefetch_count:
+            # the window is full behind a slow message, free it for new deliveries
+            for delivery_tag in self._completed:
+                self._channel.basic_ack(delivery_tag=delivery_tag)
+            self._completed = []
+
+    def _begin_stop(self):
+        if self._channel is not None and self._consumer_tag is not None:
+            self._channel.basic_cancel(self._consumer_tag)
+            self._consumer_tag = None
+        if not self._in_flight:
+            self._close()
+
+    def _close(self):
+        self._flush_acks()
+        if self._connection.is_closing or self._connection.is_closed:
+            self._connection.ioloop.stop()
+        else:
+            self.log("Closing connection to " + str(self.hostname))
+            self._connection.close()
+
+    # ------ runs in the worker threads ------
+
+    def _process(self, generation, channel, method_frame, header_frame, body):
+        try:
+            self.on_message(channel, method_frame, header_frame, body)
+            success = True
+        except Exception as e:
+            logging.getLogger(__name__).warning("%s: processing message %s failed", self.queue_name, method_frame.delivery_tag, exc_info=e)
+            success = False
+        try:
+            self._connection.ioloop.add_callback_threadsafe(
+                functools.partial(self._on_processed, generation, method_frame.delivery_tag, success))
+        except Exception as e:
+            # the connection is gone, the broker redelivers the message
+            logging.getLogger(__name__).debug("%s: could not report message %s as processed: %s", self.queue_name, method_frame.delivery_tag, e)
@@ -1,24 +1,46 @@
 import requests
 import os
-import json
 import io
 import logging
 import random
 import hashlib
 import time
+import itertools
 from time import strptime
+from collections import namedtuple
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 
 from . import utils
 from . import Config
+from . import metrics
+from . import profiling
+from . import archiver
+from . import filters
+from . import jsoncodec
 from .utils import CommonFormat
+from .cache import SeenSet, TieredJsonCache
+
+
+# witnesses get the incident as json bytes, see GenericProcessor.send_to_witness
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# file streamed out of an archive, see SourceStream
+ArchivedFile = namedtuple("ArchivedFile", ["archive", "name", "content"])
 
 
 class GenericProcessor(ABC):
 
     SHUFFLED_SUBSCRIBERS_PER_GROUP = None
     SHUFFLED_SUBSCRIBERS_EXPIRES = None
+    # configuration revision the shuffle was built from
+    SHUFFLED_SUBSCRIBERS_REVISION = None
+    # (shuffle per group, url -> list of (group, position in group), tuple of target urls -> filtered shuffle),
+    # replaced as a whole whenever the shuffle is refreshed
+    SHUFFLED_SUBSCRIBERS_INDEX = None
+
+    # byte strings that occur in every interesting push (e.g. mandatory keys), see raw_source_of_interest
+    INTEREST_NEEDLES = None
 
     @staticmethod
     def get_timed_shuffled_subscribers(targets=None):
@@ -33,11 +55,14 @@ class GenericProcessor(ABC):
             return []
 
         if GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP is None or\
-                now > GenericProcessor.SHUFFLED_SUBSCRIBERS_EXPIRES:
+                now > GenericProcessor.SHUFFLED_SUBSCRIBERS_EXPIRES or\
+                GenericProcessor.SHUFFLED_SUBSCRIBERS_REVISION != Config.revision:
+            revision = Config.revision
             subscribers = subscribers.copy()
             random.shuffle(subscribers)
 
             subscribers_per_group = {}
+            subscribers_by_url = {}
             # build list according to distinct chains
             for subscriber in subscribers:
                 if subscriber is None:
@@ -53,22 +78,32 @@ class GenericProcessor(ABC):
                         subscriber["whitelist_providers"] = subscriber.get("whitelist_providers", None)
                 if subscribers_per_group.get(subscriber["group"], None) is None:
                     subscribers_per_group[subscriber["group"]] = []
+                subscribers_by_url.setdefault(subscriber["url"], []).append(
+                    (subscriber["group"], len(subscribers_per_group[subscriber["group"]])))
                 subscribers_per_group[subscriber["group"]].append(subscriber)
+            GenericProcessor.SHUFFLED_SUBSCRIBERS_INDEX = (subscribers_per_group, subscribers_by_url, {})
             GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP = subscribers_per_group
             GenericProcessor.SHUFFLED_SUBSCRIBERS_EXPIRES = now + timedelta(
                 hours=Config.get("subscriptions", "shuffled_subscribers_expires_after_in_hours", 6)
             )
-            logging.getLogger(__name__).debug("Shuffled witnesses: " + str(GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP))
+            GenericProcessor.SHUFFLED_SUBSCRIBERS_REVISION = revision
+            logging.getLogger(__name__).debug("Shuffled witnesses: %s", GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP)
 
         if targets is not None:
-            return_value = {}
-            # filter out non targets
-            for group in GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP.keys():
-                for witness in GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP[group]:
-                    if witness["url"] in [x["url"] for x in targets]:
-                        if return_value.get(group, None) is None:
-                            return_value[group] = []
-                        return_value[group].append(witness)
+            per_group, by_url, per_targets = GenericProcessor.SHUFFLED_SUBSCRIBERS_INDEX
+            targets_key = tuple(x["url"] for x in targets)
+            return_value = per_targets.get(targets_key, None)
+            if return_value is None:
+                # filter out non targets, keeping the shuffled order within each group
+                positions = {}
+                for url in set(targets_key):
+                    for group, position in by_url.get(url, ()):
+                        positions.setdefault(group, []).append(position)
+                return_value = {}
+                for group in per_group.keys():
+                    if group in positions:
+                        return_value[group] = [per_group[group][position] for position in sorted(positions[group])]
+                per_targets[targets_key] = return_value
             return return_value
         else:
             return GenericProcessor.SHUFFLED_SUBSCRIBERS_PER_GROUP
@@ -77,28 +112,20 @@ class GenericProcessor(ABC):
     def __init__(self, file_ending=None, file_cache_store=None):
         self._allowed_file_ending = file_ending
         self._file_cache_store = file_cache_store
-        self._debug_identifiers = None
+        self._json_cache = None
+        self._debug_filter = None
 
         self._skip_on_error = False
 
     def debug_games(self, identifiers):
-        if isinstance(identifiers, str):
-            self._debug_identifiers = [identifiers.lower()]
-        elif isinstance(identifiers, int):
-            self._debug_identifiers = [identifiers]
-        else:
-            self._debug_identifiers = identifiers
+        """ Only incidents matching the identifiers (or filter expression) are found,
+            see filters.compile_filter """
+        self._debug_filter = filters.compile_filter(identifiers)
 
     def _matches_if_debug(self, incident):
-        if self._debug_identifiers is None:
+        if self._debug_filter is None:
             return True
-        matches = False
-        _incident_string = json.dumps(incident).lower()
-        for _identifier in self._debug_identifiers:
-            matches = str(_identifier).lower() in _incident_string
-            if matches:
-                return matches
-        return False
+        return self._debug_filter.matches(incident)
 
     def process_generic(self,
                         files=None,
@@ -106,31 +133,41 @@ class GenericProcessor(ABC):
                         as_string=None,
                         folder_filter=None,
                         name_filter=None):
-        if files is None:
-            files = []
-        if folder is None:
-            folder = []
-        if as_string is None:
-            as_string = []
-        # unify all sources into all_sources field
-        self.folder = folder
-        if isinstance(as_string, str):
-            as_string = [as_string]
-        if isinstance(files, str):
-            files = [files]
-        self.files = files
-        self.files_as_string = as_string
-        if type(folder_filter) == set:
-            folder_filter = list(folder_filter)
-        self.folder_filter = folder_filter
-        if type(name_filter) == str:
-            name_filter = [name_filter]
-        self.name_filter = name_filter
-        self._populate_source_list()
-        # find incidents in given sources
-        return self._find_incidents()
+        """ Finds all incidents in the given sources, see iter_generic """
+        incidents = {}
+        with profiling.profiled("find_incidents"):
+            for incident in self.iter_generic(files, folder, as_string, folder_filter, name_filter, dedup_capacity=None):
+                # use unique_string for duplicate prevention
+                incidents.setdefault(incident["unique_string"] + incident["provider_info"]["name"], incident)
+        return incidents.values()
+
+    def iter_generic(self,
+                     files=None,
+                     folder=None,
+                     as_string=None,
+                     folder_filter=None,
+                     name_filter=None,
+                     dedup_capacity=100000):
+        """ Yields the incidents of the given sources as they are found.
+
+            The state of the run lives in the generator (see SourceStream), such that one processor
+            can be used by several streams at once. Folders are walked lazily and only the last
+            dedup_capacity incidents are remembered to skip duplicates (None disables it), i.e.
+            memory does not grow with the amount of sources.
+        """
+        stream = SourceStream(self, files, folder, as_string, folder_filter, name_filter)
+        seen = SeenSet(capacity=dedup_capacity) if dedup_capacity else None
+        for incident in self._iter_incidents(stream):
+            if seen is not None and seen.check_and_add(incident["unique_string"] + incident["provider_info"]["name"]):
+                continue
+            incident["timestamp"] = utils.date_to_string()
+            logging.getLogger(__name__).debug("incident found: %s", incident["unique_string"])
+            yield incident
 
     def process(self, as_string):
+        if isinstance(as_string, (dict, list)):
+            # already parsed payload
+            return self.process_generic(as_string=[as_string])
         return self.process_generic(as_string=as_string)
 
     def skip_on_error(self):
@@ -139,82 +176,30 @@ class GenericProcessor(ABC):
     def _is_allowed_file(self, file):
         return self._allowed_file_ending and file.endswith(self._allowed_file_ending)
 
-    def _is_filtered_subfolder(self, folder, abs_path):
-        # no filter set, descend into all
-        if not self.folder_filter:
-            logging.getLogger(__name__).debug("No filter, adding " + abs_path)
-            return True
-
-        # folder is directly containted, take it
-        if folder in self.folder_filter:
-            logging.getLogger(__name__).debug("Direct match " + abs_path)
-            return True
-
-        # special case: last filder can have special meaning
-        if self.folder_filter[len(self.folder_filter) - 1].startswith("after:") and folder.startswith("2"):
-            after_folder = self.folder_filter[len(self.folder_filter) - 1].split("after:")[1]
-            after_folder = strptime(after_folder, "%Y%m%d")
-            folder_time = strptime(folder, "%Y%m%d")
-            if (after_folder < folder_time):
-                logging.getLogger(__name__).debug("Special action after: true " + abs_path)
-                return True
-
-        # matched with startswith
-        if folder.startswith(tuple(self.folder_filter)):
-            logging.getLogger(__name__).debug("Matched with startswith! " + abs_path)
-            return True
-
-        # special case: only provider given, always dive into date folders (starting with 2[018])
-        if len(self.folder_filter) == 1 and not self.folder_filter[0].startswith("2") and folder.startswith("2"):
-            logging.getLogger(__name__).debug("Only provider given, using all date folders! " + abs_path)
-            return True
-
-    def _populate_folder(self, folder):
-        for file in os.listdir(folder):
-            abs_path = os.path.join(folder, file)
-            if os.path.isdir(abs_path):
-                if self._is_filtered_subfolder(file, abs_path):
-                    self._populate_folder(abs_path)
-            else:
-                if self._is_allowed_file(file):
-                    self.files.append(abs_path)
-
-    def _populate_source_list(self):
-        if not self.files and self.folder:
-            self._populate_folder(self.folder)
-        self.all_sources = []
-        for item in self.files:
-            self._add_as_source(item)
-        for item in self.files_as_string:
-            self._add_as_source(item)
-
-    def _add_as_source(self, file_name):
-        if self.name_filter is not None:
-            match_to = os.path.basename(file_name.lower())
-            add = True
-            for tmp in self.name_filter:
-                if tmp.lower() not in match_to:
-                    add = False
-            if add:
-                self.all_sources.append(file_name)
-        else:
-            self.all_sources.append(file_name)
-
     def _parse_raw(self, raw_file_content):
         raise Exception("Abstract method")
 
-    def _find_incidents(self):
-        incidents = {}
-        for source in self.all_sources:
-            if source.endswith(".raw"):
+    def _iter_incidents(self, sources):
+        for source in sources:
+            if isinstance(source, ArchivedFile):
+                if source.name.endswith(".raw"):
+                    source = self._parse_raw(source.content)
+                    if not source or not self.source_of_interest(source):
+                        continue
+                else:
+                    source = source.content
+            elif isinstance(source, str) and source.endswith(".raw"):
                 source = self._parse_raw(io.open(source, encoding="utf-8").read())
                 if not source or not self.source_of_interest(source):
                     continue
             incident = None
+            found = []
             try:
                 # file or string?
                 # TODO rework how files are recognized
-                if self._is_allowed_file(source):
+                if not isinstance(source, str):
+                    incidentList = self._process_source(source, "parsed")
+                elif self._is_allowed_file(source):
                     incidentList = self._process_source(source, "file")
                 else:
                     incidentList = self._process_source(source, "string")
@@ -230,14 +215,9 @@ class GenericProcessor(ABC):
                             continue
                         # ensure the json format is correct
                         incident = CommonFormat().prepare_for_dump(incident)
-                        # use unique_string for duplicate prevention
-                        unique_string = incident["unique_string"] + incident["provider_info"]["name"]
                         # only return it if its interesting
-                        if self._incident_of_interest(incident) and\
-                                not incidents.get(unique_string):
-                            incident["timestamp"] = utils.date_to_string()
-                            incidents[unique_string] = incident
-                            logging.getLogger(__name__).debug("incident found: " + incident["unique_string"])
+                        if self._incident_of_interest(incident):
+                            found.append(incident)
             except Exception as e:
                 message = None
                 if incident:
@@ -247,36 +227,32 @@ class GenericProcessor(ABC):
                 logging.getLogger(__name__).error("Error parsing, " + str(e) + "\n" + message)
                 if not self._skip_on_error:
                     raise e
-        return incidents.values()
+            for incident in found:
+                yield incident
+
+    def _get_json_cache(self):
+        if self._json_cache is None:
+            ttl = Config.get("json_cache", "ttl_in_seconds", default=None)
+            self._json_cache = TieredJsonCache(
+                self._file_cache_store,
+                self.__class__.__name__,
+                capacity=Config.get("json_cache", "capacity", default=10000),
+                max_bytes=Config.get("json_cache", "max_megabytes", default=64) * 1024 * 1024,
+                ttl=ttl if ttl else None)
+        return self._json_cache
 
     def _resolve_json_with_file_cache(self,
                                       identifier,
                                       getter=None,
                                       overwrite=False):
-        """ If a file with the identifier exists, return its content.
-            Otherwise call getter, store content in file and return """
+        """ If the identifier is cached (in memory or the file cache store), return its content.
+            Otherwise call getter, cache its content and return it. The returned objects are
+            shared between lookups and must not be modified. """
         if not getter:
             def getter():
                 return None
         if self._file_cache_store:
-            sub_folder = self.__class__.__name__
-            identifier = utils.slugify(identifier)
-            if not overwrite and self._file_cache_store.exists(sub_folder,
-                                                               ".json",
-                                                               identifier):
-                stream, stream_len = self._file_cache_store.open(
-                    sub_folder,
-                    identifier + ".json"
-                )
-                return utils.save_json_loads(stream.read(stream_len))
-            else:
-                json_object = getter()
-                if json_object:
-                    self._file_cache_store.save(sub_folder,
-                                                json.dumps(json_object),
-                                                file_ext=".json",
-                                                file_name=identifier)
-                return json_object
+            return self._get_json_cache().get(utils.slugify(identifier), getter, overwrite=overwrite)
         else:
             return getter()
 
@@ -287,16 +263,34 @@ class GenericProcessor(ABC):
     def source_of_interest(self, source):
         return True
 
+    def raw_source_of_interest(self, raw_content):
+        """ Pre-filter on the raw bytes of a push, applied before they are decoded or archived.
+            Pushes it returns False for are rejected, all others still go through source_of_interest.
+
+            By default every byte string of INTEREST_NEEDLES has to occur in the push.
+        """
+        if not self.INTEREST_NEEDLES:
+            return True
+        haystack = raw_content
+        if isinstance(raw_content, memoryview) and isinstance(raw_content.obj, (bytes, bytearray)):
+            # searching the whole underlying buffer instead of copying the view can only add
+            # false positives, which source_of_interest sorts out
+            haystack = raw_content.obj
+        elif not isinstance(raw_content, (bytes, bytearray)):
+            haystack = bytes(raw_content)
+        return all(needle in haystack for needle in self.INTEREST_NEEDLES)
+
     @abstractmethod
     def _incident_of_interest(self, incident):
         return True
 
     def _do_post(self, url, json_content):
+        """ Posts the serialized incident (json bytes, see jsoncodec) """
         retries = Config.get("subscriptions", "retry_on_error", "number", 1)
         delay = Config.get("subscriptions", "retry_on_error", "delay", 2)
         while True:
             try:
-                return requests.post(url, json=json_content, timeout=1)
+                return requests.post(url, data=json_content, headers=JSON_HEADERS, timeout=1)
             except Exception as e:
                 if retries > 0:
                     retries = retries - 1
@@ -323,6 +317,8 @@ class GenericProcessor(ABC):
             return {}
 
         subscribed_witnesses_status = {}
+        # serialized once, the same bytes are posted to every witness
+        json_content = jsoncodec.dumps(incident)
 
         shuffled_per_group = GenericProcessor.get_timed_shuffled_subscribers(targets)
         delay_to_next = Config.get("subscriptions", "delay_to_next_witness_in_seconds", 30)
@@ -337,35 +333,37 @@ class GenericProcessor(ABC):
                 if subscribed_witnesses_send is not None and\
                         unmasked_provider_info["name"] not in subscribed_witnesses_send:
                     logging.getLogger(__name__).debug(
-                        "Sending to witness {0} was skipped, provider {1} not allowed ...".format(
-                            witness_url,
-                            unmasked_provider_info["name"]
-                        )
+                        "Sending to witness %s was skipped, provider %s not allowed ...",
+                        witness_url,
+                        unmasked_provider_info["name"]
                     )
                     continue
 
                 success = False
+                outcome = "exception"
 
+                started = time.perf_counter()
                 try:
-                    response = self._do_post(witness_url, incident)
+                    response = self._do_post(witness_url, json_content)
                     success = response and response.status_code == 200
+                    outcome = "ok" if success else "http_error"
                     errorMessage = "HTTP response " + str(response.status_code)
                 except Exception as e:
                     errorMessage = str(e)
+                metrics.WITNESS_POST_LATENCY.labels(witness_url).observe(time.perf_counter() - started)
+                metrics.WITNESS_POSTS.labels(witness_url, outcome).inc()
 
                 if not success:
                     logging.getLogger(__name__).info(
-                        "Sending to witness {0} has failed due to {1}, continueing ...".format(
-                            witness_url,
-                            errorMessage
-                        )
+                        "Sending to witness %s has failed due to %s, continueing ...",
+                        witness_url,
+                        errorMessage
                     )
                     subscribed_witnesses_status[witness_url] = errorMessage
                 else:
                     logging.getLogger(__name__).debug(
-                        "Sending to witness {0} was successfull".format(
-                            witness_url
-                        )
+                        "Sending to witness %s was successfull",
+                        witness_url
                     )
                     subscribed_witnesses_status[witness_url] = "ok"
 
@@ -376,6 +374,130 @@ class GenericProcessor(ABC):
         return subscribed_witnesses_status
 
 
+class SourceStream(object):
+    """ Files, folders and strings of one processing run, see GenericProcessor.iter_generic.
+
+        Iterating yields file paths and strings, then the matching files of archives
+        (see ArchivedFile). Folders are walked lazily.
+    """
+
+    def __init__(self,
+                 processor,
+                 files=None,
+                 folder=None,
+                 as_string=None,
+                 folder_filter=None,
+                 name_filter=None):
+        if files is None:
+            files = []
+        if folder is None:
+            folder = []
+        if as_string is None:
+            as_string = []
+        if isinstance(as_string, str):
+            as_string = [as_string]
+        if isinstance(files, str):
+            files = [files]
+        if type(folder_filter) == set:
+            folder_filter = list(folder_filter)
+        if type(name_filter) == str:
+            name_filter = [name_filter]
+        self.processor = processor
+        self.folder = folder
+        self.files = [item for item in files if not archiver.is_archive(item)]
+        self.archives = [item for item in files if archiver.is_archive(item)]
+        self.files_as_string = as_string
+        self.folder_filter = folder_filter
+        self.name_filter = name_filter
+
+    def __iter__(self):
+        if not self.files and not self.archives and self.folder:
+            files = self._walk(self.folder)
+        else:
+            files = iter(self.files)
+        for item in itertools.chain(files, self.files_as_string):
+            if not isinstance(item, str) or self._matches_name_filter(os.path.basename(item)):
+                yield item
+        # archives found while walking are read once all files are done
+        for item in self._archived_sources():
+            yield item
+
+    def _is_filtered_subfolder(self, folder, abs_path):
+        # no filter set, descend into all
+        if not self.folder_filter:
+            logging.getLogger(__name__).debug("No filter, adding %s", abs_path)
+            return True
+
+        # folder is directly containted, take it
+        if folder in self.folder_filter:
+            logging.getLogger(__name__).debug("Direct match %s", abs_path)
+            return True
+
+        # special case: last filder can have special meaning
+        if self.folder_filter[len(self.folder_filter) - 1].startswith("after:") and folder.startswith("2"):
+            after_folder = self.folder_filter[len(self.folder_filter) - 1].split("after:")[1]
+            after_folder = strptime(after_folder, "%Y%m%d")
+            folder_time = strptime(folder, "%Y%m%d")
+            if (after_folder < folder_time):
+                logging.getLogger(__name__).debug("Special action after: true %s", abs_path)
+                return True
+
+        # matched with startswith
+        if folder.startswith(tuple(self.folder_filter)):
+            logging.getLogger(__name__).debug("Matched with startswith! %s", abs_path)
+            return True
+
+        # special case: only provider given, always dive into date folders (starting with 2[018])
+        if len(self.folder_filter) == 1 and not self.folder_filter[0].startswith("2") and folder.startswith("2"):
+            logging.getLogger(__name__).debug("Only provider given, using all date folders! %s", abs_path)
+            return True
+
+    def _walk(self, folder):
+        for file in sorted(os.listdir(folder)):
+            abs_path = os.path.join(folder, file)
+            if os.path.isdir(abs_path):
+                if self._is_filtered_subfolder(file, abs_path):
+                    yield from self._walk(abs_path)
+            elif archiver.is_archive(file):
+                # archived folder, e.g. 20190101.tar.gz of the processed store
+                if self._is_filtered_subfolder(archiver.archive_stem(file), abs_path):
+                    self.archives.append(abs_path)
+            else:
+                if self._is_source_file(file):
+                    yield abs_path
+
+    def _matches_name_filter(self, file_name):
+        if self.name_filter is None:
+            return True
+        match_to = file_name.lower()
+        for tmp in self.name_filter:
+            if tmp.lower() not in match_to:
+                return False
+        return True
+
+    def _is_filtered_member(self, name):
+        folders, file_name = os.path.split(name)
+        for folder in folders.split(os.sep):
+            if folder and folder != "." and not self._is_filtered_subfolder(folder, name):
+                return False
+        return self._is_source_file(file_name) and self._matches_name_filter(file_name)
+
+    def _is_source_file(self, file_name):
+        if self.processor._is_allowed_file(file_name):
+            return True
+        # raw pushes only for processors that can parse them
+        can_parse_raw = type(self.processor)._parse_raw is not GenericProcessor._parse_raw
+        return can_parse_raw and file_name.endswith(".raw")
+
+    def _archived_sources(self):
+        """ Streams the matching files of all archives, decompressed in parallel """
+        for archive, name, content in archiver.iter_archives(
+                self.archives,
+                member_filter=self._is_filtered_member,
+                max_workers=Config.get("archiving", "read_workers", default=4)):
+            yield ArchivedFile(archive, name, content.decode("utf-8"))
+
+
 class JsonProcessor(GenericProcessor):
     """ Simple json processor: takes input and returns it.
         Proper json format is expected
@@ -387,6 +509,8 @@ class JsonProcessor(GenericProcessor):
         if source_type == "file":
             content = io.open(source, encoding="utf-8").read()
             incident = utils.save_json_loads(content)
+        elif source_type == "parsed":
+            incident = source
         else:
             incident = utils.save_json_loads(source)
 
@@ -395,10 +519,5 @@ class JsonProcessor(GenericProcessor):
         return incident
 
     def _incident_of_interest(self, incident):
-        if self._debug_identifiers:
-            info = json.dumps(incident["provider_info"])
-            for ident in self._debug_identifiers:
-                if ident in info:
-                    return True
-            return False
+        # debug games are already filtered by _matches_if_debug
         return True
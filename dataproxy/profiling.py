@@ -0,0 +1,142 @@
+import os
+import time
+import uuid
+import random
+import logging
+import cProfile
+import contextvars
+
+from . import Config
+
+
+"""
+    Opt-in profiling of pushes and pipeline stages.
+
+    With profiling.enabled, pushes (via :class:`ProfilingMiddleware`) and stages (via
+    :func:`profiled`) are profiled with cProfile if their provider is listed in
+    profiling.providers, or with probability profiling.sample_rate. Every profile is written
+    as pstats dump to <dump_folder>/<profiling.folder>/<yearmonthdate>/, to be inspected with
+    pstats, snakeviz or converted into a flamegraph (e.g. flameprof).
+
+    Stages that run inside a profiled push or stage are not profiled separately. When disabled,
+    profiled returns a shared no-op context manager.
+"""
+
+# profile of the push or stage that is currently profiled in this context
+ACTIVE_PROFILE = contextvars.ContextVar("dataproxy_active_profile", default=None)
+
+# (config revision, enabled, sample rate, providers, folder)
+_SETTINGS = None
+
+
+def _settings():
+    global _SETTINGS
+    settings = _SETTINGS
+    if settings is None or settings[0] != Config.revision:
+        revision = Config.revision
+        settings = (
+            revision,
+            Config.get("profiling", "enabled", default=False),
+            Config.get("profiling", "sample_rate", default=0.0),
+            frozenset(Config.get("profiling", "providers", default=[])),
+            os.path.join(Config.get("dump_folder", default="dump"), Config.get("profiling", "folder", default="profiles"))
+        )
+        _SETTINGS = settings
+    return settings
+
+
+def should_profile(provider=None):
+    """ Returns True if profiling is enabled and the given provider (or the random sample) is selected """
+    unused, enabled, sample_rate, providers, unused = _settings()
+    if not enabled or ACTIVE_PROFILE.get() is not None:
+        return False
+    return provider in providers or (sample_rate > 0 and random.random() < sample_rate)
+
+
+class _NoProfile(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_PROFILE = _NoProfile()
+
+
+class Profile(object):
+    """ cProfile of one push or stage, written to the profiles folder when finished """
+
+    def __init__(self, stage, provider=None):
+        self.stage = stage
+        self.provider = provider
+        self._profile = None
+        self._token = None
+
+    def start(self):
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # another profiler is active (on python >= 3.12 only one per process)
+            self._profile = None
+            return self
+        self._token = ACTIVE_PROFILE.set(self)
+        return self
+
+    def stop(self):
+        if self._profile is None:
+            return None
+        self._profile.disable()
+        ACTIVE_PROFILE.reset(self._token)
+        try:
+            return self._dump()
+        except OSError as e:
+            logging.getLogger(__name__).warning("Could not write profile of %s: %s", self.stage, e)
+            return None
+
+    def _dump(self):
+        folder = os.path.join(_settings()[4], time.strftime("%Y%m%d"))
+        os.makedirs(folder, exist_ok=True)
+        file_name = os.path.join(folder, "{0}_{1}_{2}_{3}.pstats".format(
+            self.stage,
+            self.provider if self.provider is not None else "all",
+            time.strftime("%H%M%S"),
+            uuid.uuid4().hex[:8]))
+        self._profile.dump_stats(file_name)
+        logging.getLogger(__name__).debug("Profile of %s written to %s", self.stage, file_name)
+        return file_name
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+def profiled(stage, provider=None):
+    """ Context manager that profiles the enclosed block if it is selected, see should_profile """
+    if not _settings()[1] or not should_profile(provider):
+        return NO_PROFILE
+    return Profile(stage, provider)
+
+
+class ProfilingMiddleware(object):
+    """ Falcon middleware that profiles selected pushes as a whole, i.e. reading, parsing,
+        processing, storing and the response """
+
+    def process_request(self, req, resp):
+        if not _settings()[1]:
+            return
+        path = req.path.strip("/").split("/")
+        provider = path[1] if len(path) > 1 and path[0] == "push" else None
+        if provider is not None and should_profile(provider):
+            req.context["profile"] = Profile("push", provider).start()
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        profile = req.context.get("profile", None)
+        if profile is not None:
+            profile.stop()
@@ -0,0 +1,45 @@
+import time
+import json
+import hashlib
+
+from ..cache import LRUCache
+
+
+class FingerprintStore(object):
+    """ Remembers a fingerprint of the relevant fields of every polled event, such that
+        only events whose state changed since the last poll are processed downstream.
+
+        Events that have not been seen for expire_after seconds are forgotten, at most
+        capacity events are remembered.
+    """
+
+    def __init__(self,
+                 fields=("time_status", "ss", "time"),
+                 id_field="id",
+                 expire_after=2 * 24 * 60 * 60,
+                 capacity=100000,
+                 clock=time.time):
+        self._fields = tuple(fields)
+        self._id_field = id_field
+        self._fingerprints = LRUCache(capacity=capacity, ttl=expire_after, clock=clock)
+
+    def fingerprint(self, event):
+        values = [event.get(field, None) for field in self._fields]
+        return hashlib.blake2b(json.dumps(values, sort_keys=True, default=str).encode(), digest_size=8).digest()
+
+    def changed(self, event):
+        """ Returns True if the event is unknown or its fingerprint differs, and remembers it """
+        fingerprint = self.fingerprint(event)
+        return self._fingerprints.replace(str(event[self._id_field]), fingerprint) != fingerprint
+
+    def filter_changed(self, events):
+        return [event for event in events if self.changed(event)]
+
+    def forget(self, events):
+        """ Forgets the given events, e.g. when they could not be processed, such that
+            they are considered changed on the next poll """
+        for event in events:
+            self._fingerprints.pop(str(event[self._id_field]))
+
+    def __len__(self):
+        return len(self._fingerprints)
@@ -0,0 +1,149 @@
+import time
+import logging
+import threading
+import requests
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+
+class RateLimiter(object):
+    """ Token bucket, allows rate calls per second with bursts of up to burst calls """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self._burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a call is allowed, returns the time waited in seconds """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self._rate
+            self._sleep(wait)
+            waited += wait
+
+
+class PooledFetcher(object):
+    """ Executes HTTP GET requests through one pooled session and a bounded thread pool.
+
+        Every host has its own rate limiter, such that parallel polling does not
+        exceed the request limits of a provider API.
+    """
+
+    MAX_VALIDATORS = 10000
+
+    def __init__(self,
+                 name,
+                 max_workers=4,
+                 requests_per_second=None,
+                 burst=None,
+                 timeout=2):
+        self.name = name
+        self._max_workers = max_workers
+        self._requests_per_second = requests_per_second
+        self._burst = burst
+        self._timeout = timeout
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="Fetcher_" + name)
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        # validators (ETag, Last-Modified) of the last response per url for conditional requests
+        self._validators = {}
+        self._validators_lock = threading.Lock()
+
+    def _limiter(self, url):
+        if not self._requests_per_second:
+            return None
+        host = urlsplit(url).netloc
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            with self._limiters_lock:
+                limiter = self._limiters.get(host)
+                if limiter is None:
+                    limiter = RateLimiter(self._requests_per_second, self._burst)
+                    self._limiters[host] = limiter
+        return limiter
+
+    def get(self, url, timeout=None, **kwargs):
+        """ Rate limited GET through the pooled session, returns the response """
+        limiter = self._limiter(url)
+        if limiter is not None:
+            waited = limiter.acquire()
+            if waited > 0:
+                logging.getLogger(__name__).debug("%s: rate limited, waited %.3fs for %s", self.name, waited, urlsplit(url).netloc)
+        return self._session.get(url, timeout=timeout if timeout is not None else self._timeout, **kwargs)
+
+    def get_conditional(self, url, timeout=None):
+        """ GET with If-None-Match/If-Modified-Since of the last response of this url.
+
+            :returns the response, or None if the server answered 304 Not Modified
+        """
+        headers = {}
+        validators = self._validators.get(url, None)
+        if validators is not None:
+            if validators[0] is not None:
+                headers["If-None-Match"] = validators[0]
+            if validators[1] is not None:
+                headers["If-Modified-Since"] = validators[1]
+        response = self.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and validators is not None:
+            return None
+        self._remember_validators(url, response)
+        return response
+
+    def _remember_validators(self, url, response):
+        etag = response.headers.get("ETag", None)
+        last_modified = response.headers.get("Last-Modified", None)
+        with self._validators_lock:
+            if etag is None and last_modified is None:
+                self._validators.pop(url, None)
+                return
+            if url not in self._validators and len(self._validators) >= PooledFetcher.MAX_VALIDATORS:
+                # drop the oldest entry
+                self._validators.pop(next(iter(self._validators)))
+            self._validators[url] = (etag, last_modified)
+
+    def forget_validators(self, url):
+        """ The next request of this url is unconditional """
+        with self._validators_lock:
+            self._validators.pop(url, None)
+
+    def submit(self, method, *args, **kwargs):
+        return self._executor.submit(method, *args, **kwargs)
+
+    def run_all(self, tasks):
+        """ Runs all (method, args) tasks in the pool and returns their results in order.
+            A failing task returns its exception instead of a result.
+
+            Tasks must not call run_all themselves, since they would wait for slots of the same pool.
+        """
+        futures = [self._executor.submit(method, *args) for method, args in tasks]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
@@ -1,15 +1,21 @@
 from pprint import pprint
-from time import sleep
 import logging
 import requests
 import json
 import os
+import threading
+from types import MappingProxyType
 from datetime import timedelta
 
 from ..json.processor import GenericJsonProcessor
+from ..fetcher import PooledFetcher
+from ..changes import FingerprintStore
+from ..wrapper_service import PollerScheduler
 from ... import Config
 from ... import utils
+from ...cache import SeenSet, LRUCache
 from ...app import get_push_receiver
+from ...routes.push import PushReceiver
 from ...datestring import date_to_string, string_to_date
 
 from bookiesports.normalize import IncidentsNormalizer, NotNormalizableException
@@ -21,36 +27,78 @@ from bookiesports.normalize import IncidentsNormalizer, NotNormalizableException
 NAME = os.path.basename(__file__).split(".")[0]
 PLAIN_NAME = Config.get("providers", NAME, "name", default=None)
 
-EVENTS_HISTORY = {}
+
+def _history_file():
+    if not Config.get("providers", NAME, "history", "persist", default=False):
+        return None
+    return os.path.join(Config.get("dump_folder", default="dump"), "history", NAME + ".json")
+
+
+# incidents that have been found already, see Processor._incident_of_interest. Persisted only by
+# the serving process (see BackgroundThread), not e.g. by the worker processes of reprocess
+EVENTS_HISTORY = SeenSet(
+    capacity=Config.get("providers", NAME, "history", "capacity", default=100000),
+    ttl=Config.get("providers", NAME, "history", "ttl_in_seconds", default=None)
+)
+
+# event details, shared by all incidents of a poll cycle, see _get_event
+EVENT_DETAILS = LRUCache(
+    capacity=Config.get("providers", NAME, "event_details", "capacity", default=10000),
+    ttl=Config.get("providers", NAME, "event_details", "ttl_in_seconds", default=60)
+)
+
+FETCHER = None
+FETCHER_LOCK = threading.Lock()
+
+# returned by conditional requests if the provider answered 304 Not Modified
+NOT_MODIFIED = object()
 
 
 def _get(*args, **kwargs):
     return Config.get("providers", NAME, *args, **kwargs)
 
 
-def logged_json_get(url):
-    logging.getLogger(__name__).info("[GET] " + url)
+def _fetcher():
+    global FETCHER
+    if FETCHER is None:
+        with FETCHER_LOCK:
+            if FETCHER is None:
+                FETCHER = PooledFetcher(
+                    NAME,
+                    max_workers=_get("polling", "max_workers", 8),
+                    requests_per_second=_get("polling", "requests_per_second", 10),
+                    timeout=_get("timeout", 2)
+                )
+    return FETCHER
+
+
+def logged_json_get(url, conditional=False):
+    logging.getLogger(__name__).info("[GET] %s", url)
+    if conditional:
+        response = _fetcher().get_conditional(url)
+        if response is None:
+            logging.getLogger(__name__).debug("[GET] %s not modified", url)
+            return NOT_MODIFIED
+    else:
+        response = _fetcher().get(url)
     json_payload = utils.save_json_loads(
-        requests.get(
-            url,
-            timeout=_get("timeout", 2)
-        ).content
+        response.content
     )
     if "error" in json_payload:
         raise Exception(url + ": " + json_payload["error"])
     if "pager" in json_payload:
+        if conditional and json_payload["pager"]["per_page"] == len(json_payload["results"]):
+            # further pages may change independently of the first one
+            _fetcher().forget_validators(url)
         # fetch all
         _paged_results = [json_payload]
         while _paged_results[len(_paged_results) - 1]["pager"]["per_page"] == len(_paged_results[len(_paged_results) - 1]["results"]):
             _url = url + "&page=" + str(_paged_results[len(_paged_results) - 1]["pager"]["page"] + 1)
-            logging.getLogger(__name__).info("[GET] " + _url)
+            logging.getLogger(__name__).info("[GET] %s", _url)
             # we received a full page, query next
             _paged_results.append(
                 utils.save_json_loads(
-                    requests.get(
-                        _url,
-                        timeout=_get("timeout", 2)
-                    ).content
+                    _fetcher().get(_url).content
                 )
             )
         # merge results
@@ -87,13 +135,20 @@ def _parse_id(id_or_name):
         return None
 
 
-def resolve_via_api(url):
-    # resolve via http API
+def _with_token(url):
     seperator = "&" if "?" in url else "?"
+    return url + seperator + "token=" + _get("token")
+
+
+def resolve_via_api(url, conditional=False):
+    # resolve via http API
+    return logged_json_get(_with_token(url), conditional)
+
 
-    url_with_token = (url + seperator +
-                      "token=" + _get("token"))
-    return logged_json_get(url_with_token)
+def forget_validators(urls):
+    """ The next conditional request of the urls (as given to resolve_via_api) fetches them in full """
+    for url in urls:
+        _fetcher().forget_validators(_with_token(url))
 
 
 def _get_sports_to_track():
@@ -103,66 +158,76 @@ def _get_sports_to_track():
     ))
 
 
-def _id_to_sport(sport_id):
-    sports = _get(
-        "recognize",
-        "sports"
-    )
-    return next(item for item in sports if str(item["id"]) == str(sport_id))
-
-
-def _get_upcoming_events(api, sport_id, league_id, until=None):
+def _get_upcoming_urls(api, sport_id, league_id, until=None):
+    url = _get("api", api, "upcoming") + "?sport_id=" + str(sport_id) + "&league_id=" + str(league_id)
     if until is None:
-        reponse = resolve_via_api(_get("api", api, "upcoming") + "?sport_id=" + str(sport_id) + "&league_id=" + str(league_id))
+        return [url]
+    if type(until) == int:
+        until = string_to_date() + timedelta(days=until)
     else:
-        if type(until) == int:
-            until = string_to_date() + timedelta(days=until)
-        else:
-            until = string_to_date(until)
-        now = string_to_date()
-        if (now < until):
-            results_list = []
-            while now < until:
-                day = now.strftime("%Y%m%d")
-                results_list.append(
-                    resolve_via_api(
-                        _get("api", api, "upcoming") +
-                        "?sport_id=" + str(sport_id) +
-                        "&league_id=" + str(league_id) +
-                        "&day=" + day
-                    )
-                )
-                now = now + timedelta(days=1)
-            results = {
-                "success": results_list[0]["success"],
-                "results": []
-            }
-            for _results in results_list:
-                for _event in _results["results"]:
-                    results["results"].append(_event)
-            reponse = results
-        else:
-            raise Exception("Can only query into the future")
+        until = string_to_date(until)
+    now = string_to_date()
+    if not now < until:
+        raise Exception("Can only query into the future")
+    urls = []
+    while now < until:
+        urls.append(url + "&day=" + now.strftime("%Y%m%d"))
+        now = now + timedelta(days=1)
+    return urls
+
+
+def _merge_upcoming(api, results_list):
+    for _results in results_list:
+        if isinstance(_results, Exception):
+            raise _results
+    # unchanged days contribute nothing
+    results_list = [_results for _results in results_list if _results is not NOT_MODIFIED]
+    if not results_list:
+        return NOT_MODIFIED
+    if len(results_list) == 1:
+        reponse = results_list[0]
+    else:
+        reponse = {
+            "success": results_list[0]["success"],
+            "results": []
+        }
+        for _results in results_list:
+            for _event in _results["results"]:
+                reponse["results"].append(_event)
     reponse["api"] = api
     return reponse
 
 
-def _get_inplay_events(api, sport_id, league_id):
-    return resolve_via_api(_get("api", api, "inplay") + "?sport_id=" + str(sport_id) + "&league_id=" + str(league_id))
+def _get_upcoming_events(api, sport_id, league_id, until=None):
+    urls = _get_upcoming_urls(api, sport_id, league_id, until)
+    return _merge_upcoming(
+        api,
+        _fetcher().run_all([(resolve_via_api, (url,)) for url in urls])
+    )
+
+
+def _get_inplay_url(api, sport_id, league_id):
+    return _get("api", api, "inplay") + "?sport_id=" + str(sport_id) + "&league_id=" + str(league_id)
+
 
+def _get_inplay_events(api, sport_id, league_id, conditional=False):
+    return resolve_via_api(_get_inplay_url(api, sport_id, league_id), conditional)
 
-def _get_ended_events(api, sport_id, league_id):
+
+def _get_ended_url(api, sport_id, league_id):
     now = date_to_string()
     now = now[0:4] + now[5:7] + now[8:10]
-    return resolve_via_api(
-        _get("api", api, "ended") +
-        "?sport_id=" + str(sport_id) +
-        "&league_id=" + str(league_id) +
-        "&day=" + now
-    )
+    return (_get("api", api, "ended") +
+            "?sport_id=" + str(sport_id) +
+            "&league_id=" + str(league_id) +
+            "&day=" + now)
 
 
-def _get_event(api, event_id):
+def _get_ended_events(api, sport_id, league_id, conditional=False):
+    return resolve_via_api(_get_ended_url(api, sport_id, league_id), conditional)
+
+
+def _fetch_event(api, event_id):
     json_payload = resolve_via_api(_get("api", api, "event") + "?event_id=" + str(event_id))
     if json_payload["success"] == 1 and json_payload["results"][0]["id"] == event_id:
         return json_payload["results"][0]
@@ -170,10 +235,56 @@ def _get_event(api, event_id):
         raise Exception("Event not found")
 
 
+def _get_event(api, event_id):
+    """ Event details, cached for event_details.ttl_in_seconds """
+    key = api + "_" + str(event_id)
+    event = EVENT_DETAILS.get(key)
+    if event is None:
+        event = _fetch_event(api, event_id)
+        EVENT_DETAILS.set(key, event)
+    return event
+
+
+def _prefetch_events(api, event_ids):
+    """ Fetches the details of all given events in parallel, failed fetches are
+        repeated (and raised) when the details are actually requested """
+    missing = []
+    seen = set()
+    for event_id in event_ids:
+        if event_id not in seen and api + "_" + str(event_id) not in EVENT_DETAILS:
+            missing.append(event_id)
+        seen.add(event_id)
+    if len(missing) < 2:
+        return
+    for event_id, event in zip(missing, _fetcher().run_all([(_fetch_event, (api, event_id)) for event_id in missing])):
+        if not isinstance(event, Exception):
+            EVENT_DETAILS.set(api + "_" + str(event_id), event)
+
+
 class Processor(GenericJsonProcessor):
+
+    # the keys source_of_interest looks for, checked before the push is decoded
+    INTEREST_NEEDLES = (b'"results": [{"id":', b"sport_id", b"league", b"home", b"away")
+
     def __init__(self):
         super(Processor, self).__init__()
         self._sports_to_track = None
+        self._lookups_revision = None
+        self._build_lookups()
+
+    def _build_lookups(self):
+        """ Builds the sport lookup table and the normalizer from the configuration,
+            they are rebuilt when the configuration revision changes """
+        revision = Config.revision
+        self._sports_by_id = MappingProxyType({
+            str(sport["id"]): sport for sport in _get("recognize", "sports", default=[])
+        })
+        self._normalizer = IncidentsNormalizer(chain=_get("bookiesports_chain", default=None))
+        self._lookups_revision = revision
+
+    def _ensure_lookups(self):
+        if self._lookups_revision != Config.revision:
+            self._build_lookups()
 
     def _parse_raw(self, raw_file_content, raw_environ=None):
         return raw_file_content
@@ -188,23 +299,36 @@ class Processor(GenericJsonProcessor):
             info["our_event_id"] = event["our_event_id"]
         return info
 
+    def _needs_details(self, call, event):
+        if call == "finish":
+            # the result is taken from the event itself if it has the score
+            return _get("resolve_whistle_times", False) or "ss" not in event
+        return call == "in_progress" and _get("resolve_whistle_times", False)
+
     def _process_event_json(self, source_json):
+        self._ensure_lookups()
+        sports_by_id = self._sports_by_id
         incidents = []
+        _prefetch_events(
+            "general",
+            [_event["id"] for _event in source_json["results"]
+             if "id" in _event and self._needs_details(self._mapStatus(_event.get("time_status", None)), _event)]
+        )
         for _event in source_json["results"]:
             try:
                 incident_id = {
-                    "sport": _id_to_sport(_event["sport_id"])["name"],
+                    "sport": sports_by_id[str(_event["sport_id"])]["name"],
                     "home": _event["home"]["name"],
                     "away": _event["away"]["name"],
                     "start_time": date_to_string(_event["time"]),
                     "event_group_name": _event["league"]["name"],
                 }
             except KeyError:
-                # wrong format?
-                pass
+                # wrong format or untracked sport
+                continue
 
             call = self._mapStatus(_event["time_status"])
-            arguments = self._getArgument(call, incident_id, _event["id"])
+            arguments = self._getArgument(call, incident_id, _event["id"], _event)
 
             incidents.append({
                 "id": incident_id,
@@ -213,14 +337,14 @@ class Processor(GenericJsonProcessor):
                 "provider_info": self._get_provider_info(_event)
             })
 
-            if call == "create" and "etfa" in source_json.get("api", None):
+            if call == "create" and "etfa" in source_json.get("api", ""):
                 # resolve dbmgs
                 betfair_event = _get_event("etfa", _event["id"])
                 print(betfair_event)
 
             elif call == "finish":
                 call = "result"
-                arguments = self._getArgument(call, incident_id, _event["id"])
+                arguments = self._getArgument(call, incident_id, _event["id"], _event)
                 incidents.append({
                     "id": incident_id,
                     "call": call,
@@ -232,12 +356,12 @@ class Processor(GenericJsonProcessor):
         # and only forward incidents that can be normalized (witness will still re-normalize as
         # dataproxies normally don't do that
         normalized = []
-        normalizer = IncidentsNormalizer(chain=_get("bookiesports_chain"))
+        normalizer = self._normalizer
         for incident in incidents:
             try:
                 normalized.append(normalizer.normalize(incident, True))
             except NotNormalizableException as e:
-                logging.getLogger(__name__).debug(str(e.__class__.__name__) + ": " + str(incident["id"]))
+                logging.getLogger(__name__).debug("%s: %s", e.__class__.__name__, incident["id"])
                 pass
         return normalized
 
@@ -251,6 +375,12 @@ class Processor(GenericJsonProcessor):
         return []
 
     def source_of_interest(self, source):
+        if isinstance(source, dict):
+            # already parsed payload, see PushReceiver.ingest
+            results = source.get("results", None)
+            if not results or not isinstance(results, list) or not isinstance(results[0], dict):
+                return False
+            return all(key in results[0] for key in ["id", "sport_id", "league", "home", "away"])
         if source:
             return '"results": [{"id":' in source and "sport_id" in source and "league" in source and "home" in source and "away" in source
         else:
@@ -269,17 +399,20 @@ class Processor(GenericJsonProcessor):
         }
         return status_map.get(status, "canceled")
 
-    def _getArgument(self, call, incident_id, event_id=None):
-        resolve_whistle_times = False
+    def _getArgument(self, call, incident_id, event_id=None, event=None):
+        """ :param event: the event as listed by the poll, its score is current while the
+            cached details may be up to event_details.ttl_in_seconds old """
+        # details are only fetched if necessary
+        resolve_whistle_times = _get("resolve_whistle_times", False)
 
         if call == "create":
             return {
                 "season": incident_id["start_time"][0:4]
             }
         elif call == "in_progress":
-            if event_id is not None:
+            if resolve_whistle_times and event_id is not None:
                 event_details = _get_event("general", event_id)
-                if resolve_whistle_times and "inplay_created_at" in event_details:
+                if "inplay_created_at" in event_details:
                     return {
                         "whistle_end_time": date_to_string(int(event_details["inplay_created_at"]))
                     }
@@ -287,9 +420,9 @@ class Processor(GenericJsonProcessor):
                 "whistle_start_time": None
             }
         elif call == "finish":
-            if event_id is not None:
+            if resolve_whistle_times and event_id is not None:
                 event_details = _get_event("general", event_id)
-                if resolve_whistle_times and "confirmed_at" in event_details:
+                if "confirmed_at" in event_details:
                     return {
                         "whistle_end_time": date_to_string(int(event_details["confirmed_at"]))
                     }
@@ -297,10 +430,13 @@ class Processor(GenericJsonProcessor):
                 "whistle_end_time": None
             }
         elif call == "result":
-            if event_id is None:
+            if event is not None and event.get("ss", None):
+                score = event["ss"]
+            elif event_id is None:
                 raise Exception("Event id is needed for resolving")
-            event_details = _get_event("general", event_id)
-            result = event_details["ss"].split("-")
+            else:
+                score = _get_event("general", event_id)["ss"]
+            result = score.split("-")
             return {
                 "home_score": result[0],
                 "away_score": result[1]
@@ -314,67 +450,120 @@ class Processor(GenericJsonProcessor):
     def _incident_of_interest(self, incident):
         # check history, make sure it doesnt explode
         giid = incident["unique_string"] + "_" + incident["provider_info"]["name"]
-        found = giid in EVENTS_HISTORY
-        if not found:
-            keys = list(EVENTS_HISTORY.keys())
-            if len(keys) > 1000:
-                EVENTS_HISTORY.pop(keys[0])
-            EVENTS_HISTORY[giid] = True
-        return not found
+        return not EVENTS_HISTORY.check_and_add(giid)
 
 
 class BackgroundThread():
 
+    def __init__(self):
+        EVENTS_HISTORY.persist_to(_history_file())
+        self._fingerprints = FingerprintStore(
+            fields=_get("polling", "fingerprint_fields", ["time_status", "ss", "time"])
+        )
+
     def getName(self):
         return "BackgroundPoller_" + PLAIN_NAME
 
     def _send(self, results):
+        receiver = PushReceiver.get_receiver(NAME)
+        if receiver is not None and _get("ingest", "in_process", True):
+            try:
+                receiver.ingest(results)
+                return True
+            except Exception as e:
+                logging.getLogger(self.getName()).warning("Processing events failed ... error below ... continueing with next")
+                logging.getLogger(self.getName()).exception(e)
+            return False
+        # HTTP loopback, e.g. if the poller runs outside of the dataproxy process
         try:
             response = requests.post(
                 "http://localhost:" + str(Config.get("wsgi", "port")) + "/push/" + NAME,
                 files={"json": json.dumps(results)}
             )
             if response and response.content == _get("processor", "response").encode() and response.status_code == 200:
-                pass
+                return True
             else:
                 raise Exception("Pull could not be pushed, response " + str(response.status_code))
         except Exception as e:
             logging.getLogger(self.getName()).warning("Fetching events failed ... error below ... continueing with next")
             logging.getLogger(self.getName()).exception(e)
+        return False
+
+    def _send_changed(self, results, urls=()):
+        """ Only sends events whose state changed since the last poll.
+
+            :param urls: the urls the results were polled from, if sending fails they are fetched
+                in full with the next poll (instead of being answered with 304 Not Modified)
+        """
+        if results is NOT_MODIFIED:
+            return
+        if not _get("polling", "change_detection", True):
+            if not self._send(results):
+                forget_validators(urls)
+            return
+        changed = self._fingerprints.filter_changed(results.get("results", None) or [])
+        if not changed:
+            return
+        results = dict(results)
+        results["results"] = changed
+        if not self._send(results):
+            # retry with the next poll
+            self._fingerprints.forget(changed)
+            forget_validators(urls)
 
     def execute(self):
+        logging.getLogger(self.getName()).info("Fetching events ...")
         api = "general"
+        conditional = _get("polling", "conditional_requests", True)
         leagues = _get(
             "recognize",
             "leagues"
         )
+        # all calls of all leagues run in the pool of the fetcher, results are sent per league
+        tasks = []
+        urls_per_league = []
         for league in leagues:
-            self._send(_get_upcoming_events(api, league["sport_id"], league["id"], 3))
-            self._send(_get_inplay_events(api, league["sport_id"], league["id"]))
-            self._send(_get_ended_events(api, league["sport_id"], league["id"]))
-
-    def run(self):
-        sleep(2)
-        while True:
+            upcoming_urls = _get_upcoming_urls(api, league["sport_id"], league["id"], 3)
+            urls = (upcoming_urls,
+                    _get_inplay_url(api, league["sport_id"], league["id"]),
+                    _get_ended_url(api, league["sport_id"], league["id"]))
+            urls_per_league.append(urls)
+            for url in upcoming_urls + [urls[1], urls[2]]:
+                tasks.append((resolve_via_api, (url, conditional)))
+        results = _fetcher().run_all(tasks)
+
+        offset = 0
+        for league, (upcoming_urls, inplay_url, ended_url) in zip(leagues, urls_per_league):
+            amount = len(upcoming_urls)
+            upcoming = results[offset:offset + amount]
+            inplay, ended = results[offset + amount], results[offset + amount + 1]
+            offset = offset + amount + 2
             try:
-                logging.getLogger(self.getName()).info("Fetching events ...")
-                self.execute()
-                sleep(
-                    _get(
-                        "polling_in_seconds",
-                        5
-                    )
-                )
+                self._send_changed(_merge_upcoming(api, upcoming), upcoming_urls)
             except Exception as e:
-                logging.getLogger(self.getName()).info("Exception while fetching events.")
-                logging.getLogger(self.getName()).exception(e)
-                # sleep additionally
-                sleep(
-                    _get(
-                        "polling_in_seconds",
-                        5
-                    )
-                )
+                self._log_failed(league, e)
+            for result, url in [(inplay, inplay_url), (ended, ended_url)]:
+                if isinstance(result, Exception):
+                    self._log_failed(league, result)
+                else:
+                    self._send_changed(result, [url])
+
+    def _log_failed(self, league, exception):
+        logging.getLogger(self.getName()).warning("Fetching events of league %s failed ... error below ... continueing with next", league["id"],
+                                                  exc_info=exception)
+
+    def interval(self):
+        return _get(
+            "polling_in_seconds",
+            5
+        )
+
+    def run(self):
+        """ Polls standalone, within the dataproxy execute is scheduled by the PollerScheduler of the app """
+        scheduler = PollerScheduler(max_workers=1)
+        scheduler.add(self.getName(), self.execute, self.interval, initial_delay=2)
+        scheduler.start()
+        scheduler.join()
 
 
 class TooManyFoundException(Exception):
@@ -1,9 +1,14 @@
 import logging
 import os
 import time
+import heapq
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from service import Service
 
 from dataproxy import utils
+from dataproxy import metrics
 
 # http://www.diveintopython3.net/xml.html
 
@@ -32,10 +37,12 @@ class WrapperService(object):
 
     def run(self):
         logging.getLogger(__name__ + "_" + self.provider_name).info("Starting provider calls")
-        # get initial history id
+        scheduler = PollerScheduler()
+        scheduler.add(self.provider_name, self.execute, self.execute_interval)
+        scheduler.start()
         while not self.got_sigterm():
-            self.execute()
-            time.sleep(self.execute_interval)
+            time.sleep(0.5)
+        scheduler.stop()
 
         logging.getLogger(__name__ + "_" + self.provider_name).info("Stopping provider calls")
 
@@ -53,14 +60,214 @@ class PythonService(Service):
                 return
 
     def run(self):
-        self.wrapper_service.logger.info("Starting provider calls")
-        # get initial history id
+        self.logger.info("Starting provider calls")
+        scheduler = PollerScheduler()
+        scheduler.add(self.wrapper_service.provider_name, self.wrapper_service.execute, self.wrapper_service.execute_interval)
+        scheduler.start()
         while not self.got_sigterm():
-            try:
-                self.wrapper_service.execute()
-            except Exception as e:
-                self.wrapper_service.logger.info("Provider method failed: " + str(e))
+            self.interruptable_sleep(1)
+        scheduler.stop()
+
+        self.logger.info("Stopping provider calls")
+
+
+class PollerStats(object):
+    """ Timing statistics of one poller """
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        # ticks that arrived while the previous execution was still running
+        self.overruns = 0
+        self.last_started = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        # delay between the scheduled tick and the actual start of the last execution
+        self.last_start_delay = None
+
+    def as_dict(self):
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "mean_duration": self.total_duration / self.runs if self.runs else None,
+            "last_start_delay": self.last_start_delay
+        }
+
+
+class ScheduledPoller(object):
+    """ A method that is executed by the :class:`PollerScheduler` every interval seconds.
+
+        Has name and is_alive() like the background threads it replaces.
+    """
+
+    def __init__(self, scheduler, name, method, interval, jitter=0.0, initial_delay=0.0, skip_after_failure=True):
+        self.name = name
+        self.method = method
+        self._interval = interval
+        self.jitter = jitter
+        self.initial_delay = initial_delay
+        self.skip_after_failure = skip_after_failure
+        self.stats = PollerStats()
+        self._scheduler = scheduler
+        # only touched under the lock of the scheduler
+        self.running = False
+        self.pending = False
+        self.skip_next = False
+        self.tick = None
+
+    @property
+    def interval(self):
+        """ Polling interval in seconds, evaluated on every tick such that configuration reloads apply """
+        if callable(self._interval):
+            return self._interval()
+        return self._interval
+
+    def is_alive(self):
+        return self._scheduler.is_alive()
+
+    def __str__(self):
+        return "ScheduledPoller(" + self.name + ")"
+
+
+class PollerScheduler(object):
+    """ Executes all pollers at a fixed rate in one thread pool.
+
+        Ticks of a poller are interval seconds apart, independent of how long an execution
+        takes, and are delayed by a random amount of up to jitter seconds to spread the load.
+        One poller never runs concurrently with itself: a tick that arrives while its previous
+        execution is still running is counted as overrun, and the poller runs once more right
+        after the execution finished. Different pollers run concurrently.
+    """
+
+    def __init__(self, max_workers=None, clock=time.monotonic, jitter_source=random.random):
+        self._max_workers = max_workers
+        self._clock = clock
+        self._jitter_source = jitter_source
+        self._pollers = []
+        # (due, sequence, nominal tick, poller)
+        self._queue = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    @property
+    def pollers(self):
+        return list(self._pollers)
+
+    def add(self, name, method, interval, jitter=0.0, initial_delay=0.0, skip_after_failure=True):
+        """ Registers method to be called every interval seconds, interval may be a callable.
+            Can be called before or after start
+
+            :returns: the :class:`ScheduledPoller`
+        """
+        poller = ScheduledPoller(self, name, method, interval, jitter, initial_delay, skip_after_failure)
+        with self._lock:
+            self._pollers.append(poller)
+            self._push(poller, self._clock() + initial_delay)
+            self._wakeup.notify()
+        return poller
+
+    def _push(self, poller, tick):
+        poller.tick = tick
+        due = tick + self._jitter_source() * poller.jitter if poller.jitter else tick
+        self._sequence += 1
+        heapq.heappush(self._queue, (due, self._sequence, tick, poller))
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers or max(4, len(self._pollers)),
+                                                thread_name_prefix="Poller")
+        self._thread = threading.Thread(name="PollerScheduler", target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        with self._lock:
+            self._wakeup.notify()
+        if wait and self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {poller.name: poller.stats.as_dict() for poller in self._pollers}
+
+    def _run(self):
+        with self._lock:
+            while not self._stopped.is_set():
+                now = self._clock()
+                if not self._queue or self._queue[0][0] > now:
+                    self._wakeup.wait(None if not self._queue else self._queue[0][0] - now)
+                    continue
+                due, unused, tick, poller = heapq.heappop(self._queue)
+                interval = poller.interval
+                # the next tick is based on this tick, such that execution times don't add up
+                next_tick = tick + interval
+                if next_tick <= now:
+                    # e.g. after the process was suspended, don't fire all missed ticks
+                    next_tick = now + interval
+                self._push(poller, next_tick)
+
+                if poller.skip_next:
+                    poller.skip_next = False
+                elif poller.running:
+                    poller.stats.overruns += 1
+                    poller.pending = True
+                    logging.getLogger(__name__).warning("%s: still running at its next tick, polling interval of %ss is exceeded", poller.name, interval)
+                else:
+                    self._submit(poller, now - due)
+
+    def _submit(self, poller, start_delay):
+        poller.running = True
+        poller.stats.last_start_delay = max(0.0, start_delay)
+        try:
+            self._executor.submit(self._execute, poller)
+        except RuntimeError:
+            # executor is shut down
+            poller.running = False
+
+    def _execute(self, poller):
+        started = self._clock()
+        failed = False
+        try:
+            poller.method()
+        except Exception as e:
+            failed = True
+            logging.getLogger(__name__).warning("%s: execution failed", poller.name, exc_info=e)
+        duration = self._clock() - started
+        interval = poller.interval
+        logging.getLogger(__name__).debug("%s: execution took %.2fs", poller.name, duration)
 
-            self.interruptable_sleep(self.wrapper_service.execute_interval)
+        metrics.POLL_CYCLE_SECONDS.labels(poller.name).observe(duration)
+        metrics.POLL_LAG_SECONDS.labels(poller.name).set(max(0.0, duration - interval))
 
-        self.wrapper_service.logger.info("Stopping provider calls")
+        with self._lock:
+            stats = poller.stats
+            stats.runs += 1
+            stats.last_started = started
+            stats.last_duration = duration
+            stats.max_duration = max(stats.max_duration, duration)
+            stats.total_duration += duration
+            poller.running = False
+            if failed:
+                stats.failures += 1
+                if poller.skip_after_failure:
+                    poller.skip_next = True
+            if poller.pending:
+                # catch up once for all ticks missed during this execution
+                poller.pending = False
+                if not failed and not self._stopped.is_set():
+                    self._submit(poller, self._clock() - poller.tick)
@@ -0,0 +1,266 @@
+import io
+import os
+import json
+import time
+import queue
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from bos_incidents.exceptions import DuplicateIncidentException
+
+from . import Config
+from . import archiver
+from . import jsoncodec
+from .backends import backend_name
+from .stores import IncidentFileStore
+
+
+"""
+    Re-derives incidents from the raw and processed stores, e.g. after bookiesports learned
+    new aliases, see :func:`reprocess`.
+"""
+
+STORE_FOLDERS = ("dump/a_raw", "dump/c_processed")
+
+# stores the default STORE_FOLDERS belong to, only their file backend can be reprocessed
+STORE_NAMES = ("raw", "processed")
+
+# incidents sent to the calling process at once
+BATCH_SIZE = 500
+
+# processor of the worker process and where it puts the batches, see _initialize_worker
+_PROCESSOR = None
+_RESULTS = None
+
+
+def get_processor(provider):
+    """ Instantiates the processor of the provider the same way the app does """
+    from .provider.json.processor import GenericJsonProcessor
+
+    provider_config = Config.get("providers", provider)
+    if "processor" in provider_config and provider_config["processor"]["type"] == "generic":
+        return GenericJsonProcessor(provider_config["processor"].get("timezone", None))
+    module_to_load = Config.get("providers", provider, "module", default=provider)
+    try:
+        module = __import__(module_to_load, fromlist=[module_to_load])
+    except ModuleNotFoundError:
+        module = __import__("dataproxy.provider.modules." + module_to_load, fromlist=[module_to_load])
+    return getattr(module, "Processor")()
+
+
+def _normalize_date(date):
+    return str(date).replace("-", "")[0:8]
+
+
+def find_units(provider, date_from, date_to, store_folders=STORE_FOLDERS):
+    """ :returns: the date folders and archives of the stores within the date range that may contain
+        pushes of the provider, as sorted list of paths """
+    date_from = _normalize_date(date_from)
+    date_to = _normalize_date(date_to)
+    units = []
+    for store_folder in store_folders:
+        if not os.path.isdir(store_folder):
+            continue
+        for name in os.listdir(store_folder):
+            path = os.path.join(store_folder, name)
+            if archiver.is_archive(name):
+                date = archiver.archive_stem(name)
+            elif os.path.isdir(os.path.join(path, provider)):
+                date = name
+            else:
+                continue
+            if date_from <= date <= date_to:
+                units.append(path)
+    return sorted(units)
+
+
+def _unit_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, unused, files in os.walk(path) for name in files)
+
+
+def _initialize_worker(provider, processor_factory, results):
+    global _PROCESSOR, _RESULTS
+    _PROCESSOR = processor_factory(provider) if processor_factory is not None else get_processor(provider)
+    _PROCESSOR.skip_on_error()
+    _RESULTS = results
+
+
+class _DirectResults(object):
+    """ Hands the batches of an in-process run straight to the calling code """
+
+    def __init__(self, handle):
+        self.put = handle
+
+
+def _process_unit(provider, path, batch_size=BATCH_SIZE):
+    """ Runs in the worker, puts the incidents the processor finds in the unit as (path, batch, None)
+        with at most batch_size incidents each, the last batch is (path, batch, size of the unit) """
+    if archiver.is_archive(path):
+        incidents = _PROCESSOR.iter_generic(files=[path], folder_filter=[provider])
+    else:
+        incidents = _PROCESSOR.iter_generic(folder=os.path.join(path, provider))
+    batch = []
+    for incident in incidents:
+        batch.append(incident)
+        if len(batch) >= batch_size:
+            _RESULTS.put((path, batch, None))
+            batch = []
+    _RESULTS.put((path, batch, _unit_size(path)))
+
+
+class Checkpoint(object):
+    """ Remembers the finished units and the running totals of a reprocessing run in a json file,
+        written atomically after every unit such that an interrupted run can continue """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.done = set()
+        self.totals = {}
+        if file_name is not None and os.path.isfile(file_name):
+            with io.open(file_name, encoding="utf-8") as file:
+                content = json.load(file)
+            self.done = set(content["done"])
+            self.totals = content["totals"]
+
+    def finish(self, unit, totals):
+        self.done.add(unit)
+        self.totals = totals
+        if self.file_name is None:
+            return
+        os.makedirs(os.path.dirname(self.file_name) or ".", exist_ok=True)
+        tmp_file = self.file_name + ".tmp"
+        with io.open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump({"done": sorted(self.done), "totals": totals}, file)
+        os.replace(tmp_file, self.file_name)
+
+
+def _store_new(provider, incidents, incident_store, incidents_storage, totals):
+    """ Stores the incidents that are neither in the incident store nor in the database """
+    for incident in incidents:
+        totals["incidents"] += 1
+        if incident_store.exists(provider, file_ext=".json", file_name=incident["unique_string"]):
+            totals["known"] += 1
+            continue
+        try:
+            incidents_storage.insert_incident(incident)
+        except DuplicateIncidentException:
+            totals["known"] += 1
+            continue
+        except Exception as e:
+            totals["failed"] += 1
+            logging.getLogger(__name__).warning("Storing reprocessed incident %s failed: %s", incident["unique_string"], e)
+            continue
+        incident.pop("_id", None)
+        incident_store.save(
+            provider,
+            jsoncodec.dumps(incident),
+            file_ext=".json",
+            file_name=incident["unique_string"])
+        totals["new"] += 1
+
+
+def reprocess(provider,
+              date_from,
+              date_to,
+              processes=None,
+              checkpoint_file=None,
+              restart=False,
+              store_folders=STORE_FOLDERS,
+              incident_store=None,
+              incidents_storage=None,
+              processor_factory=None,
+              batch_size=BATCH_SIZE):
+    """ Runs the processor of the provider over its raw and processed pushes of the given days
+        (YYYYMMDD or YYYY-MM-DD, inclusive) and stores incidents that were not found before in the
+        incident store and the database. Incidents are not sent to witnesses.
+
+        Every date folder or archive is processed by one of processes worker processes (one per cpu if
+        None, in-process if 1), storing is done by the calling process. The workers send the incidents
+        in batches of batch_size through a bounded queue, such that memory does not grow with the size
+        of a unit. Finished units are recorded in checkpoint_file, a second run with the same file skips
+        them unless restart is given.
+
+        :returns: throughput report
+    """
+    if store_folders == STORE_FOLDERS:
+        sqlite_stores = [name for name in STORE_NAMES if backend_name(name) != "file"]
+        if len(sqlite_stores) == len(STORE_NAMES):
+            raise Exception("Reprocessing reads the date folders of the file backend, the raw and processed stores use sqlite")
+        for name in sqlite_stores:
+            logging.getLogger(__name__).warning("The %s store uses the %s backend, its pushes are not reprocessed", name, backend_name(name))
+    if incident_store is None:
+        incident_store = IncidentFileStore()
+    if incidents_storage is None:
+        from .implementations import incidents_storage
+    if checkpoint_file is None:
+        checkpoint_file = os.path.join(Config.get("dump_folder", default="dump"), "reprocess",
+                                       "{0}_{1}_{2}.json".format(provider, _normalize_date(date_from), _normalize_date(date_to)))
+    if restart and os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
+    checkpoint = Checkpoint(checkpoint_file)
+
+    units = [unit for unit in find_units(provider, date_from, date_to, store_folders) if unit not in checkpoint.done]
+    totals = {"units": 0, "bytes": 0, "incidents": 0, "new": 0, "known": 0, "failed": 0}
+    totals.update(checkpoint.totals)
+    logging.getLogger(__name__).info("Reprocessing %d units of %s, %d done before", len(units), provider, len(checkpoint.done))
+
+    started = time.monotonic()
+    this_run = {"units": 0, "bytes": 0, "incidents": 0}
+    # incidents per unit that is in progress
+    found = {}
+
+    def received(result):
+        path, batch, size = result
+        _store_new(provider, batch, incident_store, incidents_storage, totals)
+        found[path] = found.get(path, 0) + len(batch)
+        this_run["incidents"] += len(batch)
+        if size is None:
+            return
+        totals["units"] += 1
+        totals["bytes"] += size
+        this_run["units"] += 1
+        this_run["bytes"] += size
+        checkpoint.finish(path, totals)
+        logging.getLogger(__name__).info("Reprocessed %s: %d incidents, %d/%d units", path, found.pop(path), this_run["units"], len(units))
+
+    if processes == 1 or len(units) <= 1:
+        _initialize_worker(provider, processor_factory, _DirectResults(received))
+        for unit in units:
+            _process_unit(provider, unit, batch_size)
+    else:
+        context = multiprocessing.get_context()
+        # bounded, workers wait while the calling process is storing
+        results = context.Queue(maxsize=4 * (processes or os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=context,
+                                 initializer=_initialize_worker,
+                                 initargs=(provider, processor_factory, results)) as executor:
+            futures = [executor.submit(_process_unit, provider, unit, batch_size) for unit in units]
+            remaining = len(units)
+            while remaining:
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            raise future.exception()
+                    continue
+                received(result)
+                if result[2] is not None:
+                    remaining -= 1
+
+    elapsed = time.monotonic() - started
+    return {
+        "provider": provider,
+        "date_from": _normalize_date(date_from),
+        "date_to": _normalize_date(date_to),
+        "checkpoint": checkpoint_file,
+        "totals": totals,
+        "seconds": round(elapsed, 3),
+        "units_per_second": round(this_run["units"] / elapsed, 3) if elapsed else None,
+        "incidents_per_second": round(this_run["incidents"] / elapsed, 3) if elapsed else None,
+        "megabytes_per_second": round(this_run["bytes"] / elapsed / 1024 / 1024, 3) if elapsed else None,
+    }
@@ -4,8 +4,6 @@ import logging
 import time
 import pkg_resources
 import hashlib
-import glob
-import os
 
 
 from .. import datestring
@@ -91,46 +89,35 @@ class IsAlive(object):
         provider_status = []
         mask = Config.get("subscriptions", "mask_providers", default=True)
         if mask:
-            if CommonFormat.MASK is None:
-                if type(mask) == bool:
-                    mask = json.dumps(Config.get("subscriptions", "witnesses")) + json.dumps(Config.get("providers"))
-                CommonFormat.MASK = mask
+            CommonFormat.get_mask()
         for provider in provider_names:
-            if self._incidents_store.folder_exists(provider):
-                list_of_files = glob.glob(os.path.join(self._incidents_store.get_storage_path(provider), "*"))
-                if list_of_files:
-                    latest_file = max(list_of_files, key=os.path.getctime)
-                    latest_ctime = os.path.getctime(latest_file)
-
-                    if datetime.datetime.now().timestamp() - latest_ctime < Config.get("providers_setting", "error_after_no_incident_in_hours", 24) * 60 * 60:
-                        status = "ok"
-                    else:
-                        status = "nok"
-                        all_is_well = False
-                    provider_dict = {
-                        "status": status,
-                        "last_incident": datestring.date_to_string(os.path.getctime(latest_file))
-                    }
-                else:
-                    provider_dict = {
-                        "status": "nok",
-                        "last_incident": None
-                    }
-                    all_is_well = False
-                    latest_file = None
-
-                masked_name = provider + CommonFormat.MASK
-                masked_name = hashlib.md5(masked_name.encode()).hexdigest()
-                if mask_names:
-                    provider_dict["name"] = masked_name
-                else:
-                    provider_dict["name"] = provider
-                    provider_dict["hash"] = masked_name
-                    provider_dict["last_incident_name"] = latest_file
-
-                provider_status.append(provider_dict)
+            latest = self._incidents_store.latest(provider)
+            if latest is None:
+                # providers without any incident are not listed
+                continue
+            latest_file = latest.location
+            latest_ctime = latest.written
+
+            if datetime.datetime.now().timestamp() - latest_ctime < Config.get("providers_setting", "error_after_no_incident_in_hours", 24) * 60 * 60:
+                status = "ok"
             else:
                 status = "nok"
+                all_is_well = False
+            provider_dict = {
+                "status": status,
+                "last_incident": datestring.date_to_string(latest_ctime)
+            }
+
+            masked_name = provider + CommonFormat.MASK
+            masked_name = hashlib.md5(masked_name.encode()).hexdigest()
+            if mask_names:
+                provider_dict["name"] = masked_name
+            else:
+                provider_dict["name"] = provider
+                provider_dict["hash"] = masked_name
+                provider_dict["last_incident_name"] = latest_file
+
+            provider_status.append(provider_dict)
         if all_is_well:
             all_is_well = "ok"
         else:
@@ -166,6 +153,8 @@ class IsAlive(object):
                 else:
                     _thread_dict["name"] = t.name
                     _thread_dict["hash"] = _masked_name
+                    if hasattr(t, "stats"):
+                        _thread_dict["stats"] = t.stats.as_dict()
                 background_threads_dict.append(_thread_dict)
             except Exception as e:
                 logging.getLogger(__name__).error("Error in background task: {}".format(str(e)))
@@ -0,0 +1,31 @@
+import falcon
+
+from .resolve import get_params
+from .. import metrics
+
+
+class Metrics(object):
+    """ Metrics of the dataproxy in the Prometheus text exposition format
+
+        Adds */metrics route. Labels contain witness urls and provider names, thus
+        the metrics are only served to localhost or when the remote control token is given.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def on_get(self, req, resp):
+        from .. import Config
+
+        if req.remote_addr != "127.0.0.1":
+            params = get_params(req, "token")
+            try:
+                if params.get("token") is None or not params.get("token") == Config.get("remote_control", "token"):
+                    resp.status = falcon.HTTP_404
+                    return
+            except KeyError:
+                resp.status = falcon.HTTP_404
+                return
+
+        resp.body = metrics.REGISTRY.expose()
+        resp.content_type = Metrics.CONTENT_TYPE
+        resp.status = falcon.HTTP_200
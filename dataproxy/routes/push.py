@@ -1,6 +1,7 @@
 import io
 import cgi
 import time
+import json
 
 import pkg_resources
 import falcon
@@ -8,6 +9,9 @@ import urllib
 
 import logging
 
+from .. import metrics
+from .. import profiling
+
 
 ALLOWED_FILE_TYPES = (
     "multipart/form-data"
@@ -51,6 +55,17 @@ class PushReceiver(object):
 
     subscribed_witnesses_status = {}
 
+    RECEIVERS = {}
+
+    @staticmethod
+    def register(provider_name, receiver):
+        """ Makes the receiver available for in-process ingestion, see get_receiver """
+        PushReceiver.RECEIVERS[provider_name] = receiver
+
+    @staticmethod
+    def get_receiver(provider_name):
+        return PushReceiver.RECEIVERS.get(provider_name, None)
+
     def __init__(self,
                  raw_store,
                  processed_store,
@@ -69,13 +84,13 @@ class PushReceiver(object):
         resp.body = "Waiting for POST push notifications from " +\
                     self._provider_name
         resp.status = falcon.HTTP_200
-        logging.getLogger(__name__ + "_" + self._provider_name).info("GET received from " + req.remote_addr)
+        logging.getLogger(__name__ + "_" + self._provider_name).info("GET received from %s", req.remote_addr)
 
     def on_pull(self, req, resp):
         resp.body = "Waiting for POST push notifications from " +\
                     self._provider_name
         resp.status = falcon.HTTP_200
-        logging.getLogger(__name__ + "_" + self._provider_name).info("PULL received from " + req.remote_addr)
+        logging.getLogger(__name__ + "_" + self._provider_name).info("PULL received from %s", req.remote_addr)
 
     def _cgiFieldStorageToDict(self, fieldStorage):
         """ Get a plain dictionary, rather than the '.value' system used
@@ -86,11 +101,27 @@ class PushReceiver(object):
             params[key] = fieldStorage[key].value
         return params
 
+    def _unquote_form(self, raw_file_content):
+        """ :returns: (content, file ending) of an xml=... or json=... body, the content is a
+            memoryview into the unquoted body """
+        file_content = urllib.parse.unquote_to_bytes(raw_file_content)
+        if file_content.startswith(b"xml="):
+            return memoryview(file_content)[4:], ".xml"
+        elif file_content.startswith(b"json="):
+            return memoryview(file_content)[5:], ".json"
+        return file_content, ".json"
+
+    def _archive_rejected(self):
+        """ Pushes rejected on their raw bytes are kept in the raw store unless providers.<name>.push.archive_rejected is false """
+        from .. import Config
+
+        return Config.get("providers", self._provider_name, "push", "archive_rejected", default=True)
+
     @falcon.before(validate_pusher)
     def on_post(self, req, resp, raw_file_content=None):
         self.process(req, resp, raw_file_content=raw_file_content)
 
-    def process_content(self, file_content, file_ending, restrict_witness_group=None, async_queue=True, target=None):
+    def process_content(self, file_content, file_ending, restrict_witness_group=None, async_queue=True, target=None, archive=True):
         from .. import implementations
 
         if restrict_witness_group is None and target is not None:
@@ -104,34 +135,80 @@ class PushReceiver(object):
             file_content,
             file_ending,
             restrict_witness_group=restrict_witness_group,
-            async_queue=async_queue
+            async_queue=async_queue,
+            archive=archive
         )
 
-    def process(self, req, resp, raw_file_content=None):
-        from .. import utils
+    def ingest(self, payload, file_ending=".json", archive=None, archive_raw=None, async_queue=True, target=None):
+        """ In-process counterpart of a POST push, e.g. for pollers running inside the dataproxy.
+
+            The already parsed payload is handed to the processor directly, there is no
+            serialization, HTTP round-trip or multipart parsing involved.
+
+            :param payload: parsed json payload (dict or list)
+            :param archive: store the payload in the processed store, defaults to providers.<name>.ingest.archive (True)
+            :param archive_raw: store the payload in the raw store as well, defaults to providers.<name>.ingest.archive_raw (False)
+        """
+        from .. import Config
+
+        started = time.perf_counter()
+        if archive is None:
+            archive = Config.get("providers", self._provider_name, "ingest", "archive", default=True)
+        if archive_raw is None:
+            archive_raw = Config.get("providers", self._provider_name, "ingest", "archive_raw", default=False)
+        if archive_raw:
+            self._raw_store.save(
+                self._provider_name,
+                json.dumps(payload)
+            )
+
+        with profiling.profiled("ingest", self._provider_name):
+            result = self.process_content(payload, file_ending, async_queue=async_queue, target=target, archive=archive)
+        metrics.PUSH_LATENCY.labels(self._provider_name).observe(time.perf_counter() - started)
+
+        logger = logging.getLogger(__name__ + "_" + self._provider_name)
+        if not result["is_interesting"]:
+            logger.info("in-process/%s: payload not interesting, skip", self._provider_name)
+        else:
+            logger.info("in-process/%s: payload processed, %d incidents found and triggered sending to witnesses",
+                        self._provider_name, result["amount_incidents"])
+        return result
 
+    def process(self, req, resp, raw_file_content=None):
+        started = time.perf_counter()
         if raw_file_content is None:
-            raw_file_content = utils.save_string(req.stream.read())
-        raw_file_name = self._raw_store.save(
-            self._provider_name,
-            raw_file_content
-        )
+            # stays bytes, it is stored as is and only decoded once the processor needs text
+            raw_file_content = req.stream.read()
+        elif isinstance(raw_file_content, str):
+            raw_file_content = raw_file_content.encode("utf-8")
+        metrics.PUSH_BYTES.labels(self._provider_name).observe(len(raw_file_content))
         file_content = None
 
         file_ending = None
+        # multipart bodies contain the file as it is, thus uninteresting ones are rejected before parsing
+        rejected = "multipart/form-data" in req.content_type and\
+            self._provider_processor is not None and\
+            not self._provider_processor.raw_source_of_interest(raw_file_content)
+        raw_file_name = None
+        if not rejected:
+            # first of all, the raw store is the source of replay and reprocessing
+            raw_file_name = self._raw_store.save(
+                self._provider_name,
+                raw_file_content
+            )
         # depending on the content_type, search for contained files
-        if "multipart/form-data" in req.content_type:
+        if rejected:
+            result = {"do_not_send_to_witness": True, "is_interesting": False, "file_name": None, "amount_incidents": 0}
+        elif "multipart/form-data" in req.content_type:
             try:
                 upload = cgi.FieldStorage(
-                    fp=io.BytesIO(raw_file_content.encode()),
+                    fp=io.BytesIO(raw_file_content),
                     environ=req.env)
                 upload = self._cgiFieldStorageToDict(upload)
                 try:
                     # check for xml file
                     file_content = upload["xml"]
-                    if isinstance(file_content, bytes):
-                        file_content = file_content.decode("utf-8")
-                    if not isinstance(file_content, str):
+                    if not isinstance(file_content, (str, bytes)):
                         raise falcon.HTTPBadRequest(
                             "Bad request",
                             "Sent file does not have any content")
@@ -145,9 +222,7 @@ class PushReceiver(object):
                 if not file_content:
                     try:
                         file_content = upload["json"]
-                        if isinstance(file_content, bytes):
-                            file_content = file_content.decode("utf-8")
-                        if not isinstance(file_content, str):
+                        if not isinstance(file_content, (str, bytes)):
                             raise falcon.HTTPBadRequest(
                                 "Bad request",
                                 "Sent file does not have any content")
@@ -160,38 +235,28 @@ class PushReceiver(object):
                 logging.getLogger(__name__).exception(e)
 
         elif "application/x-www-form-urlencoded" in req.content_type:
-            file_content = urllib.parse.unquote(raw_file_content)
-            if file_content.startswith("xml="):
-                file_content = file_content[4:len(file_content)]
-                file_ending = ".xml"
-            elif file_content.startswith("json="):
-                file_content = file_content[5:len(file_content)]
-                file_ending = ".json"
-            else:
-                file_content = file_content
-                file_ending = ".json"
+            file_content, file_ending = self._unquote_form(raw_file_content)
 
         elif "application/json" in req.content_type:
-            file_content = urllib.parse.unquote(raw_file_content)
-            if file_content.startswith("xml="):
-                file_content = file_content[4:len(file_content)]
-                file_ending = ".xml"
-            elif file_content.startswith("json="):
-                file_content = file_content[5:len(file_content)]
-                file_ending = ".json"
-            else:
-                file_content = file_content
-                file_ending = ".json"
+            file_content, file_ending = self._unquote_form(raw_file_content)
 
-        result = self.process_content(file_content, file_ending)
+        if not rejected:
+            metrics.PARSE_LATENCY.labels(self._provider_name).observe(time.perf_counter() - started)
+            result = self.process_content(file_content, file_ending)
 
         do_not_send_to_witness = result["do_not_send_to_witness"]
         is_interesting = result["is_interesting"]
         file_name = result["file_name"]
         amount_incidents = result["amount_incidents"]
 
+        if rejected and self._archive_rejected():
+            raw_file_name = self._raw_store.save(
+                self._provider_name,
+                raw_file_content
+            )
+
         # no content given
-        if not file_content:
+        if not file_content and not rejected:
             resp.body = "NO_CONTENT_GIVEN"
             resp.status = falcon.HTTP_400
         else:
@@ -202,16 +267,16 @@ class PushReceiver(object):
             else:
                 resp.body = self._post_response
                 resp.status = falcon.HTTP_200
+        metrics.PUSH_LATENCY.labels(self._provider_name).observe(time.perf_counter() - started)
 
         # construct log message
+        logger = logging.getLogger(__name__ + "_" + self._provider_name)
         if not is_interesting:
-            file_info = ', file content not interesting, skip'
+            logger.info("%s/%s: POST received, file content not interesting, skip",
+                        req.remote_addr, self._provider_name)
+        elif file_name:
+            logger.info("%s/%s: POST received, %s parsed, %d incidents found and triggered sending to witnesses",
+                        req.remote_addr, self._provider_name, file_name, amount_incidents)
         else:
-            if file_name:
-                file_info = ", " + file_name +\
-                    " parsed, " + str(amount_incidents) + " incidents found and triggered sending to witnesses"
-            else:
-                file_info = ", " + raw_file_name + " accepted, nothing found"
-
-        logging.getLogger(__name__ + "_" + self._provider_name).info(req.remote_addr + "/" + self._provider_name +
-                                                                     ": POST received" + file_info)
+            logger.info("%s/%s: POST received, %s accepted, nothing found",
+                        req.remote_addr, self._provider_name, raw_file_name)
@@ -0,0 +1,55 @@
+import hmac
+import json
+import falcon
+import logging
+
+
+TOKEN_HEADER = "X-Remote-Control-Token"
+
+
+def get_token(req):
+    """ Token from the header or the json body {"token": ...}, never from the query string """
+    token = req.get_header(TOKEN_HEADER)
+    if token is None and req.content_length:
+        try:
+            body = json.loads(req.stream.read(req.content_length).decode("utf-8"))
+        except ValueError:
+            return None
+        if isinstance(body, dict) and isinstance(body.get("token"), str):
+            token = body["token"]
+    return token
+
+
+class Reload(object):
+    """ Reloads the configuration of the dataproxy without restart, requires the remote control token
+
+        Adds */reload route, POST with the token in the X-Remote-Control-Token header or in the
+        json body. Requests that are being processed finish with the old configuration.
+    """
+    def on_post(self, req, resp):
+        from .. import Config
+
+        token = get_token(req)
+        logging.getLogger(__name__).info("POST reload received (" + req.remote_addr + ")")
+
+        try:
+            expected = Config.get("remote_control", "token")
+            if token is None or not expected or not hmac.compare_digest(str(token), str(expected)):
+                resp.status = falcon.HTTP_404
+                return
+        except KeyError:
+            resp.status = falcon.HTTP_404
+            return
+
+        try:
+            files = Config.reload()
+        except Exception as e:
+            logging.getLogger(__name__).warning("Reloading the configuration failed, keeping the current one", exc_info=e)
+            resp.body = json.dumps({"status": "failed", "message": str(e), "revision": Config.revision})
+            resp.content_type = falcon.MEDIA_JSON
+            resp.status = falcon.HTTP_500
+            return
+
+        resp.body = json.dumps({"status": "ok", "files": files, "revision": Config.revision})
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
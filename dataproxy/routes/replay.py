@@ -17,6 +17,7 @@ class Replay(object):
                             "provider",
                             "received",
                             "name_filter",
+                            "matches",
                             "only_report",
                             "token",
                             "manufacture",
@@ -46,6 +47,7 @@ class Replay(object):
             params["provider"] = "Replay only using incidents from this provider, default from all providers"
             params["received"] = "Replay only incidents that were received matching this regex (e.g. 201805 to replay all received in May 2018). If not given it tries to guess the desired range according to the name_filter, if no guess poissble search complete database"
             params["name_filter"] = "Replay only incidents whose id matches this string or match all in comma seperated list (e.g. 'soccer', or '2018-05-31', or 'world  cup', or '2018-05-31,soccer,create'), mandatory."
+            params["matches"] = "Replay only incidents that match this filter expression, e.g. 'home~wizards and call=result' or 'sport=soccer and not call=create'"
             params["only_report"] = "Only generate a report of what would happen, default false"
             params["manufacture"] = "Unique string of an incident to be manufactured, format is specified in bos-incidents/format/incident_to_string"
             resp.body = json.dumps(
@@ -7,6 +7,9 @@ import shutil
 import logging
 from datetime import datetime
 from . import datestring
+from . import metrics
+from . import profiling
+from .backends import get_backend, FileBackend
 
 
 def zip_it(folder):
@@ -21,66 +24,93 @@ def zip_it(folder):
     logging.getLogger("RawStore").info("Deleting done, old folder was " + folder)
 
 
+def _yearmonthdate(folder_time=None):
+    if not folder_time:
+        folder_time = time.time()
+    if type(folder_time) == datetime:
+        folder_time = folder_time.timestamp()
+    return time.strftime("%Y%m%d", time.localtime(folder_time))
+
+
+def _zip_previous_day(storage_path, folder_time=None):
+    """ Zips the date folder of the previous day once the folder of the current day is missing """
+    if not folder_time:
+        folder_time = time.time()
+    if type(folder_time) == datetime:
+        folder_time = folder_time.timestamp()
+    date_folder = storage_path.format(yearmonthdate=_yearmonthdate(folder_time))
+    # check if folder exists. if it doesnt, create it and zip the old one
+    if not os.path.isdir(date_folder):
+        # go back 23h in time
+        old_date_folder = storage_path.format(yearmonthdate=_yearmonthdate(folder_time - 60 * 60 * 23))
+        if os.path.isdir(old_date_folder):
+            thr = threading.Thread(target=zip_it, args=(old_date_folder,), kwargs={})
+            thr.start()  # we dont care when it finishes
+
+
 class RawStore(object):
-    """ Stores the stream content as is in the file system """
+    """ Stores the stream content as is, in the backend configured for the raw store """
     _CHUNK_SIZE_BYTES = 4096
+    STORE_NAME = "raw"
 
     def __init__(self,
                  storage_path="dump/a_raw/{yearmonthdate}",
                  uuidgen=uuid.uuid4,
                  fopen=io.open,
-                 dmakedir=os.makedirs):
+                 dmakedir=os.makedirs,
+                 backend=None):
         self._storage_path = storage_path
         self._uuidgen = uuidgen
-        self._fopen = fopen
-        self._dmakedir = dmakedir
+        if backend is None:
+            backend = get_backend(self.STORE_NAME, storage_path, fopen=fopen, dmakedir=dmakedir)
+        self._backend = backend
+
+        # only date folders of the file backend can be zipped
+        self._zip_old = isinstance(backend, FileBackend)
+
+    def hand_over_archiving(self):
+        """ Switches off archiving the previous day on rollover, for an archiver that takes over
+
+            :returns: the storage path of the date folders, None if the store does not archive them
+        """
+        if not self._zip_old:
+            return None
+        self._zip_old = False
+        return self._storage_path
 
     def get_storage_path(self, sub_folder, folder_time=None):
-        if not folder_time:
-            folder_time = time.time()
-        date_folder = self._storage_path.format(
-            yearmonthdate=time.strftime("%Y%m%d", time.localtime(folder_time))
-        )
-        folder = os.path.join(
-            date_folder,
-            sub_folder
-        )
-
-        # check if folder exists. if it doesnt, create it and zip the old one
-        if not os.path.isdir(date_folder):
-            # go back 23h in time
-            old_date_folder = self._storage_path.format(
-                yearmonthdate=time.strftime("%Y%m%d", time.localtime(folder_time - 60 * 60 * 23))
-            )
-            if os.path.isdir(old_date_folder):
-                thr = threading.Thread(target=zip_it, args=(old_date_folder,), kwargs={})
-                thr.start()  # we dont care when it finishes
-
-        # ensure all subfolders exist
-        self._dmakedir(folder, exist_ok=True)
-
-        return folder
+        """ Folder of the file backend """
+        if not isinstance(self._backend, FileBackend):
+            raise Exception(self.__class__.__name__ + " does not store in the file system")
+        if self._zip_old:
+            _zip_previous_day(self._storage_path, folder_time)
+        return self._backend.path(_yearmonthdate(folder_time), sub_folder)
+
+    def prune(self, date_before):
+        """ Deletes the items of the days before date_before (YYYYMMDD) unless the backend archives
+            them, see backends.StorageBackend.prune """
+        return self._backend.prune(date_before)
 
     def save(self, sub_folder, file_content):
         name = '{timestamp}_{uuid}{ext}'.format(
             timestamp=time.strftime("%Y%m%d-%H%M%S"),
             uuid=self._uuidgen(),
             ext='.raw')
-        file_path = self.get_storage_path(sub_folder)
-        file_name = os.path.join(
-            file_path,
-            name
-        )
+        with profiling.profiled("store_" + self.__class__.__name__, sub_folder):
+            if self._zip_old:
+                _zip_previous_day(self._storage_path)
 
-        with self._fopen(file_name, 'w') as file:
-            file.write(file_content)
+            with metrics.STORE_WRITE_LATENCY.labels(self.__class__.__name__).time():
+                location = self._backend.save(_yearmonthdate(), sub_folder, name, file_content)
 
-        return name, file_path
+        return name, os.path.dirname(location)
 
 
 class FileStore(object):
-    """ Stores parsed files in the file system """
+    """ Stores parsed files per date and provider (sub folder), in the file system or
+        the backend configured for the store, see backends.get_backend """
     _CHUNK_SIZE_BYTES = 4096
+    STORE_NAME = None
 
     def __init__(self,
                  storage_path="dump/{yearmonthdate}/received",
@@ -88,115 +118,105 @@ class FileStore(object):
                  fopen=io.open,
                  dmakedir=os.makedirs,
                  disfile=os.path.isfile,
-                 disfolder=os.path.isdir):
+                 disfolder=os.path.isdir,
+                 backend=None):
         self._storage_path = storage_path
         self._uuidgen = uuidgen
-        self._fopen = fopen
-        self._dmakedir = dmakedir
-        self._disfile = disfile
-        self._disfolder = disfolder
+        if backend is None:
+            backend = get_backend(self.STORE_NAME, storage_path,
+                                  fopen=fopen, dmakedir=dmakedir, disfile=disfile, disfolder=disfolder)
+        self._backend = backend
 
         self._zip_old = False
 
-    def _get_storage_path(self, sub_folder, folder_time=None):
-        if not folder_time:
-            folder_time = time.time()
-        if type(folder_time) == datetime:
-            folder_time = folder_time.timestamp()
-
-        date_folder = self._storage_path.format(
-            yearmonthdate=time.strftime("%Y%m%d", time.localtime(folder_time))
-        )
-        folder = os.path.join(
-            date_folder,
-            sub_folder
-        )
-
-        # check if folder exists. if it doesnt, create it and zip the old one
-        if self._zip_old and not os.path.isdir(date_folder):
-            # go back 23h in time
-            old_date_folder = self._storage_path.format(
-                yearmonthdate=time.strftime("%Y%m%d", time.localtime(folder_time - 60 * 60 * 23))
-            )
-            if os.path.isdir(old_date_folder):
-                thr = threading.Thread(target=zip_it, args=(old_date_folder,), kwargs={})
-                thr.start()  # we dont care when it finishes
-
-        # ensure all subfolders exist
-        self._dmakedir(folder, exist_ok=True)
-
-        return folder
+    def _date(self, folder_time=None):
+        return _yearmonthdate(folder_time)
 
-    def get_storage_path(self, sub_folder, name=None, folder_time=None):
-        folder = self._get_storage_path(sub_folder, folder_time)
+    def hand_over_archiving(self):
+        """ Switches off archiving the previous day on rollover, for an archiver that takes over
 
-        if name:
-            return os.path.join(
-                folder,
-                name
-            )
-        else:
-            return folder
+            :returns: the storage path of the date folders, None if the store does not archive them
+        """
+        if not self._zip_old:
+            return None
+        self._zip_old = False
+        return self._storage_path
+
+    def get_storage_path(self, sub_folder, name=None, folder_time=None):
+        """ Folder (or file, if name is given) of the file backend """
+        if not isinstance(self._backend, FileBackend):
+            raise Exception(self.__class__.__name__ + " does not store in the file system")
+        return self._backend.path(self._date(folder_time), sub_folder, name)
 
     def exists(self,
                sub_folder,
                file_ext=".xml",
                file_name=None,
                folder_time=None):
-        file_path = self.get_storage_path(sub_folder, file_name + file_ext, folder_time)
-        return self._disfile(file_path)
+        return self._backend.exists(self._date(folder_time), sub_folder, file_name + file_ext)
 
     def folder_exists(self, sub_folder, folder_time=None):
-        folder_path = self.get_storage_path(sub_folder, folder_time=folder_time)
-        return self._disfolder(folder_path)
+        return self._backend.folder_exists(self._date(folder_time), sub_folder)
 
     def save(self,
              sub_folder,
              file_string,
              file_ext=".xml",
              file_name=None,
-             folder_time=None):
+             folder_time=None,
+             overwrite=False):
         if not file_name:
             name = '{timestamp}_{uuid}'.format(
                 timestamp=time.strftime("%Y%m%d-%H%M%S"),
                 uuid=self._uuidgen())
-            fail_if_exists = True
+            if_exists = "fail"
         else:
             name = file_name
-            fail_if_exists = False
+            if_exists = "overwrite" if overwrite else "keep"
 
         name = name + file_ext
 
-        file_path = self.get_storage_path(sub_folder, name, folder_time=folder_time)
-        if self._disfile(file_path):
-            if fail_if_exists:
-                raise Exception("File exists, but shouldnt!")
-        else:
-            with self._fopen(file_path, 'wt', encoding="utf-8") as file:
-                file.write(file_string)
+        with profiling.profiled("store_" + self.__class__.__name__, sub_folder):
+            if self._zip_old:
+                _zip_previous_day(self._storage_path, folder_time)
+            with metrics.STORE_WRITE_LATENCY.labels(self.__class__.__name__).time():
+                self._backend.save(self._date(folder_time), sub_folder, name, file_string, if_exists=if_exists)
         return name
 
-    def open(self, sub_folder, name):
-        file_path = self.get_storage_path(sub_folder, name)
-        stream = self._fopen(file_path, 'rb')
-        stream_len = os.path.getsize(file_path)
+    def open(self, sub_folder, name, folder_time=None):
+        return self._backend.open(self._date(folder_time), sub_folder, name)
 
-        return stream, stream_len
+    def prune(self, date_before):
+        """ Deletes the items of the days before date_before (YYYYMMDD) unless the backend archives
+            them, see backends.StorageBackend.prune """
+        return self._backend.prune(date_before)
+
+    def iterate(self, sub_folder=None, date_from=None, date_to=None):
+        """ :returns: generator of the stored items (backends.StoredItem), dates as YYYYMMDD """
+        return self._backend.iterate(sub_folder, date_from, date_to)
+
+    def latest(self, sub_folder=None):
+        """ :returns: the most recently written item (backends.StoredItem) of the sub folder or None """
+        return self._backend.last_written(sub_folder)
 
 
 class ProcessedFileStore(FileStore):
+    STORE_NAME = "processed"
+
     def __init__(self):
         super(ProcessedFileStore, self).__init__(
             storage_path="dump/c_processed/{yearmonthdate}")
-        self._zip_old = True
+        self._zip_old = isinstance(self._backend, FileBackend)
 
 
 class IncidentFileStore(FileStore):
+    STORE_NAME = "incidents"
     last_written = None
 
-    def __init__(self, storage_path="dump/d_incidents/{yearmonthdate}"):
+    def __init__(self, storage_path="dump/d_incidents/{yearmonthdate}", backend=None):
         super(IncidentFileStore, self).__init__(
-            storage_path=storage_path)
+            storage_path=storage_path,
+            backend=backend)
 
     def save(self,
              sub_folder,
@@ -214,7 +234,13 @@ class IncidentFileStore(FileStore):
 
 
 class CacheFileStore(FileStore):
-    def __init__(self):
+    """ Persistent cache, its items are not partitioned by date such that it stays warm over midnight """
+    STORE_NAME = "cache"
+
+    def __init__(self, storage_path="dump/b_cache", backend=None):
         super(CacheFileStore, self).__init__(
-            storage_path="dump/b_cache/{yearmonthdate}")
+            storage_path=storage_path,
+            backend=backend)
 
+    def _date(self, folder_time=None):
+        return "persistent"
@@ -13,6 +13,9 @@ import os
 import logging
 from . import Config
 from . import datestring
+from . import metrics
+from . import profiling
+from . import jsoncodec
 
 try:
     from bookiesports.normalize import IncidentsNormalizer, NotNormalizableException
@@ -38,11 +41,17 @@ def get_log_file_path(log_file_name=None):
         return LOG_FOLDER
 
 
+BYTES_TYPES = (bytes, bytearray, memoryview)
+
+
 def save_string(source):
     """ Loads str and bytes object properly into json """
-    safe_return = {str: lambda: source,
-                   bytes: lambda: source.decode("utf-8")}
-    return safe_return[type(source)]()
+    if isinstance(source, str):
+        return source
+    if isinstance(source, BYTES_TYPES):
+        # decodes memoryviews without copying them to bytes first
+        return str(source, "utf-8")
+    raise KeyError(type(source))
 
 
 def search_in(search_for, in_list):
@@ -50,7 +59,8 @@ def search_in(search_for, in_list):
 
 
 def save_json_loads(source):
-    return json.loads(save_string(source))
+    # the codec decodes utf-8 bytes itself, without an intermediate str
+    return jsoncodec.loads(source)
 
 
 def slugify(value, allow_unicode=False):
@@ -74,14 +84,18 @@ class CommonFormat(object):
 
     JSON_SCHEMA_CACHED = None
     MASK = None
+    # configuration revision the mask was built from
+    MASK_REVISION = None
 
     @staticmethod
     def get_mask():
-        if CommonFormat.MASK is None:
+        if CommonFormat.MASK is None or CommonFormat.MASK_REVISION != Config.revision:
+            revision = Config.revision
             mask = Config.get("subscriptions", "mask_providers", default=True)
             if type(mask) == bool:
                 mask = json.dumps(Config.get("subscriptions", "witnesses")) + json.dumps(Config.get("providers"))
             CommonFormat.MASK = mask
+            CommonFormat.MASK_REVISION = revision
         return CommonFormat.MASK
 
     @staticmethod
@@ -105,7 +119,8 @@ class CommonFormat(object):
                     formatted_dict[key] = date_to_string(value)
 
     def validate(self, formatted_dict):
-        IncidentValidator().validate_incident(formatted_dict)
+        with metrics.VALIDATE_LATENCY.time():
+            IncidentValidator().validate_incident(formatted_dict)
 
     def get_id_as_string(self, incident_id):
         return incident_id["start_time"] \
@@ -116,6 +131,10 @@ class CommonFormat(object):
 
     def prepare_for_dump(self, formatted_dict):
         """ reformats dates, validates the json and creates unique_string identifier """
+        with metrics.PREPARE_FOR_DUMP_LATENCY.time(), profiling.profiled("prepare_for_dump"):
+            return self._prepare_for_dump(formatted_dict)
+
+    def _prepare_for_dump(self, formatted_dict):
         self.reformat_datetimes(formatted_dict)
         self.validate(formatted_dict)
         # get all to ensure they exist!
@@ -129,7 +148,8 @@ class CommonFormat(object):
         return formatted_dict
 
     def normalize_for_witness(self, validated_incident):
-        return IncidentsNormalizer().normalize(validated_incident)
+        with metrics.NORMALIZE_LATENCY.time():
+            return IncidentsNormalizer().normalize(validated_incident)
 
 
 def date_to_string(date_object=None):
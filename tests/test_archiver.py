@@ -0,0 +1,83 @@
+import os
+import time
+import unittest
+import shutil
+import tarfile
+import tempfile
+
+from .abstract import TestWithConfig
+
+from dataproxy import archiver as archiver_module
+from dataproxy.archiver import Archiver, Throttle
+
+
+class TestArchiver(TestWithConfig):
+
+    def setUp(self):
+        super(TestArchiver, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.folder, "a_raw", "{yearmonthdate}")
+        self.today = time.strftime("%Y%m%d")
+        for date in ["20200101", self.today]:
+            os.makedirs(os.path.join(self.folder, "a_raw", date, "radish"))
+            with open(os.path.join(self.folder, "a_raw", date, "radish", "push.raw"), "w") as file:
+                file.write("content of " + date)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        super(TestArchiver, self).tearDown()
+
+    def test_archive_past_days(self):
+        archiver = Archiver([self.storage_path], max_bytes_per_second=1024 * 1024)
+        self.assertEqual(archiver.pending(), [os.path.join(self.folder, "a_raw", "20200101")])
+
+        archiver.execute()
+
+        archive = os.path.join(self.folder, "a_raw", "20200101.tar.gz")
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "a_raw", "20200101")))
+        self.assertFalse(os.path.exists(archive + ".tmp"))
+        self.assertTrue(os.path.isdir(os.path.join(self.folder, "a_raw", self.today)))
+        with tarfile.open(archive) as tar:
+            self.assertEqual(tar.getnames(), ["./radish/push.raw"])
+            self.assertEqual(tar.extractfile("./radish/push.raw").read(), b"content of 20200101")
+        self.assertEqual(archiver.pending(), [])
+
+    @unittest.skipIf(archiver_module.fcntl is None, "needs fcntl")
+    def test_skips_locked_folder(self):
+        folder = os.path.join(self.folder, "a_raw", "20200101")
+        archiver = Archiver([self.storage_path])
+        # flock locks of different open files exclude each other like those of another process
+        lock = os.open(folder + ".lock", os.O_RDWR | os.O_CREAT)
+        try:
+            archiver_module.fcntl.flock(lock, archiver_module.fcntl.LOCK_EX)
+            self.assertIsNone(archiver.archive(folder))
+            self.assertTrue(os.path.isdir(folder))
+            self.assertFalse(os.path.exists(folder + ".tar.gz.tmp"))
+        finally:
+            os.close(lock)
+
+        self.assertEqual(archiver.archive(folder), folder + ".tar.gz")
+        self.assertFalse(os.path.exists(folder + ".lock"))
+        # archived by another process since it was listed
+        self.assertIsNone(archiver.archive(folder))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(folder))), sorted(["20200101.tar.gz", self.today]))
+
+    def test_from_config(self):
+        from dataproxy.stores import RawStore, IncidentFileStore
+
+        raw_store = RawStore(self.storage_path)
+        archiver = Archiver.from_config([raw_store, IncidentFileStore(os.path.join(self.folder, "d_incidents", "{yearmonthdate}"))])
+        self.assertEqual(archiver._storage_paths, [self.storage_path])
+        # the store does not archive on rollover anymore
+        self.assertIsNone(raw_store.hand_over_archiving())
+
+    def test_throttle(self):
+        now = [0.0]
+        slept = []
+        throttle = Throttle(100, clock=lambda: now[0], sleep=slept.append)
+        throttle.consume(50)
+        throttle.consume(50)
+        self.assertEqual(slept, [0.5, 1.0])
+        now[0] = 5.0
+        throttle.consume(100)
+        self.assertEqual(len(slept), 2)
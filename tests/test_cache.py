@@ -0,0 +1,151 @@
+import os
+import shutil
+import time
+import tempfile
+import threading
+
+from .abstract import TestWithConfig
+
+from dataproxy.cache import LRUCache, SeenSet, SizedLRUCache, TieredJsonCache
+from dataproxy.stores import CacheFileStore
+
+
+class TestLRUCache(TestWithConfig):
+
+    def test_eviction_order(self):
+        cache = LRUCache(capacity=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # touch a, b is now least recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        now = [0]
+        cache = LRUCache(capacity=10, ttl=5, clock=lambda: now[0])
+        cache.set("a", 1)
+        now[0] = 6
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.replace("a", 2, "missing"), "missing")
+        self.assertEqual(cache.replace("a", 3), 2)
+
+
+class TestSeenSet(TestWithConfig):
+
+    def test_check_and_add(self):
+        seen = SeenSet(capacity=2)
+        self.assertFalse(seen.check_and_add("a"))
+        self.assertTrue(seen.check_and_add("a"))
+        seen.check_and_add("b")
+        seen.check_and_add("c")
+        self.assertFalse(seen.check_and_add("a"))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as folder:
+            persist_file = os.path.join(folder, "history", "seen.json")
+            seen = SeenSet(capacity=10, persist_file=persist_file)
+            seen.check_and_add("a")
+            seen.check_and_add("b")
+            seen.save()
+
+            restarted = SeenSet(capacity=10, persist_file=persist_file, persist_interval=0.05)
+            self.assertTrue(restarted.check_and_add("a"))
+            self.assertTrue(restarted.check_and_add("b"))
+            self.assertFalse(restarted.check_and_add("c"))
+            seen.close()
+
+            # written in the background, not by check_and_add
+            for unused in range(100):
+                with open(persist_file) as file:
+                    if "\"c\"" in file.read():
+                        break
+                time.sleep(0.05)
+            self.assertTrue(SeenSet(capacity=10, persist_file=persist_file).check_and_add("c"))
+            restarted.close()
+
+            # persisting enabled later keeps what was added before
+            late = SeenSet(capacity=10)
+            late.check_and_add("d")
+            late.save()
+            late.persist_to(persist_file)
+            self.assertTrue(late.check_and_add("a"))
+            self.assertTrue(late.check_and_add("d"))
+            late.close()
+            self.assertTrue(SeenSet(capacity=10, persist_file=persist_file).check_and_add("d"))
+
+
+class TestTieredJsonCache(TestWithConfig):
+
+    def setUp(self):
+        super(TestTieredJsonCache, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.store = CacheFileStore(os.path.join(self.folder, "b_cache"))
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        super(TestTieredJsonCache, self).tearDown()
+
+    def getter(self, value):
+        def get():
+            self.calls.append(value)
+            return value
+        return get
+
+    def test_tiers(self):
+        now = [1000.0]
+        cache = TieredJsonCache(self.store, "Processor", ttl=60, clock=lambda: now[0])
+        self.assertEqual(cache.get("event", self.getter({"id": 1})), {"id": 1})
+        self.assertEqual(cache.get("event", self.getter({"id": 2})), {"id": 1})
+
+        # a new process only has the store
+        cache = TieredJsonCache(self.store, "Processor", ttl=60, clock=lambda: now[0])
+        self.assertEqual(cache.get("event", self.getter({"id": 3})), {"id": 1})
+        self.assertEqual(cache.get("event", self.getter({"id": 3}), overwrite=True), {"id": 3})
+        now[0] += 61
+        self.assertEqual(cache.get("event", self.getter({"id": 4})), {"id": 4})
+
+        self.assertEqual(self.calls, [{"id": 1}, {"id": 3}, {"id": 4}])
+        self.assertEqual(cache.stats()["store_hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_memory_bytes(self):
+        cache = SizedLRUCache(capacity=10, max_bytes=100)
+        cache.set("a", 1, size=60)
+        cache.set("b", 2, size=30)
+        cache.set("c", 3, size=30)
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.bytes, 60)
+        self.assertEqual(cache.replace("b", 4, size=50), 2)
+        self.assertEqual(cache.bytes, 80)
+        self.assertIsNone(cache.replace("d", 5, size=40))
+        self.assertNotIn("c", cache)
+        self.assertEqual(cache.bytes, 90)
+
+    def test_single_flight(self):
+        cache = TieredJsonCache(self.store, "Processor")
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            self.calls.append("slow")
+            return {"id": 1}
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(cache.get("event", slow)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(cache._flight.do("event", self.getter({"id": 2}))))
+        second.start()
+        # give the second lookup time to join the running one
+        time.sleep(0.2)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, [{"id": 1}, {"id": 1}])
+        self.assertEqual(self.calls, ["slow"])
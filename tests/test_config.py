@@ -0,0 +1,114 @@
+import os
+import tempfile
+
+from .abstract import TestWithConfig
+
+from dataproxy import Config
+from dataproxy.utils import CommonFormat
+from dataproxy.processors import GenericProcessor
+
+
+class TestConfig(TestWithConfig):
+
+    def test_get(self):
+        self.assertEqual(Config.get("providers", "radish", "name"), Config.get_config()["providers"]["radish"]["name"])
+        self.assertEqual(Config.get("does", "not", "exist", 42), 42)
+        self.assertEqual(Config.get("does", "not", "exist", default=None), None)
+        self.assertRaises(KeyError, Config.get, "does", "not", "exist")
+        self.assertRaises(KeyError, Config.get, "does", "not", "exist", 1, default=1)
+
+    def test_none_counts_as_missing(self):
+        data = Config.get_config()
+        data["empty"] = None
+        data["empty_list"] = [None]
+        Config.swap(data)
+        self.assertRaises(KeyError, Config.get, "empty")
+        self.assertEqual(Config.get("empty", 1), 1)
+        self.assertIsNone(Config.get("empty_list"))
+
+    def test_swap(self):
+        revision = Config.revision
+        snapshot = Config.snapshot()
+        data = Config.get_config()
+        data["added"] = {"key": "value"}
+        Config.swap(data)
+
+        self.assertEqual(Config.revision, revision + 1)
+        self.assertEqual(Config.get("added", "key"), "value")
+        # snapshots taken earlier are not affected
+        self.assertEqual(snapshot.data.get("added", None), None)
+        data["added"]["key"] = "changed"
+        self.assertEqual(Config.get("added", "key"), "value")
+
+    def test_snapshots_are_immutable(self):
+        self.addCleanup(Config.swap, Config.get_config())
+        handle, file_name = tempfile.mkstemp(suffix=".yaml")
+        os.close(handle)
+        self.addCleanup(os.remove, file_name)
+        self.addCleanup(lambda: Config.files.remove(file_name))
+        with open(file_name, "w") as file:
+            file.write("subscriptions:\n  postfix: /loaded\n")
+
+        data = Config.get_config()
+        data["added"] = {"list": [1]}
+        Config.swap(data)
+        snapshot = Config.snapshot()
+        # loading builds new data instead of updating the active snapshot
+        Config.load(file_name, True)
+        self.assertEqual(Config.get("subscriptions", "postfix"), "/loaded")
+        self.assertNotEqual(snapshot.data["subscriptions"].get("postfix", None), "/loaded")
+
+        # values can't be changed through get, copies can
+        self.assertRaises(TypeError, Config.get("added").__setitem__, "key", "value")
+        self.assertRaises(TypeError, Config.get("added", "list").append, 2)
+        copied = Config.get_config()
+        copied["added"]["list"].append(2)
+        self.assertEqual(Config.get("added", "list"), [1])
+
+    def test_reload(self):
+        handle, file_name = tempfile.mkstemp(suffix=".yaml")
+        os.close(handle)
+        self.addCleanup(os.remove, file_name)
+        self.addCleanup(lambda: Config.files.remove(file_name))
+        with open(file_name, "w") as file:
+            file.write("subscriptions:\n  witnesses:\n    - http://localhost:1/trigger\n")
+        Config.load(file_name, True)
+        CommonFormat.get_mask()
+        self.assertEqual(len(GenericProcessor.get_timed_shuffled_subscribers()["none"]), 1)
+
+        with open(file_name, "w") as file:
+            file.write("subscriptions:\n  witnesses:\n    - http://localhost:1/trigger\n    - http://localhost:2/trigger\n")
+        revision = Config.revision
+        Config.reload()
+
+        self.assertEqual(Config.revision, revision + 1)
+        self.assertEqual(len(Config.get("subscriptions", "witnesses")), 2)
+        CommonFormat.get_mask()
+        self.assertEqual(CommonFormat.MASK_REVISION, Config.revision)
+        self.assertEqual(len(GenericProcessor.get_timed_shuffled_subscribers()["none"]), 2)
+
+    def test_reload_route(self):
+        import falcon
+        from falcon import testing
+        from dataproxy.routes.reload import Reload, TOKEN_HEADER
+
+        def set_token():
+            data = Config.get_config()
+            data["remote_control"] = {"token": "secret"}
+            Config.swap(data)
+
+        api = falcon.API()
+        api.add_route("/reload", Reload())
+        client = testing.TestClient(api)
+
+        set_token()
+        # only POST, the token is not read from the query string
+        self.assertEqual(client.simulate_get("/reload", params={"token": "secret"}).status_code, 405)
+        self.assertEqual(client.simulate_post("/reload", params={"token": "secret"}).status_code, 404)
+        self.assertEqual(client.simulate_post("/reload", headers={TOKEN_HEADER: "wrong"}).status_code, 404)
+
+        revision = Config.revision
+        self.assertEqual(client.simulate_post("/reload", headers={TOKEN_HEADER: "secret"}).json["revision"], revision + 1)
+        # the reload dropped the swapped in token
+        set_token()
+        self.assertEqual(client.simulate_post("/reload", json={"token": "secret"}).json["revision"], revision + 3)
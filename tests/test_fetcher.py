@@ -0,0 +1,82 @@
+from .abstract import TestWithConfig
+
+from dataproxy.provider.fetcher import RateLimiter, PooledFetcher
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append((url, dict(headers or {})))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+class TestFetcher(TestWithConfig):
+
+    def test_rate_limiter(self):
+        clock = FakeClock()
+        limiter = RateLimiter(2, burst=3, clock=clock, sleep=clock.sleep)
+        # the burst passes without waiting, then one call every 0.5s
+        self.assertEqual([limiter.acquire() for unused in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+        # idle time refills the bucket, at most up to the burst
+        clock.now += 10
+        self.assertEqual([limiter.acquire() for unused in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+        self.assertAlmostEqual(sum(clock.slept), 1.5)
+
+    def test_conditional_get(self):
+        fetcher = PooledFetcher("test", max_workers=1)
+        try:
+            fetcher._session = FakeSession([
+                FakeResponse(200, {"ETag": "\"v1\"", "Last-Modified": "Mon, 21 Jan 2019 10:00:00 GMT"}),
+                FakeResponse(304),
+                FakeResponse(200, {"ETag": "\"v2\""}),
+                FakeResponse(200),
+                FakeResponse(200),
+            ])
+            url = "http://provider/events"
+            self.assertEqual(fetcher.get_conditional(url).status_code, 200)
+            self.assertIsNone(fetcher.get_conditional(url))
+            self.assertEqual(fetcher.get_conditional(url).status_code, 200)
+            fetcher.forget_validators(url)
+            self.assertEqual(fetcher.get_conditional(url).status_code, 200)
+            # the last response had no validators
+            fetcher.get_conditional(url)
+
+            headers = [request[1] for request in fetcher._session.requests]
+            self.assertEqual(headers[0], {})
+            self.assertEqual(headers[1], {"If-None-Match": "\"v1\"", "If-Modified-Since": "Mon, 21 Jan 2019 10:00:00 GMT"})
+            self.assertEqual(headers[2], {"If-None-Match": "\"v1\"", "If-Modified-Since": "Mon, 21 Jan 2019 10:00:00 GMT"})
+            self.assertEqual(headers[3], {})
+            self.assertEqual(headers[4], {})
+        finally:
+            fetcher.close()
@@ -0,0 +1,64 @@
+from .abstract import TestWithConfig
+
+from dataproxy.filters import compile_filter, IdentifierFilter
+from dataproxy.processors import JsonProcessor
+
+
+INCIDENT = {
+    "id": {
+        "sport": "Basketball",
+        "home": "Washington Wizards",
+        "away": "Golden State Warriors",
+        "event_group_name": "NBA Regular Season",
+        "start_time": "2019-01-25T01:00:00Z"
+    },
+    "call": "create",
+    "arguments": {"season": "2019"},
+    "provider_info": {"name": "radish", "api_event_id": 2865094, "source_file": "wizards.json"}
+}
+
+
+class TestFilters(TestWithConfig):
+
+    def test_identifiers(self):
+        self.assertTrue(compile_filter("golden state").matches(INCIDENT))
+        self.assertTrue(compile_filter(2865094).matches(INCIDENT))
+        self.assertTrue(compile_filter(["lakers", "2019-01-25"]).matches(INCIDENT))
+        self.assertFalse(compile_filter(["lakers", "create"]).matches(INCIDENT))
+        self.assertFalse(compile_filter([]).matches(INCIDENT))
+        # only the id fields are looked at
+        self.assertFalse(compile_filter("wizards.json").matches(INCIDENT))
+        self.assertIsInstance(compile_filter("lakers or wizards"), IdentifierFilter)
+        # plain strings that are no valid expression, e.g. team names
+        incident = {"id": {"home": "Team (W)", "away": "Ateam!"}}
+        self.assertTrue(compile_filter("Team (W)").matches(incident))
+        self.assertTrue(compile_filter("ateam!").matches(incident))
+        self.assertFalse(compile_filter("Team (W)").matches(INCIDENT))
+
+    def test_expressions(self):
+        for expression, expected in [
+                ("sport=basketball and call=create", True),
+                ("sport=basketball and not call=create", False),
+                ("home~wizards and (call=result or call=create)", True),
+                ("start_time>=2019-01-25 and start_time<2019-01-26", True),
+                ("arguments.season!=2019 or provider=radish", True),
+                ("unknown.field=x", False),
+                ('away="golden state warriors"', True),
+                ("lakers or api_event_id=2865094", True),
+                # numbers compare numerically, other values as strings
+                ("api_event_id>999999", True),
+                ("api_event_id<10000000", True),
+                ("arguments.season>=2019.0 and arguments.season<=2019", True),
+                ("home>Washington", True)]:
+            self.assertEqual(compile_filter(expression).matches(INCIDENT), expected, expression)
+        self.assertFalse(compile_filter("api_event_id>10").matches({"provider_info": {"api_event_id": 9}}))
+        self.assertTrue(compile_filter("api_event_id>10").matches({"provider_info": {"api_event_id": "11"}}))
+        for expression in ["", "sport=", "(home~wizards", "home~wizards and"]:
+            self.assertRaises(Exception, compile_filter, expression)
+
+    def test_debug_games(self):
+        processor = JsonProcessor()
+        processor.debug_games("wizards and call=create")
+        self.assertEqual(len(list(processor.iter_generic(as_string=[INCIDENT]))), 1)
+        processor.debug_games("lakers")
+        self.assertEqual(len(list(processor.iter_generic(as_string=[INCIDENT]))), 0)
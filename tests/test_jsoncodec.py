@@ -0,0 +1,46 @@
+import json
+from unittest import mock
+
+from .abstract import TestWithConfig
+
+from dataproxy import Config, jsoncodec
+from dataproxy.processors import JsonProcessor
+
+
+INCIDENT = {
+    "id": {"sport": "Soccer", "home": "Málaga", "away": "Sevilla", "event_group_name": "LaLiga", "start_time": "2019-01-25T19:00:00Z"},
+    "call": "create",
+    "arguments": {"season": "2019"},
+    "provider_info": {"name": "radish", "pushed": "2019-01-20T03:18:36Z"},
+    "unique_string": "2019-01-25t190000z__soccer__laliga__malaga__sevilla__create__2019"
+}
+
+
+class TestJsonCodec(TestWithConfig):
+
+    def test_codecs(self):
+        for name, (dumps, loads) in jsoncodec.CODECS.items():
+            content = dumps(INCIDENT)
+            self.assertIsInstance(content, bytes, name)
+            self.assertEqual(json.loads(content), INCIDENT, name)
+            self.assertEqual(loads(content), INCIDENT, name)
+            self.assertEqual(loads(content.decode("utf-8")), INCIDENT, name)
+
+        # not serializable or parseable by every codec, handled by the stdlib then
+        self.assertEqual(json.loads(jsoncodec.dumps({1: "a"})), {"1": "a"})
+        self.assertEqual(jsoncodec.loads(memoryview(b"[2e400, 18446744073709551616]")), [float("inf"), 18446744073709551616])
+
+    def test_serialized_once_for_all_witnesses(self):
+        data = Config.get_config()
+        data["subscriptions"]["witnesses"] = [{"url": "http://witness" + str(i), "group": "test"} for i in range(5)]
+        data["subscriptions"]["delay_to_next_witness_in_seconds"] = 0
+        Config.swap(data)
+        response = mock.Mock(status_code=200)
+        with mock.patch("dataproxy.processors.requests.post", return_value=response) as post,\
+                mock.patch("dataproxy.jsoncodec.dumps", wraps=jsoncodec.dumps) as dumps:
+            status = JsonProcessor().send_to_witness(json.loads(json.dumps(INCIDENT)))
+        self.assertEqual(len(status), 5)
+        self.assertEqual(dumps.call_count, 1)
+        bodies = set(call[1]["data"] for call in post.call_args_list)
+        self.assertEqual(len(bodies), 1)
+        self.assertEqual(json.loads(bodies.pop())["id"], INCIDENT["id"])
@@ -0,0 +1,87 @@
+import sys
+import json
+import queue
+import logging
+import threading
+
+from .abstract import TestWithConfig
+
+from dataproxy import logs
+
+
+class FakeRequest(object):
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.context = {}
+
+    def get_header(self, name):
+        return self.headers.get(name, None)
+
+
+class FakeResponse(object):
+
+    def __init__(self):
+        self.headers = {}
+
+    def set_header(self, name, value):
+        self.headers[name] = value
+
+
+def _record(message, args=None, exc_info=None):
+    return logging.LogRecord("dataproxy.test", logging.WARNING, __file__, 1, message, args, exc_info)
+
+
+class TestLogs(TestWithConfig):
+
+    def test_json_lines_formatter(self):
+        record = _record("pushed %s", ("radish",))
+        logs.RequestIdFilter().filter(record)
+        entry = json.loads(logs.JsonLinesFormatter().format(record))
+        self.assertEqual(entry["message"], "pushed radish")
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["request_id"], "-")
+
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            record = _record("failed", exc_info=sys.exc_info())
+        self.assertIn("ValueError: broken", json.loads(logs.JsonLinesFormatter().format(record))["exception"])
+
+    def test_local_queue_handler(self):
+        records = queue.Queue()
+        handler = logs.LocalQueueHandler(records)
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            handler.handle(_record("pushed %s", ("radish",), sys.exc_info()))
+        record = records.get_nowait()
+        self.assertEqual((record.msg, record.args, record.exc_info), ("pushed radish", None, None))
+        self.assertIn("ValueError: broken", record.exc_text)
+        # the listener formats it as if it was the original record
+        self.assertIn("ValueError: broken", json.loads(logs.JsonLinesFormatter().format(record))["exception"])
+
+    def test_request_id_in_threads(self):
+        token = logs.set_request_id("abc")
+        try:
+            seen = []
+            thread = threading.Thread(target=logs.run_in_context(lambda: seen.append(logs.get_request_id())))
+            thread.start()
+            thread.join()
+            self.assertEqual(seen, ["abc"])
+        finally:
+            logs.reset_request_id(token)
+        self.assertIsNone(logs.get_request_id())
+
+    def test_request_id_middleware(self):
+        middleware = logs.RequestIdMiddleware()
+        for header, reused in [("client-id.42", True), ("x" * 65, False), ("id\nforged log line", False), (None, False)]:
+            request = FakeRequest({logs.RequestIdMiddleware.HEADER: header} if header else {})
+            response = FakeResponse()
+            middleware.process_request(request, response)
+            request_id = logs.get_request_id()
+            middleware.process_response(request, response, None)
+            self.assertEqual(response.headers[logs.RequestIdMiddleware.HEADER], request_id)
+            self.assertEqual(request_id == header, reused, header)
+            self.assertTrue(logs.VALID_REQUEST_ID.match(request_id))
+            self.assertIsNone(logs.get_request_id())
@@ -0,0 +1,45 @@
+from .abstract import TestWithConfig
+
+from dataproxy import metrics
+
+
+class TestMetrics(TestWithConfig):
+
+    def test_counter_and_gauge(self):
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter("test_incidents", "help", ("provider", "outcome")))
+        counter.labels("radish", "new").inc()
+        counter.labels("radish", "new").inc(2)
+        gauge = registry.register(metrics.Gauge("test_depth", "help"))
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        exposed = registry.expose()
+        self.assertIn('test_incidents_total{provider="radish",outcome="new"} 3', exposed)
+        self.assertIn("# TYPE test_depth gauge", exposed)
+        self.assertIn("test_depth 1", exposed)
+
+    def test_histogram(self):
+        registry = metrics.Registry()
+        histogram = registry.register(metrics.Histogram("test_latency", "help", ("store",), buckets=(0.1, 1)))
+        histogram.labels("RawStore").observe(0.05)
+        histogram.labels("RawStore").observe(0.5)
+        histogram.labels("RawStore").observe(5)
+
+        exposed = registry.expose()
+        self.assertIn('test_latency_bucket{store="RawStore",le="0.1"} 1', exposed)
+        self.assertIn('test_latency_bucket{store="RawStore",le="1"} 2', exposed)
+        self.assertIn('test_latency_bucket{store="RawStore",le="+Inf"} 3', exposed)
+        self.assertIn('test_latency_count{store="RawStore"} 3', exposed)
+
+    def test_duplicate_registration(self):
+        registry = metrics.Registry()
+        registry.register(metrics.Counter("test_twice", "help"))
+        with self.assertRaises(ValueError):
+            registry.register(metrics.Counter("test_twice", "help"))
+
+    def test_pipeline_metrics_exposed(self):
+        exposed = metrics.REGISTRY.expose()
+        self.assertIn("# TYPE dataproxy_push_latency_seconds histogram", exposed)
+        self.assertIn("dataproxy_delivery_queue_depth", exposed)
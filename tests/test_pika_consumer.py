@@ -0,0 +1,259 @@
+import time
+import queue
+import threading
+
+from .abstract import TestWithConfig
+
+from dataproxy.pika_consumer import AsyncPikaConsumer
+
+
+class FakeIOLoop(object):
+
+    def __init__(self):
+        self._callbacks = queue.Queue()
+        self._timers = []
+        self._running = False
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.put(callback)
+
+    def call_later(self, delay, callback):
+        self._timers.append((time.monotonic() + delay, callback))
+
+    def start(self):
+        self._running = True
+        while self._running:
+            now = time.monotonic()
+            due = [timer for timer in self._timers if timer[0] <= now]
+            for timer in due:
+                self._timers.remove(timer)
+                timer[1]()
+            try:
+                self._callbacks.get(timeout=0.005)()
+            except queue.Empty:
+                pass
+
+    def stop(self):
+        self._running = False
+
+
+class FakeBroker(object):
+    """ In-process stand-in for one AMQP queue """
+
+    def __init__(self, messages):
+        self.ready = list(messages)
+        self.acked = []
+        self.nacked = []
+        # prefetched messages that were rejected since their consumer was cancelled
+        self.rejected = 0
+        self.ack_calls = 0
+        self.max_unacked = 0
+        self.connections = 0
+        self.drop_connection_after = None
+        self.lock = threading.Lock()
+
+    def connect(self, parameters, on_open_callback, on_open_error_callback, on_close_callback):
+        self.connections += 1
+        return FakeConnection(self, on_open_callback, on_close_callback)
+
+
+class FakeConnection(object):
+
+    def __init__(self, broker, on_open_callback, on_close_callback):
+        self.broker = broker
+        self.ioloop = FakeIOLoop()
+        self.is_closing = False
+        self.is_closed = False
+        self._on_close_callback = on_close_callback
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def channel(self, on_open_callback):
+        self._channel = FakeChannel(self)
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self._channel))
+
+    def close(self, reason="closed"):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        # unacknowledged messages are requeued
+        self.broker.ready = [body for unused, body in sorted(self._channel.unacked.items())] + self.broker.ready
+        self._channel.unacked = {}
+        self._channel.prefetched = []
+        self.ioloop.add_callback_threadsafe(lambda: self._on_close_callback(self, reason))
+
+
+class FakeChannel(object):
+    """ Like pika, messages are sent up to the prefetch count ahead and handed to the consumer
+        one by one. Sent messages that arrive after a cancel are rejected and requeued
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.unacked = {}
+        # (delivery tag, body) sent to the client, not yet handed to the consumer
+        self.prefetched = []
+        self.next_tag = 1
+        self.consumer = None
+        self.prefetch_count = 0
+        self.delivered = 0
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def basic_qos(self, prefetch_count, callback):
+        self.prefetch_count = prefetch_count
+        self.connection.ioloop.add_callback_threadsafe(lambda: callback(None))
+
+    def basic_consume(self, queue_name, on_message_callback):
+        self.consumer = on_message_callback
+        self.connection.ioloop.add_callback_threadsafe(self._deliver)
+        return "consumer"
+
+    def basic_cancel(self, consumer_tag):
+        self.consumer = None
+        for delivery_tag, body in reversed(self.prefetched):
+            del self.unacked[delivery_tag]
+            self.broker.ready.insert(0, body)
+            self.broker.rejected += 1
+        self.prefetched = []
+
+    def _deliver(self):
+        while self.consumer is not None and self.broker.ready and len(self.unacked) < self.prefetch_count:
+            if self.broker.drop_connection_after == self.delivered:
+                self.broker.drop_connection_after = None
+                self.connection.close("dropped")
+                return
+            body = self.broker.ready.pop(0)
+            self.unacked[self.next_tag] = body
+            self.prefetched.append((self.next_tag, body))
+            self.next_tag += 1
+            self.delivered += 1
+            self.broker.max_unacked = max(self.broker.max_unacked, len(self.unacked))
+            self.connection.ioloop.add_callback_threadsafe(self._dispatch)
+
+    def _dispatch(self):
+        if self.consumer is None or not self.prefetched:
+            return
+        delivery_tag, body = self.prefetched.pop(0)
+        method_frame = type("Method", (object, ), {"delivery_tag": delivery_tag})
+        self.consumer(self, method_frame, None, body)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.broker.ack_calls += 1
+        for tag in [tag for tag in self.unacked if (tag <= delivery_tag if multiple else tag == delivery_tag)]:
+            self.broker.acked.append(self.unacked.pop(tag))
+        self.connection.ioloop.add_callback_threadsafe(self._deliver)
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        body = self.unacked.pop(delivery_tag)
+        if requeue:
+            self.broker.ready.append(body)
+        else:
+            self.broker.nacked.append(body)
+
+
+class Consumer(AsyncPikaConsumer):
+
+    def __init__(self, broker, **kwargs):
+        super(Consumer, self).__init__("localhost", 5672, "user", "password", "/", "incidents",
+                                       connection_factory=broker.connect, reconnect_delay=0.01, **kwargs)
+        self.processed = []
+        self.in_processing = 0
+        self.max_in_processing = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.lock = threading.Lock()
+
+    def on_message(self, channel, method_frame, header_frame, body):
+        with self.lock:
+            self.in_processing += 1
+            self.max_in_processing = max(self.max_in_processing, self.in_processing)
+        self.release.wait()
+        with self.lock:
+            self.in_processing -= 1
+            self.processed.append(body)
+        if body == "fail":
+            raise Exception("processing failed")
+
+
+class TestAsyncPikaConsumer(TestWithConfig):
+
+    def _run(self, broker, consumer, expected):
+        thread = threading.Thread(target=consumer.consume)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while len(broker.acked) + len(broker.nacked) < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        consumer.stop()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def test_batched_acks(self):
+        messages = ["message" + str(i) for i in range(200)]
+        messages[50] = "fail"
+        broker = FakeBroker(messages)
+        consumer = Consumer(broker, max_workers=4, ack_batch_size=20, ack_interval=0.05)
+        self._run(broker, consumer, len(messages))
+
+        self.assertEqual(sorted(broker.acked), sorted(x for x in messages if x != "fail"))
+        self.assertEqual(broker.nacked, ["fail"])
+        self.assertLess(broker.ack_calls, len(messages) / 5)
+        self.assertLessEqual(consumer.max_in_processing, 4)
+
+    def test_backpressure(self):
+        broker = FakeBroker(["message" + str(i) for i in range(100)])
+        consumer = Consumer(broker, max_workers=2, max_in_flight=6, ack_batch_size=1)
+        consumer.release.clear()
+        thread = threading.Thread(target=consumer.consume)
+        thread.start()
+        time.sleep(0.2)
+        # workers are blocked, the broker stops at max_in_flight unacknowledged deliveries
+        self.assertEqual(consumer.prefetch_count, 6)
+        self.assertEqual(broker.max_unacked, 6)
+        consumer.release.set()
+        deadline = time.monotonic() + 10
+        while len(broker.acked) < 100 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        consumer.stop()
+        thread.join(10)
+        self.assertEqual(sorted(broker.acked), sorted("message" + str(i) for i in range(100)))
+        self.assertLessEqual(consumer.max_in_processing, 2)
+        # backpressure came from the prefetch window, no prefetched message was requeued
+        self.assertEqual(broker.rejected, 0)
+
+    def test_slow_message_does_not_block_the_window(self):
+        messages = ["slow"] + ["message" + str(i) for i in range(50)]
+        broker = FakeBroker(messages)
+        slow = threading.Event()
+        self.addCleanup(slow.set)
+        consumer = Consumer(broker, max_workers=2, max_in_flight=4, ack_batch_size=10, ack_interval=0.05)
+        on_message = consumer.on_message
+        consumer.on_message = lambda channel, method, header, body: slow.wait() if body == "slow" else on_message(channel, method, header, body)
+        thread = threading.Thread(target=consumer.consume)
+        thread.start()
+        try:
+            deadline = time.monotonic() + 10
+            while broker.ready and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # the ack timer freed the window for all others while the first message is still being processed
+            self.assertEqual(broker.ready, [])
+            self.assertNotIn("slow", broker.acked)
+            slow.set()
+            while len(broker.acked) < 51 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            consumer.stop()
+            thread.join(10)
+        self.assertEqual(sorted(broker.acked), sorted(messages))
+        self.assertLessEqual(broker.max_unacked, 4)
+
+    def test_reconnect(self):
+        messages = ["message" + str(i) for i in range(100)]
+        broker = FakeBroker(messages)
+        broker.drop_connection_after = 30
+        consumer = Consumer(broker, max_workers=4, ack_batch_size=10, ack_interval=0.05)
+        self._run(broker, consumer, len(messages))
+
+        self.assertEqual(broker.connections, 2)
+        self.assertEqual(sorted(set(broker.acked)), sorted(messages))
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+from .abstract import TestWithConfig
+
+from dataproxy import Config
+from dataproxy.archiver import Archiver
+from dataproxy.processors import GenericProcessor, JsonProcessor, SourceStream
+
+
+class TestTargets(TestWithConfig):
+
+    def setUp(self):
+        super(TestTargets, self).setUp()
+        self.config = Config.get_config()
+        data = Config.get_config()
+        data["subscriptions"]["witnesses"] = [
+            {"url": "http://witness" + str(i), "name": "witness" + str(i), "group": "group" + str(i % 3)}
+            for i in range(12)
+        ]
+        Config.swap(data)
+
+    def tearDown(self):
+        Config.swap(self.config)
+        super(TestTargets, self).tearDown()
+
+    def test_shuffled_subscribers_for_targets(self):
+        shuffled = GenericProcessor.get_timed_shuffled_subscribers()
+        targets = [{"url": "http://witness" + str(i)} for i in (1, 4, 5, 11)]
+
+        expected = {}
+        for group in shuffled.keys():
+            for witness in shuffled[group]:
+                if witness["url"] in [x["url"] for x in targets]:
+                    expected.setdefault(group, []).append(witness)
+
+        self.assertEqual(GenericProcessor.get_timed_shuffled_subscribers(targets), expected)
+        # served from the cache
+        self.assertIs(GenericProcessor.get_timed_shuffled_subscribers(targets),
+                      GenericProcessor.get_timed_shuffled_subscribers(list(targets)))
+        self.assertEqual(GenericProcessor.get_timed_shuffled_subscribers([{"url": "http://unknown"}]), {})
+
+    def test_find_targets(self):
+        from dataproxy.implementations import _find_targets
+
+        self.assertEqual(len(_find_targets(None)), 12)
+        self.assertEqual([x["name"] for x in _find_targets("group1")], ["witness1", "witness4", "witness7", "witness10"])
+        self.assertEqual([x["name"] for x in _find_targets("http://witness3")], ["witness3"])
+        self.assertEqual([x["name"] for x in _find_targets("witness5")], ["witness5"])
+        self.assertEqual(_find_targets("unknown"), [])
+
+        data = Config.get_config()
+        data["subscriptions"]["witnesses"].append({"url": "http://witness12", "name": "witness12", "group": "group1"})
+        Config.swap(data)
+        self.assertEqual(len(_find_targets("group1")), 5)
+
+
+class TestArchivedSources(TestWithConfig):
+
+    def setUp(self):
+        super(TestArchivedSources, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        incidents_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "dump", "sampledata", "incidents")
+        self.names = sorted(os.listdir(incidents_folder))
+        for date in ["20190125", "20190126"]:
+            os.makedirs(os.path.join(self.folder, date, "radish"))
+            for name in self.names:
+                shutil.copy(os.path.join(incidents_folder, name), os.path.join(self.folder, date, "radish", name))
+        Archiver([os.path.join(self.folder, "{yearmonthdate}")]).archive(
+            os.path.join(self.folder, "20190125"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        super(TestArchivedSources, self).tearDown()
+
+    def test_archived_and_plain_folders(self):
+        incidents = JsonProcessor().process_generic(folder=self.folder, folder_filter=["radish", "2019"])
+        # both days contain the same incidents
+        self.assertEqual(len(incidents), len(self.names))
+
+        stream = SourceStream(JsonProcessor(), folder=self.folder, folder_filter=["radish", "20190125"], name_filter=["result"])
+        sources = list(stream)
+        self.assertEqual(stream.archives, [os.path.join(self.folder, "20190125.tar.gz")])
+        self.assertEqual([os.path.basename(source.name) for source in sources], [name for name in self.names if "result" in name])
+
+        incidents = JsonProcessor().process_generic(folder=self.folder, folder_filter=["other", "20190125"])
+        self.assertEqual(len(incidents), 0)
+
+    def test_streaming(self):
+        processor = JsonProcessor()
+        first = processor.iter_generic(folder=self.folder, folder_filter=["radish", "20190126"])
+        second = processor.iter_generic(folder=self.folder, folder_filter=["radish", "20190125"])
+        # the streams are independent of each other, also when interleaved
+        incidents = [incident for pair in zip(first, second) for incident in pair]
+        self.assertEqual(len(incidents), 2 * len(self.names))
+        self.assertEqual(list(first), [])
+        self.assertEqual(list(second), [])
+
+        # duplicates across days are skipped
+        self.assertEqual(len(list(processor.iter_generic(folder=self.folder, folder_filter=["radish", "2019"]))), len(self.names))
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+
+from .abstract import TestWithConfig
+
+from dataproxy import Config
+from dataproxy import profiling
+
+
+class TestProfiling(TestWithConfig):
+
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+        self.dump_folder = tempfile.mkdtemp()
+        data = Config.get_config()
+        data["dump_folder"] = self.dump_folder
+        data["profiling"] = {"enabled": True, "sample_rate": 0.0, "providers": ["radish"], "folder": "profiles"}
+        Config.swap(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dump_folder, ignore_errors=True)
+        super(TestProfiling, self).tearDown()
+
+    def test_profiled_provider(self):
+        with profiling.profiled("stage", "radish") as profile:
+            # nested stages are part of the enclosing profile
+            self.assertIs(profiling.profiled("inner", "radish"), profiling.NO_PROFILE)
+            sum(range(1000))
+        if profile._profile is None:
+            self.skipTest("another profiler is active")
+        dumps = [file_name for unused, unused, files in os.walk(self.dump_folder) for file_name in files]
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].startswith("stage_radish_"))
+        self.assertTrue(dumps[0].endswith(".pstats"))
+
+    def test_not_selected(self):
+        self.assertIs(profiling.profiled("stage", "other"), profiling.NO_PROFILE)
+
+        data = Config.get_config()
+        data["profiling"]["enabled"] = False
+        Config.swap(data)
+        self.assertIs(profiling.profiled("stage", "radish"), profiling.NO_PROFILE)
@@ -0,0 +1,30 @@
+from .abstract import TestWithConfig
+
+from dataproxy.provider.changes import FingerprintStore
+
+
+class TestFingerprintStore(TestWithConfig):
+
+    def test_only_changed_events(self):
+        store = FingerprintStore()
+        event = {"id": 1, "time_status": "0", "ss": None, "time": "1550000000", "home": {"name": "a"}}
+
+        self.assertEqual(store.filter_changed([event]), [event])
+        self.assertEqual(store.filter_changed([dict(event)]), [])
+
+        # irrelevant fields do not matter
+        self.assertEqual(store.filter_changed([dict(event, home={"name": "b"})]), [])
+
+        in_play = dict(event, time_status="1", ss="0-0")
+        self.assertEqual(store.filter_changed([in_play]), [in_play])
+
+        store.forget([in_play])
+        self.assertEqual(store.filter_changed([in_play]), [in_play])
+
+    def test_expiry(self):
+        now = [0]
+        store = FingerprintStore(expire_after=10, clock=lambda: now[0])
+        self.assertTrue(store.changed({"id": 1, "time_status": "0"}))
+        self.assertFalse(store.changed({"id": 1, "time_status": "0"}))
+        now[0] = 30
+        self.assertTrue(store.changed({"id": 1, "time_status": "0"}))
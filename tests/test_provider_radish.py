@@ -17,3 +17,158 @@ class TestRadish(TestWithConfig):
         radish.CommandLineInterface()
 
         print(radish)
+
+    def test_source_of_interest_parsed(self):
+        from dataproxy.provider.modules import radish
+
+        processor = radish.Processor()
+        event = {"id": "1", "sport_id": "1", "league": {"name": "league"}, "home": {"name": "home"}, "away": {"name": "away"}}
+        self.assertTrue(processor.source_of_interest({"results": [event]}))
+        self.assertTrue(processor.source_of_interest(json.dumps({"results": [event]}, separators=(", ", ": "))))
+        self.assertFalse(processor.source_of_interest({"results": []}))
+        self.assertFalse(processor.source_of_interest({"error": "something"}))
+
+    def test_raw_source_of_interest(self):
+        from dataproxy.provider.modules import radish
+        from dataproxy.implementations import process_content
+
+        processor = radish.Processor()
+        event = {"id": "1", "sport_id": "1", "league": {"name": "league"}, "home": {"name": "home"}, "away": {"name": "away"}}
+        content = ("json=" + json.dumps({"results": [event]})).encode("utf-8")
+        self.assertTrue(processor.raw_source_of_interest(content[5:]))
+        self.assertTrue(processor.raw_source_of_interest(memoryview(content)[5:]))
+        content = json.dumps({"success": 1, "odds": [event]}).encode("utf-8")
+        self.assertFalse(processor.raw_source_of_interest(content))
+        result = process_content("radish", processor, None, None, memoryview(content), ".json")
+        self.assertFalse(result["is_interesting"])
+
+    def test_lookups_follow_config_revision(self):
+        from dataproxy.provider.modules import radish
+        from dataproxy import Config
+
+        processor = radish.Processor()
+        self.assertEqual(processor._sports_by_id["1"]["name"], "Soccer")
+
+        data = Config.get_config()
+        data["providers"]["radish"]["recognize"]["sports"].append({"name": "Basketball", "id": 18})
+        Config.swap(data)
+        self.assertNotIn("18", processor._sports_by_id)
+        processor._ensure_lookups()
+        self.assertEqual(processor._sports_by_id["18"]["name"], "Basketball")
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession(object):
+    """ Answers conditional requests with 304 like the provider API does """
+
+    def __init__(self, payload):
+        self.payload = json.dumps(payload).encode("utf-8")
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None):
+        headers = headers or {}
+        self.requests.append(url)
+        if headers.get("If-None-Match") == "\"v1\"":
+            return FakeResponse(304)
+        return FakeResponse(200, self.payload, {"ETag": "\"v1\""})
+
+    def close(self):
+        pass
+
+
+class WithFakeFetcher(TestWithConfig):
+    """ Replaces the fetcher of radish by one with a fake session """
+
+    def setUp(self):
+        super(WithFakeFetcher, self).setUp()
+        from dataproxy.provider.modules import radish
+        from dataproxy.provider.fetcher import PooledFetcher
+
+        self.radish = radish
+        self.fetcher = PooledFetcher("test", max_workers=2)
+        self.fetcher._session = FakeSession({"success": 1, "results": [{"id": "1", "time_status": "3", "ss": "1-0"}]})
+        self.previous_fetcher = radish.FETCHER
+        radish.FETCHER = self.fetcher
+
+    def tearDown(self):
+        self.radish.FETCHER = self.previous_fetcher
+        self.fetcher.close()
+        super(WithFakeFetcher, self).tearDown()
+
+
+class TestRadishPolling(WithFakeFetcher):
+
+    def test_failed_send_is_retried(self):
+        thread = self.radish.BackgroundThread()
+        sent = []
+        outcomes = [False, True]
+        thread._send = lambda results: sent.append(results["results"]) or outcomes.pop(0)
+
+        url = "http://provider/ended?sport_id=1"
+        for unused in range(3):
+            thread._send_changed(self.radish.resolve_via_api(url, True), [url])
+
+        # the failed poll is not answered with 304, thus the events are sent again
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(sent[0], sent[1])
+        self.assertEqual(len(self.fetcher._session.requests), 3)
+        self.assertIsNone(self.fetcher.get_conditional(self.radish._with_token(url)))
+
+
+class FakeDetailsSession(FakeSession):
+    """ Serves event details, with a stale score """
+
+    def __init__(self):
+        super(FakeDetailsSession, self).__init__({})
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append(url)
+        event_id = url.split("event_id=")[1].split("&")[0]
+        details = {"id": event_id, "ss": "9-9", "confirmed_at": "1548370000"}
+        return FakeResponse(200, json.dumps({"success": 1, "results": [details]}).encode("utf-8"))
+
+
+class TestRadishEventDetails(WithFakeFetcher):
+
+    def setUp(self):
+        super(TestRadishEventDetails, self).setUp()
+        from dataproxy import Config
+
+        self.fetcher._session = FakeDetailsSession()
+        self.radish.EVENT_DETAILS.clear()
+        data = Config.get_config()
+        data["providers"]["radish"]["api"]["general"] = {"event": "http://provider/event"}
+        data["providers"]["radish"]["resolve_whistle_times"] = True
+        Config.swap(data)
+
+    def tearDown(self):
+        self.radish.EVENT_DETAILS.clear()
+        super(TestRadishEventDetails, self).tearDown()
+
+    def test_one_fetch_per_finished_event(self):
+        processor = self.radish.Processor()
+
+        def event(event_id, time_status, score=None):
+            result = {"id": event_id, "sport_id": "1", "time_status": time_status, "time": "1548370000",
+                      "league": {"name": "Premier League"}, "home": {"name": "Arsenal"}, "away": {"name": "Chelsea"}}
+            if score is not None:
+                result["ss"] = score
+            return result
+
+        poll = {"results": [event("1", "3", "2-1"), event("2", "3", "0-0"), event("3", "0")]}
+        processor._process_event_json(poll)
+        self.assertEqual(sorted(url.split("event_id=")[1].split("&")[0] for url in self.fetcher._session.requests), ["1", "2"])
+        # the next poll hits the cache
+        processor._process_event_json(poll)
+        self.assertEqual(len(self.fetcher._session.requests), 2)
+
+        # the score of the polled event is used, not the one of the cached details
+        self.assertEqual(processor._getArgument("result", None, "1", event("1", "3", "2-1")), {"home_score": "2", "away_score": "1"})
+        self.assertEqual(processor._getArgument("result", None, "1"), {"home_score": "9", "away_score": "9"})
@@ -0,0 +1,69 @@
+import json
+
+import falcon
+from falcon import testing
+
+from .abstract import TestWithConfig
+
+from dataproxy import Config
+from dataproxy.routes.push import PushReceiver
+
+
+EVENT = {"id": "1", "sport_id": "1", "league": {"name": "league"}, "home": {"name": "home"}, "away": {"name": "away"}}
+
+
+class FakeStore(object):
+
+    def __init__(self, failing=False):
+        self.saved = []
+        self.failing = failing
+
+    def save(self, sub_folder, content, **kwargs):
+        if self.failing:
+            raise Exception("disk full")
+        self.saved.append(bytes(content) if not isinstance(content, str) else content)
+        return "name"
+
+    def exists(self, *args, **kwargs):
+        return True
+
+
+class TestPushReceiver(TestWithConfig):
+
+    def setUp(self):
+        super(TestPushReceiver, self).setUp()
+        from dataproxy.provider.modules import radish
+
+        self.addCleanup(Config.swap, Config.get_config())
+        data = Config.get_config()
+        data["providers"]["radish"]["push"] = {"archive_rejected": False}
+        Config.swap(data)
+        self.raw_store = FakeStore()
+        self.processed_store = FakeStore()
+        self.receiver = PushReceiver(self.raw_store, self.processed_store, FakeStore(), "radish", "OK", radish.Processor())
+
+    def _post(self, body, content_type):
+        environ = testing.create_environ("/push/radish", method="POST", body=body, headers={"Content-Type": content_type})
+        response = falcon.Response()
+        self.receiver.process(falcon.Request(environ), response)
+        return response
+
+    def test_raw_store_written_first(self):
+        body = json.dumps({"results": [EVENT]}).encode("utf-8")
+        self.processed_store.failing = True
+        self.assertRaises(Exception, self._post, body, "application/json")
+        # the push can be replayed even though processing failed
+        self.assertEqual(self.raw_store.saved, [body])
+
+    def test_uninteresting_pushes(self):
+        # found uninteresting while processing, stored as before
+        body = b"json=" + json.dumps({"success": 1, "odds": []}).encode("utf-8")
+        self.assertEqual(self._post(body, "application/x-www-form-urlencoded").status, falcon.HTTP_200)
+        self.assertEqual(self.raw_store.saved, [body])
+
+        # rejected on the raw bytes, not archived with archive_rejected false
+        body = (b"--b\r\nContent-Disposition: form-data; name=\"json\"\r\n\r\n" +
+                json.dumps({"success": 1, "odds": []}).encode("utf-8") + b"\r\n--b--\r\n")
+        self.assertEqual(self._post(body, "multipart/form-data; boundary=b").status, falcon.HTTP_200)
+        self.assertEqual(len(self.raw_store.saved), 1)
+        self.assertEqual(self.processed_store.saved, [])
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from .abstract import TestWithConfig
+
+from bos_incidents import factory
+
+from dataproxy.archiver import Archiver
+from dataproxy.processors import JsonProcessor
+from dataproxy import reprocess as reprocessing
+from dataproxy.reprocess import reprocess, find_units
+from dataproxy.stores import IncidentFileStore
+
+
+def json_processor(provider):
+    return JsonProcessor()
+
+
+class TestReprocess(TestWithConfig):
+
+    def setUp(self):
+        super(TestReprocess, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.store_folder = os.path.join(self.folder, "c_processed")
+        incidents_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "dump", "sampledata", "incidents")
+        self.names = sorted(os.listdir(incidents_folder))
+        for date, names in [("20190125", self.names[0:10]), ("20190126", self.names), ("20190301", self.names)]:
+            os.makedirs(os.path.join(self.store_folder, date, "radish"))
+            for name in names:
+                shutil.copy(os.path.join(incidents_folder, name), os.path.join(self.store_folder, date, "radish", name))
+        Archiver([os.path.join(self.store_folder, "{yearmonthdate}")]).archive(os.path.join(self.store_folder, "20190126"))
+
+        self.storage = factory.get_incident_storage("mongodbtest", purge=True)
+        self.incident_store = IncidentFileStore(os.path.join(self.folder, "d_incidents", "{yearmonthdate}"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        super(TestReprocess, self).tearDown()
+
+    def _reprocess(self, processes=1, batch_size=reprocessing.BATCH_SIZE):
+        return reprocess("radish", "2019-01-25", "20190131",
+                         processes=processes,
+                         batch_size=batch_size,
+                         checkpoint_file=os.path.join(self.folder, "checkpoint.json"),
+                         store_folders=[self.store_folder],
+                         incident_store=self.incident_store,
+                         incidents_storage=self.storage,
+                         processor_factory=json_processor)
+
+    def test_reprocess(self):
+        self.assertEqual(find_units("radish", "20190125", "20190131", [self.store_folder]),
+                         [os.path.join(self.store_folder, "20190125"), os.path.join(self.store_folder, "20190126.tar.gz")])
+
+        report = self._reprocess()
+        self.assertEqual(report["totals"]["units"], 2)
+        self.assertEqual(report["totals"]["incidents"], 25)
+        self.assertEqual(report["totals"]["new"], 15)
+        self.assertEqual(report["totals"]["known"], 10)
+        self.assertEqual(len(list(self.storage.get_incidents())), 15)
+        self.assertEqual(len(os.listdir(self.incident_store.get_storage_path("radish"))), 15)
+
+        # finished units are skipped on the next run
+        report = self._reprocess()
+        self.assertEqual(report["totals"]["units"], 2)
+        self.assertEqual(report["totals"]["incidents"], 25)
+        self.assertEqual(report["incidents_per_second"], 0)
+
+    def test_bounded_batches(self):
+        with mock.patch("dataproxy.reprocess._store_new", wraps=reprocessing._store_new) as store_new:
+            report = self._reprocess(batch_size=4)
+        self.assertEqual(report["totals"]["new"], 15)
+        self.assertEqual(sum(len(call[0][1]) for call in store_new.call_args_list), 25)
+        self.assertLessEqual(max(len(call[0][1]) for call in store_new.call_args_list), 4)
+
+    def test_worker_processes(self):
+        report = self._reprocess(processes=2, batch_size=4)
+        self.assertEqual(report["totals"]["units"], 2)
+        self.assertEqual(report["totals"]["incidents"], 25)
+        self.assertEqual(report["totals"]["new"], 15)
+        self.assertEqual(len(list(self.storage.get_incidents())), 15)
+
+    def test_sqlite_stores_are_rejected(self):
+        from dataproxy import Config
+
+        self.addCleanup(Config.swap, Config.get_config())
+        data = Config.get_config()
+        data["stores"]["raw"]["backend"] = "sqlite"
+        data["stores"]["processed"]["backend"] = "sqlite"
+        Config.swap(data)
+        self.assertRaises(Exception, reprocess, "radish", "20190125", "20190131",
+                          checkpoint_file=os.path.join(self.folder, "checkpoint.json"))
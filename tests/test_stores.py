@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from .abstract import TestWithConfig
+
+from dataproxy.backends import FileBackend, SqliteBackend
+from dataproxy.stores import RawStore, FileStore, IncidentFileStore
+
+
+class TestStores(TestWithConfig):
+
+    def setUp(self):
+        super(TestStores, self).setUp()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        super(TestStores, self).tearDown()
+
+    def test_bytes(self):
+        content = "json={\"name\": \"Málaga\"}".encode("utf-8")
+
+        store = FileStore(os.path.join(self.folder, "processed", "{yearmonthdate}"))
+        name = store.save("radish", memoryview(content)[5:], file_ext=".json")
+        stream, stream_len = store.open("radish", name)
+        with stream:
+            self.assertEqual(stream.read(stream_len), content[5:])
+        store.save("radish", "Málaga", file_ext=".json", file_name="text")
+        stream, stream_len = store.open("radish", "text.json")
+        with stream:
+            self.assertEqual(stream.read(stream_len), "Málaga".encode("utf-8"))
+
+        store = RawStore(os.path.join(self.folder, "raw", "{yearmonthdate}"))
+        name, file_path = store.save("radish", content)
+        with open(os.path.join(file_path, name), "rb") as file:
+            self.assertEqual(file.read(), content)
+
+    def _test_backend(self, backend):
+        store = IncidentFileStore(backend=backend)
+        for day, name in [(1, "b"), (1, "a"), (2, "a"), (2, "c")]:
+            store.save("radish", "content " + name, file_ext=".json", file_name=name,
+                       folder_time=datetime(2019, 1, day, 12))
+        store.save("other", b"content", file_ext=".json", file_name="a", folder_time=datetime(2019, 1, 3, 12))
+        # kept, not overwritten
+        store.save("radish", "changed", file_ext=".json", file_name="a", folder_time=datetime(2019, 1, 1, 12))
+
+        self.assertTrue(store.exists("radish", ".json", "b", folder_time=datetime(2019, 1, 1, 12)))
+        self.assertFalse(store.exists("radish", ".json", "c", folder_time=datetime(2019, 1, 1, 12)))
+        self.assertTrue(store.folder_exists("other", folder_time=datetime(2019, 1, 3, 12)))
+        stream, stream_len = store.open("radish", "a.json", folder_time=datetime(2019, 1, 1, 12))
+        with stream:
+            self.assertEqual(stream.read(stream_len), b"content a")
+
+        self.assertEqual([(item.date, item.name) for item in store.iterate("radish")],
+                         [("20190101", "a.json"), ("20190101", "b.json"), ("20190102", "a.json"), ("20190102", "c.json")])
+        self.assertEqual([item.sub_folder for item in store.iterate(date_from="20190102")], ["radish", "radish", "other"])
+        latest = store.latest("radish")
+        self.assertEqual((latest.date, latest.name), ("20190102", "c.json"))
+        self.assertEqual(store.latest("other").date, "20190103")
+        self.assertIsNone(store.latest("unknown"))
+
+    def test_file_backend(self):
+        self._test_backend(FileBackend(os.path.join(self.folder, "incidents", "{yearmonthdate}")))
+
+    def test_sqlite_backend(self):
+        self._test_backend(SqliteBackend(os.path.join(self.folder, "incidents.sqlite")))
+
+    def test_sqlite_retention(self):
+        from dataproxy.archiver import Archiver
+
+        backend = SqliteBackend(os.path.join(self.folder, "raw.sqlite"))
+        store = RawStore(backend=backend)
+        self.assertRaises(Exception, store.get_storage_path, "radish")
+        for date in ["20190101", "20190102", "20190103"]:
+            backend.save(date, "radish", "push.raw", b"content")
+
+        # the archiver prunes stores that it can not archive
+        self.assertIsNone(store.hand_over_archiving())
+        archiver = Archiver([], clock=lambda: datetime(2019, 1, 4, 12).timestamp(), retention=[(store, 2)])
+        archiver.execute()
+        self.assertEqual([item.date for item in backend.iterate()], ["20190102", "20190103"])
+        # date folders of the file backend are archived instead
+        self.assertEqual(FileStore(backend=FileBackend(os.path.join(self.folder, "{yearmonthdate}"))).prune("20190104"), 0)
@@ -0,0 +1,73 @@
+import time
+import threading
+
+from .abstract import TestWithConfig
+
+from dataproxy.provider.wrapper_service import PollerScheduler
+
+
+class TestPollerScheduler(TestWithConfig):
+
+    def test_fixed_rate(self):
+        scheduler = PollerScheduler()
+        poller = scheduler.add("fixed_rate", lambda: time.sleep(0.03), 0.05)
+        scheduler.start()
+        time.sleep(0.52)
+        scheduler.stop()
+
+        # with sleeping after each execution it would be 6 runs
+        self.assertGreaterEqual(poller.stats.runs, 9)
+        self.assertEqual(poller.stats.overruns, 0)
+        self.assertTrue(poller.stats.max_duration >= 0.03)
+
+    def test_overrun(self):
+        active = []
+        concurrent = []
+        lock = threading.Lock()
+
+        def slow():
+            with lock:
+                active.append(1)
+                concurrent.append(len(active))
+            time.sleep(0.12)
+            with lock:
+                active.pop()
+
+        scheduler = PollerScheduler()
+        slow_poller = scheduler.add("slow", slow, 0.05)
+        fast_poller = scheduler.add("fast", lambda: None, 0.05)
+        scheduler.start()
+        time.sleep(0.5)
+        scheduler.stop()
+
+        self.assertEqual(max(concurrent), 1)
+        self.assertGreater(slow_poller.stats.overruns, 0)
+        # runs back to back after an overrun
+        self.assertGreaterEqual(slow_poller.stats.runs, 3)
+        # other pollers are not delayed
+        self.assertGreaterEqual(fast_poller.stats.runs, 8)
+
+    def test_failure_skips_next_tick(self):
+        calls = []
+
+        def failing():
+            calls.append(time.monotonic())
+            raise Exception("failed")
+
+        scheduler = PollerScheduler()
+        poller = scheduler.add("failing", failing, 0.1)
+        scheduler.start()
+        time.sleep(0.45)
+        self.assertTrue(poller.is_alive())
+        scheduler.stop()
+
+        self.assertEqual(poller.stats.failures, len(calls))
+        self.assertLessEqual(len(calls), 3)
+        self.assertFalse(poller.is_alive())
+
+    def test_jitter(self):
+        scheduler = PollerScheduler(clock=lambda: 100.0, jitter_source=lambda: 0.5)
+        scheduler.add("jittered", lambda: None, 10, jitter=2.0)
+        scheduler.add("exact", lambda: None, 10)
+
+        self.assertEqual(sorted((due, tick) for due, unused, tick, unused in scheduler._queue), [(100.0, 100.0), (101.0, 100.0)])